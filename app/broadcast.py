@@ -0,0 +1,255 @@
+import os
+import json
+import uuid
+import socket
+import asyncio
+import logging
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# このプロセスの識別子（自分が発行したメッセージかどうかの判定用）
+WORKER_ID = str(uuid.uuid4())
+
+# on_message(message, from_self)
+MessageHandler = Callable[[dict, bool], None]
+
+
+class BroadcastBackend(ABC):
+    """ワーカー間で避難所更新を配るための中継（各ワーカーのハブが購読する）"""
+
+    @abstractmethod
+    async def start(self, on_message: MessageHandler) -> None:
+        ...
+
+    @abstractmethod
+    async def publish(self, message: dict) -> None:
+        ...
+
+    async def stop(self) -> None:
+        pass
+
+
+class InProcessBroadcast(BroadcastBackend):
+    """単一プロセス用（既定）。発行したメッセージをそのまま自プロセスへ渡す"""
+
+    def __init__(self):
+        self._on_message: Optional[MessageHandler] = None
+
+    async def start(self, on_message: MessageHandler) -> None:
+        self._on_message = on_message
+
+    async def publish(self, message: dict) -> None:
+        if self._on_message is not None:
+            self._on_message(message, True)
+
+
+class PostgresBroadcast(BroadcastBackend):
+    """PostgreSQLのLISTEN/NOTIFYで全ワーカー（全レプリカ）へ配る
+
+    自プロセスのクライアントへは publish() で直接渡す（LISTEN接続の再接続中やNOTIFYの失敗でも届くように）。
+    自分が発行した通知は受信側で無視する。
+    """
+
+    # NOTIFYのペイロード上限は8000バイト
+    MAX_PAYLOAD = 7900
+
+    def __init__(self, engine, channel: str = "shelter_updates", reconnect_delay: float = 5.0):
+        self.engine = engine
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._on_message: Optional[MessageHandler] = None
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    async def start(self, on_message: MessageHandler) -> None:
+        self._on_message = on_message
+        self._loop = asyncio.get_running_loop()
+        await self._listen()
+
+    async def _listen(self) -> None:
+        try:
+            raw = await run_in_threadpool(self.engine.raw_connection)
+            raw.detach()  # LISTEN用の専用接続としてプールから切り離す
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {self.channel}")
+            self._conn = conn
+            self._loop.add_reader(conn.fileno(), self._on_readable)
+            logger.info("Listening for broadcasts on PostgreSQL channel: %s", self.channel)
+        except Exception as e:
+            logger.error("Failed to start PostgreSQL LISTEN: %s", str(e))
+            self._schedule_reconnect()
+
+    def _on_readable(self) -> None:
+        try:
+            self._conn.poll()
+        except Exception as e:
+            logger.error("PostgreSQL LISTEN connection lost: %s", str(e))
+            self._drop_connection()
+            self._schedule_reconnect()
+            return
+        while self._conn.notifies:
+            notify = self._conn.notifies.pop(0)
+            try:
+                envelope = json.loads(notify.payload)
+                if envelope.get("origin") == WORKER_ID:
+                    continue  # publish() で配信済み
+                self._on_message(envelope["data"], False)
+            except Exception as e:
+                logger.error("Invalid broadcast payload: %s", str(e))
+
+    def _drop_connection(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._loop.remove_reader(self._conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _schedule_reconnect(self) -> None:
+        if self._stopped or (self._reconnect_task and not self._reconnect_task.done()):
+            return
+
+        async def reconnect():
+            await asyncio.sleep(self.reconnect_delay)
+            await self._listen()
+
+        self._reconnect_task = self._loop.create_task(reconnect())
+
+    async def publish(self, message: dict) -> None:
+        payload = json.dumps({"origin": WORKER_ID, "data": message}, ensure_ascii=False, default=str)
+        if len(payload.encode("utf-8")) > self.MAX_PAYLOAD:
+            logger.warning("Broadcast payload too large (%d bytes), sending resync notice", len(payload))
+            payload = json.dumps({"origin": WORKER_ID, "data": {"action": "resync"}})
+        # on_message はメッセージを書き換えるため、ペイロードを作ってから渡す
+        if self._on_message is not None:
+            self._on_message(message, True)
+
+        def notify():
+            with self.engine.begin() as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": payload})
+
+        await run_in_threadpool(notify)
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        self._drop_connection()
+
+
+class LocalSocketBroadcast(BroadcastBackend):
+    """同じホスト上のワーカー間でUNIXドメインソケット（データグラム）を使って配る
+
+    各ワーカーが共有ディレクトリに自分のソケットを作り、発行時はディレクトリ内の全ソケット（自分を含む）へ送る。
+    外部サービスなしで複数ワーカーを動かす場合に使う（別ホストのレプリカには届かない）。
+    """
+
+    # 1データグラムの上限（超える場合は再同期の通知に置き換える）
+    MAX_PAYLOAD = 60000
+
+    def __init__(self, directory: str, worker_id: str = WORKER_ID):
+        self.directory = directory
+        self.worker_id = worker_id
+        self.path = os.path.join(directory, f"{worker_id}.sock")
+        self._on_message: Optional[MessageHandler] = None
+        self._sock: Optional[socket.socket] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self, on_message: MessageHandler) -> None:
+        self._on_message = on_message
+        self._loop = asyncio.get_running_loop()
+        os.makedirs(self.directory, exist_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.path)
+        sock.setblocking(False)
+        self._sock = sock
+        self._loop.add_reader(sock.fileno(), self._on_readable)
+        logger.info("Listening for broadcasts on local socket: %s", self.path)
+
+    def _on_readable(self) -> None:
+        while True:
+            try:
+                payload = self._sock.recv(self.MAX_PAYLOAD + 1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error("Local broadcast socket error: %s", str(e))
+                return
+            try:
+                envelope = json.loads(payload)
+                self._on_message(envelope["data"], envelope.get("origin") == self.worker_id)
+            except Exception as e:
+                logger.error("Invalid broadcast payload: %s", str(e))
+
+    def _peers(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.endswith(".sock")]
+
+    async def publish(self, message: dict) -> None:
+        payload = json.dumps({"origin": self.worker_id, "data": message}, ensure_ascii=False, default=str).encode("utf-8")
+        if len(payload) > self.MAX_PAYLOAD:
+            logger.warning("Broadcast payload too large (%d bytes), sending resync notice", len(payload))
+            payload = json.dumps({"origin": self.worker_id, "data": {"action": "resync"}}).encode("utf-8")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for peer in self._peers():
+                try:
+                    sender.sendto(payload, peer)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # 終了したワーカーのソケットが残っている
+                    if peer != self.path:
+                        self._remove_stale(peer)
+                except BlockingIOError:
+                    logger.warning("Broadcast dropped, receiver queue is full: %s", peer)
+                except OSError as e:
+                    logger.error("Failed to send broadcast to %s: %s", peer, str(e))
+
+    @staticmethod
+    def _remove_stale(path: str) -> None:
+        try:
+            os.remove(path)
+            logger.info("Removed stale broadcast socket: %s", path)
+        except OSError:
+            pass
+
+    async def stop(self) -> None:
+        if self._sock is None:
+            return
+        try:
+            self._loop.remove_reader(self._sock.fileno())
+        except Exception:
+            pass
+        self._sock.close()
+        self._sock = None
+        self._remove_stale(self.path)
+
+
+def create_broadcast(engine) -> BroadcastBackend:
+    backend = os.getenv("BROADCAST_BACKEND", "auto")
+    if backend == "auto":
+        backend = "postgres" if engine.dialect.name == "postgresql" else "memory"
+    logger.info("Broadcast backend: %s", backend)
+    if backend == "postgres":
+        return PostgresBroadcast(engine, channel=os.getenv("BROADCAST_CHANNEL", "shelter_updates"))
+    if backend == "socket":
+        default_dir = os.path.join(tempfile.gettempdir(), "safeshelter-broadcast")
+        return LocalSocketBroadcast(os.getenv("BROADCAST_SOCKET_DIR", default_dir))
+    return InProcessBroadcast()
@@ -0,0 +1,145 @@
+import logging
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotliは任意（無ければgzipのみ）
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 圧縮する Content-Type（画像などの圧縮済み形式は対象外）
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type == "text/event-stream":
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Accept-Encoding のうち q=0 でないもの"""
+    accepted = set()
+    for token in accept_encoding.split(","):
+        name, _, params = token.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        if params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name)
+    return accepted
+
+
+class _Encoder:
+    """1レスポンス分の圧縮器（flush() はストリーミング時にチャンクごとに呼ぶ）"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, *, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _CompressingSend:
+    """send をラップして本文を圧縮する（Starletteの内部クラスには依存しない）"""
+
+    def __init__(self, send: Send, encoder: _Encoder, minimum_size: int):
+        self.send = send
+        self.encoder = encoder
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.passthrough = False
+        self.streaming = False
+
+    async def __call__(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            # 圧縮済み・対象外の形式はそのまま流す
+            self.passthrough = "content-encoding" in headers or not is_compressible(headers.get("content-type", ""))
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start = message
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.streaming:
+            start, self.start = self.start, None
+            if not more_body and len(body) < self.minimum_size:
+                await self.send(start)
+                await self.send(message)
+                self.passthrough = True
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = self.encoder.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                # 長さが分からないため Content-Length を外してチャンクごとに送る
+                del headers["Content-Length"]
+                self.streaming = True
+            else:
+                body = self.encoder.compress(body, final=True)
+                headers["Content-Length"] = str(len(body))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            await self.send(start)
+        await self.send({
+            "type": "http.response.body",
+            "body": self.encoder.compress(body, final=not more_body),
+            "more_body": more_body,
+        })
+
+
+class CompressionMiddleware:
+    """JSON/HTML/JS/CSSなどのレスポンスをAccept-Encodingに応じてbrotli（あれば）またはgzipで圧縮する
+
+    既にContent-Encodingが付いているもの（事前圧縮した一覧・静的ファイル）とminimum_size未満はそのまま返す。
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if brotli is not None and "br" in accepted:
+            encoding = "br"
+        elif "gzip" in accepted:
+            encoding = "gzip"
+        else:
+            await self.app(scope, receive, send)
+            return
+        encoder = _Encoder(encoding, self.gzip_level, self.brotli_quality)
+        await self.app(scope, receive, _CompressingSend(send, encoder, self.minimum_size))
@@ -1,8 +1,9 @@
 import os
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import MetaData, create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
 
 # ロギング設定
 logging.basicConfig(
@@ -42,6 +43,49 @@ SessionLocal = sessionmaker(
 
 Base = declarative_base()
 
+# SQLiteはNOT NULLを外せないため、モデルの定義で作り直して行を移す（作成→コピー→削除→リネーム）
+# インデックスはリネーム後に upgrade_schema の最後で作り直す
+def _rebuild_sqlite_table(conn, table, quote):
+    metadata = MetaData()
+    for other in Base.metadata.sorted_tables:
+        if other is not table:
+            other.to_metadata(metadata)
+    new_table = table.to_metadata(metadata, name=f"{table.name}__new")
+    columns = ", ".join(quote(column.name) for column in table.columns)
+    conn.execute(CreateTable(new_table))
+    conn.execute(text(f"INSERT INTO {quote(new_table.name)} ({columns}) SELECT {columns} FROM {quote(table.name)}"))
+    conn.execute(text(f"DROP TABLE {quote(table.name)}"))
+    conn.execute(text(f"ALTER TABLE {quote(new_table.name)} RENAME TO {quote(table.name)}"))
+    logger.info("Rebuilt table %s to match the model", table.name)
+
+# 既存テーブルへのスキーマ追随（create_allは既存テーブルを変更しないため）
+def upgrade_schema(bind):
+    inspector = inspect(bind)
+    quote = bind.dialect.identifier_preparer.quote
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"]: c for c in inspector.get_columns(table.name)}
+            rebuild = False
+            for column in table.columns:
+                current = existing.get(column.name)
+                if current is None:
+                    col_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {col_type}"))
+                    logger.info("Added column %s.%s", table.name, column.name)
+                elif column.nullable and not current["nullable"] and not column.primary_key:
+                    if bind.dialect.name == "postgresql":
+                        conn.execute(text(f"ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(column.name)} DROP NOT NULL"))
+                        logger.info("Dropped NOT NULL on %s.%s", table.name, column.name)
+                    else:
+                        rebuild = True
+            if rebuild:
+                _rebuild_sqlite_table(conn, table, quote)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
 # 同期依存性
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,112 @@
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[int, int]
+
+
+class ReverseGeocodeCache:
+    """逆ジオコーディング結果のキャッシュ（緯度経度を格子に丸めて共有する）
+
+    grid_deg=0.01 で約1km四方。期限切れ・上限超過のものは古い順に捨て、
+    同じ格子への同時の問い合わせは1回の取得を待ち合わせる。
+    """
+
+    def __init__(self, grid_deg: float = 0.01, ttl_seconds: float = 86400.0, max_entries: int = 10000):
+        self.grid_deg = grid_deg
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Key, Tuple[float, dict]]" = OrderedDict()
+        self._inflight: Dict[Key, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, lat: float, lon: float) -> Key:
+        return int(math.floor(lat / self.grid_deg)), int(math.floor(lon / self.grid_deg))
+
+    def center(self, key: Key) -> Tuple[float, float]:
+        # 同じ格子の問い合わせは同じ地点で引く（結果が問い合わせ順に左右されないように）
+        return (
+            round((key[0] + 0.5) * self.grid_deg, 6),
+            round((key[1] + 0.5) * self.grid_deg, 6),
+        )
+
+    def _lookup(self, key: Key) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key: Key, value: dict) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, lat: float, lon: float, fetch: Callable[[float, float], Awaitable[dict]]) -> dict:
+        """キャッシュになければ fetch(格子の中心の緯度, 経度) で取得する。失敗はキャッシュしない"""
+        key = self.key(lat, lon)
+        value = self._lookup(key)
+        if value is not None:
+            self.hits += 1
+            return dict(value)
+
+        # 取得は独立したタスクで行い、各リクエストは shield して待つ（先頭のリクエストが切断されても他は失敗しない）
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            # 待ち合わせがいない場合に "exception was never retrieved" を出さない
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        return dict(await asyncio.shield(task))
+
+    async def _fetch(self, key: Key, fetch: Callable[[float, float], Awaitable[dict]]) -> dict:
+        try:
+            value = await fetch(*self.center(key))
+        except Exception:
+            self.errors += 1
+            raise
+        else:
+            self._store(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "grid_deg": self.grid_deg,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else None,
+            "inflight": len(self._inflight),
+        }
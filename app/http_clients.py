@@ -0,0 +1,162 @@
+import os
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401  httpx[http2]
+    HTTP2_AVAILABLE = True
+except ImportError:  # h2が無ければHTTP/1.1のkeep-aliveのみ
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# レイテンシのパーセンタイル計算に使う直近のサンプル数
+LATENCY_SAMPLES = 200
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class UpstreamStats:
+    """上流ごとのリクエスト数・エラー・レイテンシ（レスポンスヘッダ受信まで）
+
+    errors は例外（接続失敗・タイムアウトなど）と5xx応答の数。4xxは status にだけ数える。
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.status: Dict[str, int] = {}
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._recent: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, seconds: float, status_code: Optional[int] = None, error: Optional[Exception] = None) -> None:
+        self.requests += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self._recent.append(seconds)
+        if error is not None:
+            self.errors += 1
+            if isinstance(error, httpx.TimeoutException):
+                self.timeouts += 1
+        elif status_code is not None and status_code >= 500:
+            self.errors += 1
+        if status_code is not None:
+            key = f"{status_code // 100}xx"
+            self.status[key] = self.status.get(key, 0) + 1
+
+    def _percentile(self, samples: list, q: float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def to_dict(self) -> dict:
+        samples = sorted(self._recent)
+        latency = None
+        if samples:
+            latency = {
+                "avg_ms": round(self.total_seconds / self.requests * 1000, 1),
+                "p50_ms": round(self._percentile(samples, 0.5) * 1000, 1),
+                "p95_ms": round(self._percentile(samples, 0.95) * 1000, 1),
+                "max_ms": round(self.max_seconds * 1000, 1),
+            }
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "status": self.status,
+            "latency": latency,
+        }
+
+
+class _MeteredTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, stats: UpstreamStats):
+        self._transport = transport
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as e:
+            self._stats.record(time.perf_counter() - started, error=e)
+            raise
+        self._stats.record(time.perf_counter() - started, status_code=response.status_code)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class HttpClientRegistry:
+    """上流（Geoapify・国土地理院・気象庁など）ごとに1つの AsyncClient を共有する
+
+    接続はプールして使い回し（HTTP/2が使えれば多重化）、上流ごとに同時接続数を制限する。
+    タイムアウトと接続数は HTTP_<NAME>_TIMEOUT / HTTP_<NAME>_MAX_CONNECTIONS で上書きできる。
+    """
+
+    def __init__(self, timeout: float = 10.0, max_connections: int = 20, max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30.0, http2: bool = True):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, UpstreamStats] = {}
+
+    def register(self, name: str, timeout: Optional[float] = None, connect_timeout: Optional[float] = None,
+                 max_connections: Optional[int] = None, headers: Optional[dict] = None,
+                 http2: Optional[bool] = None) -> httpx.AsyncClient:
+        if name in self._clients:
+            return self._clients[name]
+        prefix = f"HTTP_{name.upper()}_"
+        timeout = _env_float(prefix + "TIMEOUT", timeout if timeout is not None else self.timeout)
+        connect_timeout = _env_float(prefix + "CONNECT_TIMEOUT", connect_timeout if connect_timeout is not None else min(5.0, timeout))
+        max_connections = _env_int(prefix + "MAX_CONNECTIONS", max_connections or self.max_connections)
+        use_http2 = self.http2 if http2 is None else (http2 and HTTP2_AVAILABLE)
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(self.max_keepalive_connections, max_connections),
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        stats = UpstreamStats()
+        transport = _MeteredTransport(httpx.AsyncHTTPTransport(limits=limits, http2=use_http2, retries=1), stats)
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            headers=headers,
+        )
+        self._clients[name] = client
+        self._stats[name] = stats
+        logger.info("HTTP client registered: %s (timeout=%ss, max_connections=%d, http2=%s)", name, timeout, max_connections, use_http2)
+        return client
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """登録済みでなければ既定の設定で作る"""
+        return self._clients.get(name) or self.register(name)
+
+    def metrics(self) -> dict:
+        return {
+            "http2": self.http2,
+            "upstreams": {name: stats.to_dict() for name, stats in self._stats.items()},
+        }
+
+    async def aclose(self) -> None:
+        for name, client in self._clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning("Failed to close HTTP client %s: %s", name, str(e))
+        self._clients.clear()
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from warning_index import OfficeWarnings, WarningIndex
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ALERTS_CACHE_PATH = os.path.join(BASE_DIR, "data", "alerts_cache.json")
+
+JMA_WARNING_URL = "https://www.jma.go.jp/bosai/warning/data/warning/{code}.json"
+
+
+class FeedEntry:
+    """取得済みのフィード（本文と、条件付きGET用のETag/Last-Modified）"""
+
+    __slots__ = ("data", "etag", "last_modified", "fetched_at", "checked_at")
+
+    def __init__(self, data, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 fetched_at: Optional[float] = None, checked_at: Optional[float] = None):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        # fetched_at: 内容が変わった（200を受けた）時刻、checked_at: 最後に上流に確認した時刻（いずれもUNIX時刻）
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.checked_at = checked_at if checked_at is not None else self.fetched_at
+
+    def to_dict(self) -> dict:
+        return {
+            "data": self.data,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "fetched_at": self.fetched_at,
+            "checked_at": self.checked_at,
+        }
+
+    @classmethod
+    def from_dict(cls, value: dict) -> "FeedEntry":
+        return cls(value["data"], value.get("etag"), value.get("last_modified"), value.get("fetched_at"), value.get("checked_at"))
+
+
+async def conditional_get(client: httpx.AsyncClient, url: str, entry: Optional[FeedEntry] = None,
+                          headers: Optional[dict] = None) -> Optional[httpx.Response]:
+    """前回のETag/Last-Modifiedを付けてGETする。変化なし（304）ならNone"""
+    request_headers = dict(headers or {})
+    if entry is not None:
+        if entry.etag:
+            request_headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            request_headers["If-Modified-Since"] = entry.last_modified
+    res = await client.get(url, headers=request_headers)
+    if res.status_code == 304:
+        return None
+    res.raise_for_status()
+    return res
+
+
+class FeedPoller(ABC):
+    """一定間隔で poll() を呼ぶバックグラウンドタスク（失敗しても次の周期で再試行する）"""
+
+    name = "feed"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def poll(self) -> None:
+        """1周期分の取得・取り込み"""
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error("JMA %s poll failed: %s", self.name, str(e))
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class WarningFeedPoller(FeedPoller):
+    """気象庁の警報・注意報（府県予報区ごと）を定期取得し、メモリとファイルに保持する
+
+    利用者ごとに上流へ取りに行かず、APIはこのキャッシュから答える。
+    取得した文書は取り込み時に WarningIndex へ展開しておき、リクエスト時には走査しない。
+    ファイル（alerts_cache.json）は再起動直後のウォームスタート用。
+    """
+
+    name = "warning"
+
+    def __init__(self, client: httpx.AsyncClient, office_codes: Iterable[str], interval: float = 120.0,
+                 stale_after: float = 600.0, concurrency: int = 8, cache_path: Optional[str] = DEFAULT_ALERTS_CACHE_PATH):
+        super().__init__(interval)
+        self.client = client
+        self.office_codes = list(dict.fromkeys(office_codes))
+        # これより古い（ポーリングが失敗し続けている）場合は、リクエスト時に取り直しを試みる
+        self.stale_after = stale_after
+        self.cache_path = cache_path
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._entries: Dict[str, FeedEntry] = {}
+        self.index = WarningIndex()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.polls = 0
+        self.fetches = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.last_poll_at: Optional[float] = None
+
+    def load_cache(self) -> int:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return 0
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                stored = json.load(f)
+            entries = {code: FeedEntry.from_dict(value) for code, value in stored.get("offices", {}).items()}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring unreadable alerts cache %s: %s", self.cache_path, str(e))
+            return 0
+        for code, entry in entries.items():
+            if code in self._entries:
+                continue
+            self._entries[code] = entry
+            self.index.update(code, entry.data)
+        logger.info("Loaded %d warning feeds from %s", len(entries), self.cache_path)
+        return len(entries)
+
+    def _write_cache(self, snapshot: dict) -> None:
+        # ワーカーごとに別の一時ファイルに書いてからリネームする（同じ一時ファイルを取り合わない）
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path) or ".", prefix=".alerts-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.cache_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def save_cache(self) -> None:
+        if not self.cache_path:
+            return
+        snapshot = {"offices": {code: entry.to_dict() for code, entry in self._entries.items()}}
+        try:
+            await run_in_threadpool(self._write_cache, snapshot)
+        except OSError as e:
+            logger.warning("Failed to write alerts cache %s: %s", self.cache_path, str(e))
+
+    async def _fetch(self, code: str) -> bool:
+        """1府県分を条件付きGETで更新する。内容が変わったらTrue"""
+        entry = self._entries.get(code)
+        async with self._semaphore:
+            res = await conditional_get(self.client, JMA_WARNING_URL.format(code=code), entry)
+        now = time.time()
+        if res is None:
+            self.not_modified += 1
+            entry.checked_at = now
+            return False
+        self.fetches += 1
+        data = res.json()
+        self.index.update(code, data)
+        self._entries[code] = FeedEntry(
+            data,
+            etag=res.headers.get("etag"),
+            last_modified=res.headers.get("last-modified"),
+            fetched_at=now,
+        )
+        return True
+
+    async def refresh(self, code: str) -> bool:
+        # 同じ府県への同時の取り直しは1回にまとめる
+        task = self._inflight.get(code)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(code))
+            self._inflight[code] = task
+            task.add_done_callback(lambda _: self._inflight.pop(code, None))
+            # 待っていたリクエストが切断済みでも "exception was never retrieved" を出さない
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def refresh_all(self) -> int:
+        results = await asyncio.gather(*(self.refresh(code) for code in self.office_codes), return_exceptions=True)
+        changed = 0
+        for code, result in zip(self.office_codes, results):
+            if isinstance(result, Exception):
+                self.errors += 1
+                logger.warning("Failed to refresh JMA warnings for %s: %s", code, str(result))
+            elif result:
+                changed += 1
+        self.polls += 1
+        self.last_poll_at = time.time()
+        if changed:
+            await self.save_cache()
+        logger.info("JMA warnings polled: %d offices, %d changed", len(self.office_codes), changed)
+        return changed
+
+    async def poll(self) -> None:
+        await self.refresh_all()
+
+    def start(self) -> None:
+        self.load_cache()
+        super().start()
+
+    async def stop(self) -> None:
+        await super().stop()
+        # リクエスト時の取り直しはポーリングとは別のタスクなので、閉じたクライアントを使う前に止める
+        tasks = list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._inflight.clear()
+
+    async def get(self, code: str) -> OfficeWarnings:
+        """展開済みの警報・注意報。未取得または古すぎる場合だけ上流に取りに行く"""
+        entry = self._entries.get(code)
+        if entry is not None and time.time() - entry.checked_at <= self.stale_after:
+            return self.index.get(code)
+        try:
+            await self.refresh(code)
+        except (httpx.HTTPError, ValueError):
+            if entry is None:
+                raise
+            # 取得できなければ古いデータで答える
+            self.errors += 1
+            logger.warning("Serving stale JMA warnings for %s (checked %.0fs ago)", code, time.time() - entry.checked_at)
+        return self.index.get(code)
+
+    def metrics(self) -> dict:
+        now = time.time()
+        oldest = min((entry.checked_at for entry in self._entries.values()), default=None)
+        return {
+            "offices": len(self.office_codes),
+            "cached": len(self._entries),
+            "active_warnings": self.index.active_count(),
+            "interval": self.interval,
+            "polls": self.polls,
+            "fetches": self.fetches,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "last_poll_age_seconds": round(now - self.last_poll_at, 1) if self.last_poll_at else None,
+            "oldest_check_age_seconds": round(now - oldest, 1) if oldest else None,
+        }
@@ -4,12 +4,19 @@ import json
 import uuid
 import io
 import asyncio
+import time
 from starlette.websockets import WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
 import logging
 from fastapi.responses import JSONResponse
 from fastapi import APIRouter, Query
 import traceback
-from datetime import datetime, timedelta
+import hashlib
+import base64
+from email.utils import format_datetime
+from itertools import islice
+from urllib.parse import urlsplit
+from datetime import datetime, timedelta, timezone
 from fastapi import Body
 import schemas
 from fastapi import Request
@@ -27,17 +34,16 @@ from fastapi import (
     Query,
 )
 from fastapi import HTTPException
-import xmltodict
 from fastapi import Header
 import requests
 from fastapi.responses import HTMLResponse, Response, FileResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi import Query
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 from pydantic import ValidationError
 from fastapi import Query, HTTPException
@@ -45,7 +51,7 @@ from fastapi import FastAPI, HTTPException
 import httpx
 import xml.etree.ElementTree as ET
 logging.basicConfig(level=logging.DEBUG)
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from fastapi import APIRouter, HTTPException
 from fastapi import FastAPI, APIRouter, HTTPException
 from dotenv import load_dotenv
@@ -64,7 +70,7 @@ logger.info("Current working directory: %s", os.getcwd())
 logger.info("Python sys.path: %s", sys.path)
 
 # --- DB周り ---
-from database import SessionLocal, engine, Base, get_db
+from database import SessionLocal, engine, Base, get_db, upgrade_schema
 
 # --- ORMモデル ---
 from models import (
@@ -73,6 +79,7 @@ from models import (
     Company as CompanyModel,
     Photo as PhotoModel,
     ShelterPhoto as ShelterPhotoModel,
+    ShelterChange as ShelterChangeModel,
 )
 
 # --- Pydanticスキーマ ---
@@ -83,10 +90,61 @@ from schemas import (
     BulkUpdateRequest,
     CompanySchema,
     PhotoUploadResponse,
+    NearestShelter as NearestShelterSchema,
+    ShelterChanges as ShelterChangesSchema,
+    AlertQuery,
 )
 
 # --- 企業周りのRouter ---
 from utils import router as company_router
+
+# --- 空間インデックス ---
+from spatial import ShelterGridIndex, bounding_box
+
+# --- 写真ストレージ ---
+from photo_store import create_photo_store, PhotoTooLarge, UnsupportedPhotoType
+from photo_variants import (
+    VARIANT_MEDIA_TYPES,
+    VariantFailures,
+    negotiate_format,
+    render_variant,
+    resolve_width,
+    variant_name,
+    variants_available,
+)
+
+# --- シリアライズ ---
+from serializers import (
+    FastJSONResponse,
+    SHELTER_FIELDS,
+    SHELTER_FIELD_COLUMNS,
+    serialize_shelter_model,
+    serialize_shelter_rows,
+    shelter_columns,
+)
+
+# --- 圧縮・静的ファイル ---
+from compression import CompressionMiddleware
+from static_assets import StaticAssets
+
+# --- 上流HTTPクライアント ---
+from http_clients import HttpClientRegistry
+
+# --- 逆ジオコーディングのキャッシュ ---
+from geocode_cache import ReverseGeocodeCache
+from prefectures import PrefectureIndex
+
+# --- 気象庁フィード ---
+from jma_feeds import WarningFeedPoller
+from quake_feed import QuakeFeedPoller, QuakeHistory
+from tsunami_feed import TsunamiFeedPoller
+
+# --- 一覧スナップショット ---
+from shelter_snapshot import ShelterSnapshot
+
+# --- WebSocket配信 ---
+from ws_hub import ConnectionHub
+from broadcast import create_broadcast
 app = FastAPI()
 
 
@@ -136,9 +194,33 @@ STATIC_DIR = os.path.join(BASE_DIR, "static")
 DATA_DIR = os.path.join(BASE_DIR, "data")
 os.makedirs(STATIC_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+# ビルド済み（python static_assets.py build）ならハッシュ付き・事前圧縮版を配信
+static_assets = StaticAssets(directory=STATIC_DIR)
+app.mount("/static", static_assets, name="static")
 templates = Jinja2Templates(directory=TEMPLATE_DIR)
-connected_clients: Dict[str, WebSocket] = {}
+templates.env.globals["static_url"] = static_assets.url
+photo_store = create_photo_store()
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", str(10 * 1024 * 1024)))  # 1枚あたりの上限
+PHOTO_MAX_FILES = int(os.getenv("PHOTO_MAX_FILES", "20"))  # 一括アップロードの上限枚数
+PHOTO_DELETE_GRACE_SECONDS = float(os.getenv("PHOTO_DELETE_GRACE_SECONDS", "60"))  # 直近に使われたファイルの削除を見送る秒数
+pending_photo_removals = set()  # 猶予後に削除し直すタスク
+background_tasks = set()  # 起動時に開始した定期処理（シャットダウン時に止める）
+variant_failures = VariantFailures(ttl_seconds=float(os.getenv("PHOTO_VARIANT_FAILURE_TTL", "300")))  # 縮小版の生成失敗を覚えておく秒数
+
+# 変更フィード
+SHELTER_CHANGES_RETENTION_DAYS = int(os.getenv("SHELTER_CHANGES_RETENTION_DAYS", "30"))  # 変更履歴（削除の記録を含む）の保持日数
+CHANGE_FEED_SETTLE_SECONDS = int(os.getenv("CHANGE_FEED_SETTLE_SECONDS", "30"))  # 欠番をコミット待ちとみなす時間
+ALLOWED_PHOTO_TYPES = "JPEG, PNG, GIF, WebP"
+ws_hub = ConnectionHub(
+    queue_size=int(os.getenv("WS_QUEUE_SIZE", "100")),
+    heartbeat_interval=float(os.getenv("WS_HEARTBEAT_INTERVAL", "30")),
+    heartbeat_timeout=float(os.getenv("WS_HEARTBEAT_TIMEOUT", "90")),
+)
+# ワーカー間の更新配信（PostgreSQLならLISTEN/NOTIFY、それ以外はプロセス内。BROADCAST_BACKEND=socket で同一ホストのワーカー間）
+broadcaster = create_broadcast(engine)
+
+# レスポンス圧縮（JSON/HTMLなど、COMPRESSION_MIN_SIZEバイト以上）
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
 
 # CORS設定
 app.add_middleware(
@@ -155,8 +237,74 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # 認証方式
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/company-token")
 
-# HTTP クライアント
-http_client = httpx.AsyncClient(timeout=10.0)
+# HTTP クライアント（上流ごとに接続をプールして共有する。設定は HTTP_<NAME>_TIMEOUT などで上書き可）
+http_clients = HttpClientRegistry(
+    timeout=float(os.getenv("HTTP_TIMEOUT", "10")),
+    max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "20")),
+)
+http_clients.register("geoapify", max_connections=10)
+http_clients.register("gsi", max_connections=10)
+http_clients.register("jma", max_connections=8)  # www.jma.go.jp（警報・地震のJSON）
+http_clients.register("jma_xml", max_connections=4)  # www.data.jma.go.jp（XML電文）
+
+# /api/proxy で中継してよいホストと、使う上流のクライアント（ホストごとの接続数制限を共有する）
+PROXY_HOST_CLIENTS = {
+    "www.jma.go.jp": "jma",
+    "www.data.jma.go.jp": "jma_xml",
+}
+
+# 逆ジオコーディングのキャッシュ（Geoapifyは従量課金のため、近い地点の問い合わせを共有する）
+reverse_geocode_cache = ReverseGeocodeCache(
+    grid_deg=float(os.getenv("REVERSE_GEOCODE_GRID_DEG", "0.01")),  # 約1km
+    ttl_seconds=float(os.getenv("REVERSE_GEOCODE_TTL", "86400")),
+    max_entries=int(os.getenv("REVERSE_GEOCODE_CACHE_SIZE", "10000")),
+)
+
+# 緯度経度→都道府県（同梱の境界データ data/prefectures.json。判定できない地点はGeoapifyで補う）
+prefecture_index = PrefectureIndex.load()
+
+# 避難所の空間インデックス（半径検索用）
+shelter_index = ShelterGridIndex(ttl_seconds=float(os.getenv("SHELTER_INDEX_TTL", "60")))
+
+# 最寄り検索で1回のIN句に載せる候補数の上限
+NEAREST_MAX_BATCH = 4096
+# 一覧の半径検索で1回のIN句に載せるIDの数
+SHELTER_ID_BATCH = 500
+# 一覧の半径検索の上限（km）。広すぎる範囲は空間インデックスの走査が重くなる
+MAX_SEARCH_DISTANCE_KM = 500
+
+def refresh_shelter_index(db: Session):
+    if shelter_index.is_stale():
+        rows = db.query(ShelterModel.id, ShelterModel.latitude, ShelterModel.longitude).all()
+        shelter_index.rebuild(rows)
+
+# 公開用の避難所一覧（絞り込みなしの一覧・トップページ・変更フィードの全件応答で共有）
+shelter_snapshot = ShelterSnapshot(ttl_seconds=float(os.getenv("SHELTER_SNAPSHOT_TTL", "60")))
+
+def build_shelter_snapshot():
+    with SessionLocal() as db:
+        version = settled_shelter_version(db)
+        items = fetch_shelters(db, db.query(ShelterModel))
+    return items, version
+
+# 最新の変更番号と突き合わせたスナップショット（配信を経由しない書き込みもTTLを待たずに反映する）
+async def current_shelter_snapshot(db: Session):
+    latest = current_shelter_version(db)
+    return await run_in_threadpool(shelter_snapshot.get, build_shelter_snapshot, latest)
+
+def snapshot_response(request: Request, snapshot) -> Response:
+    headers = {
+        "ETag": snapshot.etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        "X-Shelter-Version": str(snapshot.version),
+    }
+    if etag_matches(request.headers.get("if-none-match"), snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    body, encoding = snapshot.encoded(request.headers.get("accept-encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
 
 async def get_current_user_optional(
     authorization: Optional[str] = Header(None),
@@ -184,6 +332,7 @@ async def on_startup():
     logger.info("Starting database initialization...")
     try:
         Base.metadata.create_all(bind=engine)
+        upgrade_schema(engine)
         with SessionLocal() as db:
             admin = db.query(CompanyModel).filter(CompanyModel.email == "admin@example.com").first()
             if not admin:
@@ -228,6 +377,14 @@ async def on_startup():
                 db.add(sample_shelter)
                 db.commit()
                 logger.info("Sample shelter inserted")
+
+            ensure_shelter_change_baseline(db)
+            refresh_shelter_index(db)
+        background_tasks.add(asyncio.create_task(prune_shelter_changes_periodically()))
+        warning_poller.start()
+        quake_poller.start()
+        tsunami_poller.start()
+        await broadcaster.start(handle_broadcast)
     except Exception as e:
         logger.error("Error during startup: %s\n%s", str(e), traceback.format_exc())
         raise
@@ -235,8 +392,15 @@ async def on_startup():
 # シャットダウンイベント
 @app.on_event("shutdown")
 async def on_shutdown():
-    await http_client.aclose()
-    logger.info("HTTP client closed")
+    for task in list(pending_photo_removals) + list(background_tasks):
+        task.cancel()
+    background_tasks.clear()
+    await broadcaster.stop()
+    await warning_poller.stop()
+    await quake_poller.stop()
+    await tsunami_poller.stop()
+    await http_clients.aclose()
+    logger.info("HTTP clients closed")
 
 # 企業登録／一覧 用 API をマウント
 app.include_router(company_router)
@@ -315,21 +479,195 @@ def log_action(db: Session, action: str, shelter_id: Optional[int] = None, user:
         logger.error("Error logging action: %s\n%s", str(e), traceback.format_exc())
         db.rollback()
 
-# WebSocketブロードキャスト
-async def broadcast_shelter_update(data: dict):
-    logger.info("Broadcasting update: %s", data)
-    disconnected = []
-    for client_id, ws in connected_clients.items():
+# 避難所一覧をAPIの形で取得（必要な列だけをSELECTし、写真は1クエリで一括取得してN+1を避ける）
+def fetch_shelters(db: Session, query, fields: List[str] = SHELTER_FIELDS) -> List[dict]:
+    rows = query.with_entities(*shelter_columns(fields)).all()
+    if not rows:
+        return []
+    photos_by_shelter: Dict[int, List[str]] = {}
+    if "photos" in fields:
+        id_subquery = query.with_entities(ShelterModel.id).order_by(None).subquery()
+        photo_rows = (
+            db.query(ShelterPhotoModel.shelter_id, ShelterPhotoModel.photo_id)
+            .filter(ShelterPhotoModel.shelter_id.in_(select(id_subquery.c.id)))
+            .order_by(ShelterPhotoModel.created_at, ShelterPhotoModel.photo_id)
+            .all()
+        )
+        for shelter_id, photo_id in photo_rows:
+            photos_by_shelter.setdefault(shelter_id, []).append(f"/api/photos/{photo_id}")
+    return serialize_shelter_rows(rows, fields, photos_by_shelter)
+
+# 写真URLを避難所IDごとにまとめて取得
+def photo_urls_by_shelter(db: Session, shelter_ids: List[int]) -> Dict[int, List[str]]:
+    if not shelter_ids:
+        return {}
+    rows = (
+        db.query(ShelterPhotoModel.shelter_id, ShelterPhotoModel.photo_id)
+        .filter(ShelterPhotoModel.shelter_id.in_(shelter_ids))
+        .order_by(ShelterPhotoModel.created_at, ShelterPhotoModel.photo_id)
+        .all()
+    )
+    photos_by_shelter: Dict[int, List[str]] = {}
+    for shelter_id, photo_id in rows:
+        photos_by_shelter.setdefault(shelter_id, []).append(f"/api/photos/{photo_id}")
+    return photos_by_shelter
+
+# fields= の指定を検証
+def parse_shelter_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(SHELTER_FIELDS)
+    selected = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in SHELTER_FIELD_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"不明な項目です: {', '.join(unknown)}")
+    # カーソル生成のためidは常に含める
+    return ["id"] + [name for name in dict.fromkeys(selected) if name != "id"]
+
+# ページングカーソル（中身はクライアントに意味を持たせない）
+def encode_cursor(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(data, dict) or not isinstance(data.get("id"), int):
+            raise ValueError(cursor)
+        return data
+    except Exception:
+        raise HTTPException(status_code=400, detail="不正なカーソルです")
+
+# 1件の避難所の写真URL（shelter_photosのphoto_idのみ参照）
+def shelter_photo_urls(db: Session, shelter_id: int) -> List[str]:
+    rows = (
+        db.query(ShelterPhotoModel.photo_id)
+        .filter(ShelterPhotoModel.shelter_id == shelter_id)
+        .order_by(ShelterPhotoModel.created_at, ShelterPhotoModel.photo_id)
+        .all()
+    )
+    return [f"/api/photos/{photo_id}" for (photo_id,) in rows]
+
+# 更新前後の差分（attributesは変わったキーのみ）
+def shelter_delta(before: dict, after: dict) -> dict:
+    changes = {}
+    for key, value in after.items():
+        if key == "attributes":
+            attributes = {k: v for k, v in value.items() if before["attributes"].get(k) != v}
+            if attributes:
+                changes["attributes"] = attributes
+        elif before.get(key) != value:
+            changes[key] = value
+    return changes
+
+# 変更履歴に記録し、版数（最大の変更番号）を返す。コミット前に呼び、変更と同じトランザクションで確定させる
+def record_shelter_changes(db: Session, action: str, shelter_ids: List[int]) -> int:
+    now = datetime.utcnow()
+    changes = [ShelterChangeModel(shelter_id=shelter_id, action=action, changed_at=now) for shelter_id in shelter_ids]
+    db.add_all(changes)
+    db.flush()
+    return max(change.id for change in changes)
+
+def current_shelter_version(db: Session) -> int:
+    return db.query(func.max(ShelterChangeModel.id)).scalar() or 0
+
+# 全件応答と一緒に返す版数。差分APIと同じく、直近の欠番（コミット待ちの可能性）の手前で止める
+# （最大の番号を返すと、後からコミットされた小さい番号の変更をクライアントが取りこぼす）
+def settled_shelter_version(db: Session) -> int:
+    settle_before = datetime.utcnow() - timedelta(seconds=CHANGE_FEED_SETTLE_SECONDS)
+    base = db.query(func.max(ShelterChangeModel.id)).filter(ShelterChangeModel.changed_at <= settle_before).scalar()
+    recent = [
+        change_id for (change_id,) in
+        db.query(ShelterChangeModel.id).filter(ShelterChangeModel.id > (base or 0)).order_by(ShelterChangeModel.id)
+    ]
+    if base is None:
+        base = recent[0] - 1 if recent else 0
+    cursor = base
+    for change_id in recent:
+        if change_id != cursor + 1:
+            break
+        cursor = change_id
+    return cursor
+
+# 変更履歴が空なら起点の行を入れておく（版数0のままだと、クライアントが毎回全件を取り直すことになる）
+def ensure_shelter_change_baseline(db: Session):
+    if db.query(ShelterChangeModel.id).first() is None:
+        db.add(ShelterChangeModel(shelter_id=0, action="init", changed_at=datetime.utcnow()))
+        db.commit()
+        logger.info("Shelter change feed initialized")
+
+# 保持期間を過ぎた変更履歴を削除（それより古いsinceで問い合わせたクライアントには全件を返す）
+# 最新の1行は残し、番号が振り直されないようにする
+def prune_shelter_changes(db: Session):
+    cutoff = datetime.utcnow() - timedelta(days=SHELTER_CHANGES_RETENTION_DAYS)
+    latest = current_shelter_version(db)
+    deleted = (
+        db.query(ShelterChangeModel)
+        .filter(ShelterChangeModel.changed_at < cutoff, ShelterChangeModel.id < latest)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    if deleted:
+        logger.info("Pruned %d shelter changes older than %s", deleted, cutoff)
+
+async def prune_shelter_changes_periodically(interval: float = 24 * 60 * 60):
+    while True:
         try:
-            await ws.send_json(data)
-            logger.debug("Sent to %s", client_id)
+            with SessionLocal() as db:
+                await run_in_threadpool(prune_shelter_changes, db)
         except Exception as e:
-            logger.error("Broadcast error to %s: %s", client_id, str(e))
-            disconnected.append(client_id)
-    for client_id in disconnected:
-        if client_id in connected_clients:
-            del connected_clients[client_id]
-            logger.info("Disconnected client: %s", client_id)
+            logger.error("Error pruning shelter changes: %s", str(e))
+        await asyncio.sleep(interval)
+
+# 住所先頭の都道府県名（見つからなければNone）
+def address_prefecture(address: Optional[str]) -> Optional[str]:
+    if not address:
+        return None
+    found = [(address.find(name), name) for name in PREF_CODE_MAP if name in address]
+    return min(found)[1] if found else None
+
+# WebSocketの購読条件との照合に使う避難所の位置・運営企業・都道府県
+def shelter_target(shelter: ShelterModel) -> dict:
+    return {
+        "latitude": shelter.latitude,
+        "longitude": shelter.longitude,
+        "company_id": shelter.company_id,
+        "prefecture": address_prefecture(shelter.address),
+    }
+
+# WebSocketブロードキャスト（targetsを渡すと購読条件に一致するクライアントにだけ届く）
+async def broadcast_shelter_update(data: dict, targets: Optional[List[dict]] = None):
+    logger.info("Broadcasting update: %s", data)
+    shelter_snapshot.invalidate()
+    if targets is not None:
+        data["targets"] = targets
+    try:
+        await broadcaster.publish(data)
+    except Exception as e:
+        # DBへの反映は完了しているため、配信失敗でリクエストを失敗させない
+        logger.error("Broadcast publish failed: %s\n%s", str(e), traceback.format_exc())
+
+# 全ワーカーで受信した更新を自プロセスのクライアントへ配る
+def handle_broadcast(message: dict, from_self: bool):
+    targets = message.pop("targets", None)
+    if not from_self:
+        shelter_snapshot.invalidate()
+        # 他ワーカーでの変更を空間インデックスへ反映（位置が分からない場合は再構築させる）
+        action = message.get("action")
+        changes = message.get("changes") or {}
+        if action == "create" and message.get("shelter"):
+            shelter = message["shelter"]
+            shelter_index.upsert(shelter["id"], shelter["latitude"], shelter["longitude"])
+        elif action in ("delete", "bulk_delete"):
+            for shelter_id in message.get("shelter_ids") or [message.get("shelter_id")]:
+                shelter_index.remove(shelter_id)
+        elif action in ("update", "bulk_update"):
+            if "latitude" in changes and "longitude" in changes and message.get("shelter_id"):
+                shelter_index.upsert(message["shelter_id"], changes["latitude"], changes["longitude"])
+            elif "latitude" in changes or "longitude" in changes:
+                shelter_index.invalidate()
+        else:
+            shelter_index.invalidate()
+    delivered = ws_hub.publish(message, targets)
+    logger.debug("Delivered broadcast to %d clients: %s", delivered, message)
 
 # ログイン画面（GET）
 @app.get("/login", response_class=HTMLResponse)
@@ -378,43 +716,13 @@ async def login_post(
         logs = []
         try:
             if company.role == "admin":
-                shelters = db.query(ShelterModel).all()
+                shelters = fetch_shelters(db, db.query(ShelterModel))
                 logs = db.query(AuditLogModel).order_by(AuditLogModel.timestamp.desc()).limit(50).all()
             else:
-                shelters = db.query(ShelterModel).filter(ShelterModel.company_id == company.id).all()
+                shelters = fetch_shelters(db, db.query(ShelterModel).filter(ShelterModel.company_id == company.id))
         except Exception as e:
             logger.error("Error fetching shelters/logs: %s\n%s", str(e), traceback.format_exc())
 
-        shelters_data = []
-        for shelter in shelters:
-            photos = [f"/api/photos/{photo.id}" for photo in shelter.photos_rel]
-            shelters_data.append({
-                "id": shelter.id,
-                "name": shelter.name,
-                "address": shelter.address,
-                "latitude": shelter.latitude,
-                "longitude": shelter.longitude,
-                "capacity": shelter.capacity,
-                "current_occupancy": shelter.current_occupancy,
-                "attributes": {
-                    "pets_allowed": shelter.pets_allowed,
-                    "barrier_free": shelter.barrier_free,
-                    "toilet_available": shelter.toilet_available,
-                    "food_available": shelter.food_available,
-                    "medical_available": shelter.medical_available,
-                    "wifi_available": shelter.wifi_available,
-                    "charging_available": shelter.charging_available,
-                    "equipment": shelter.equipment or "",
-                },
-                "photos": photos,
-                "contact": shelter.contact,
-                "operator": shelter.operator,
-                "opened_at": shelter.opened_at.isoformat(),
-                "status": shelter.status,
-                "updated_at": shelter.updated_at.isoformat() if shelter.updated_at else None,
-                "company_id": shelter.company_id,
-            })
-
         template_name = "admin.html" if company.role == "admin" else "index.html"
         template_response = templates.TemplateResponse(
             template_name,
@@ -422,7 +730,7 @@ async def login_post(
                 "request": request,
                 "company": company,
                 "token": access_token,
-                "shelters": shelters_data,
+                "shelters": shelters,
                 "logs": logs if company.role == "admin" else [],
                 "api_url": "/api",
                 "ws_url": "ws://localhost:8000/ws/shelters" if ENV == "local" else "wss://safeshelter.onrender.com/ws/shelters",
@@ -464,7 +772,7 @@ async def register_auth(request: Request, auth_password: str = Form(...)):
     )
 
 @app.post("/shelters", response_model=schemas.ShelterSchema)
-def create_shelter(
+async def create_shelter(
     request: Request,
     shelter: schemas.ShelterCreate,
     db: Session = Depends(get_db)
@@ -481,27 +789,61 @@ def create_shelter(
         if not company:
             raise HTTPException(status_code=404, detail="企業情報が見つかりません")
 
-        new_shelter = models.ShelterModel(
-            **shelter.dict(exclude={"company_id"}),
+        new_shelter = ShelterModel(
+            name=shelter.name,
+            address=shelter.address,
+            latitude=shelter.latitude,
+            longitude=shelter.longitude,
+            capacity=shelter.capacity,
+            current_occupancy=shelter.current_occupancy,
+            pets_allowed=shelter.attributes.pets_allowed,
+            barrier_free=shelter.attributes.barrier_free,
+            toilet_available=shelter.attributes.toilet_available,
+            food_available=shelter.attributes.food_available,
+            medical_available=shelter.attributes.medical_available,
+            wifi_available=shelter.attributes.wifi_available,
+            charging_available=shelter.attributes.charging_available,
+            equipment=shelter.attributes.equipment or "",
+            photos="",  # 旧列、photos_relで管理
+            contact=shelter.contact,
+            operator=shelter.operator,
+            opened_at=datetime.fromisoformat(shelter.opened_at) if shelter.opened_at else datetime.utcnow(),
+            status=shelter.status,
+            updated_at=datetime.utcnow(),
             company_id=company.id  # ← ここで強制的にログイン中のIDに上書き
         )
         db.add(new_shelter)
+        db.flush()
+        version = record_shelter_changes(db, "create", [new_shelter.id])
         db.commit()
         db.refresh(new_shelter)
-        return new_shelter
+
+        shelter_index.upsert(new_shelter.id, new_shelter.latitude, new_shelter.longitude)
+        payload = serialize_shelter_model(new_shelter, [])
+        await broadcast_shelter_update({
+            "action": "create",
+            "shelter_id": new_shelter.id,
+            "version": version,
+            "shelter": payload,
+        }, [shelter_target(new_shelter)])
+        return FastJSONResponse(content=payload)
 
     except JWTError:
         raise HTTPException(status_code=401, detail="不正なトークン")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="開設日時の形式が不正です")
 
 # 避難所一覧取得（公開エンドポイント）
 @app.get("/api/shelters", response_model=List[ShelterSchema])
 async def get_shelters(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     search: Optional[str] = Query(None),
     current_user: Optional[CompanyModel] = Depends(get_current_user_optional),
     only_mine: bool = Query(False),  # ← 追加
     status: Optional[str] = Query(None, pattern="^(open|closed)?$"),
-    distance: Optional[float] = Query(None, ge=0),
+    distance: Optional[float] = Query(None, ge=0, le=MAX_SEARCH_DISTANCE_KM),
     latitude: Optional[float] = Query(None),
     longitude: Optional[float] = Query(None),
     pets_allowed: Optional[bool] = Query(None),
@@ -511,9 +853,30 @@ async def get_shelters(
     medical_available: Optional[bool] = Query(None),
     wifi_available: Optional[bool] = Query(None),
     charging_available: Optional[bool] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
 ):
     try:
         logger.info("Fetching shelters: search=%s, status=%s, distance=%s", search, status, distance)
+        paginate = limit is not None or cursor is not None or fields is not None
+        attribute_filters = (
+            pets_allowed, barrier_free, toilet_available, food_available,
+            medical_available, wifi_available, charging_available,
+        )
+        # 絞り込みなしの一覧はエンコード済みのスナップショットを返す（変化が無ければ304）
+        if (
+            not paginate and not search and not status and not distance
+            and not (only_mine and current_user)
+            and all(value is None for value in attribute_filters)
+        ):
+            snapshot = await current_shelter_snapshot(db)
+            return snapshot_response(request, snapshot)
+
+        selected = parse_shelter_fields(fields)
+        after = decode_cursor(cursor) if cursor else None
+        # 一覧より先に版数を読む（クライアントはこれより新しい差分だけを適用する）
+        response.headers["X-Shelter-Version"] = str(settled_shelter_version(db))
         query = db.query(ShelterModel)
 
         # 自分の投稿のみ取得（オプション）
@@ -543,64 +906,223 @@ async def get_shelters(
         if charging_available is not None:
             query = query.filter(ShelterModel.charging_available == charging_available)
 
-        shelters = query.all()
-
-        # 距離フィルタ
+        # 距離フィルタ（矩形でSQL側を絞り込み、空間インデックスで半径内の候補に限定）
+        nearby = None
         if distance and latitude is not None and longitude is not None:
-            from math import radians, sin, cos, sqrt, atan2
-            def haversine(lat1, lon1, lat2, lon2):
-                R = 6371
-                dlat = radians(lat2 - lat1)
-                dlon = radians(lon2 - lon1)
-                a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-                c = 2 * atan2(sqrt(a), sqrt(1 - a))
-                return R * c
-
-            filtered_shelters = []
-            for shelter in shelters:
-                if shelter.latitude and shelter.longitude:
-                    dist = haversine(latitude, longitude, shelter.latitude, shelter.longitude)
-                    if dist <= distance:
-                        filtered_shelters.append(shelter)
-            shelters = filtered_shelters
+            min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, distance)
+            query = query.filter(
+                ShelterModel.latitude.between(min_lat, max_lat),
+                ShelterModel.longitude.between(min_lon, max_lon),
+            )
+            refresh_shelter_index(db)
+            nearby = shelter_index.within(latitude, longitude, distance)
+            if not nearby:
+                logger.info("Returning 0 shelters")
+                return []
+
+        # limit / cursor / fields 指定時は必要な列だけをSELECTし、キーセットでページングする
+        if paginate:
+            columns = shelter_columns(selected)
+            if nearby is not None:
+                # 距離順（同距離はID順）。候補を距離順に並べ、SQL側の条件はバッチごとに確認
+                candidates = sorted((dist, shelter_id) for shelter_id, dist in nearby.items())
+                if after is not None:
+                    key = (after.get("d", -1.0), after["id"])
+                    candidates = [c for c in candidates if c > key]
+                rows = []
+                batch_size = max((limit or 0) * 2, 200)
+                for start in range(0, len(candidates), batch_size):
+                    batch = dict((shelter_id, dist) for dist, shelter_id in candidates[start:start + batch_size])
+                    found = query.with_entities(*columns).filter(ShelterModel.id.in_(list(batch))).all()
+                    found.sort(key=lambda row: (batch[row.id], row.id))
+                    rows.extend(found)
+                    if limit is not None and len(rows) > limit:
+                        break
+            else:
+                page_query = query.with_entities(*columns)
+                if after is not None:
+                    page_query = page_query.filter(ShelterModel.id > after["id"])
+                page_query = page_query.order_by(ShelterModel.id)
+                if limit is not None:
+                    page_query = page_query.limit(limit + 1)
+                rows = page_query.all()
+
+            headers = {"X-Shelter-Version": response.headers["X-Shelter-Version"]}
+            if limit is not None and len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                next_cursor = {"id": last.id}
+                if nearby is not None:
+                    next_cursor["d"] = nearby[last.id]
+                headers["X-Next-Cursor"] = encode_cursor(next_cursor)
+            photos = photo_urls_by_shelter(db, [row.id for row in rows]) if "photos" in selected else {}
+            result = serialize_shelter_rows(rows, selected, photos)
+            logger.info("Returning %d shelters (fields=%s, next=%s)", len(result), fields, "X-Next-Cursor" in headers)
+            return FastJSONResponse(content=result, headers=headers)
+
+        if nearby is not None:
+            # IN句が長くなりすぎないよう、候補をまとめて分けて引く
+            ids = sorted(nearby)
+            result = []
+            for start in range(0, len(ids), SHELTER_ID_BATCH):
+                result.extend(fetch_shelters(db, query.filter(ShelterModel.id.in_(ids[start:start + SHELTER_ID_BATCH]))))
+        else:
+            result = fetch_shelters(db, query)
+        logger.info("Returning %d shelters", len(result))
+        return FastJSONResponse(content=result, headers={"X-Shelter-Version": response.headers["X-Shelter-Version"]})
 
-        result = []
-        for shelter in shelters:
-            photos = [f"/api/photos/{photo.id}" for photo in shelter.photos_rel]
-            shelter_data = {
-                "id": shelter.id,
-                "name": shelter.name,
-                "address": shelter.address,
-                "latitude": shelter.latitude,
-                "longitude": shelter.longitude,
-                "capacity": shelter.capacity,
-                "current_occupancy": shelter.current_occupancy,
-                "attributes": {
-                    "pets_allowed": shelter.pets_allowed,
-                    "barrier_free": shelter.barrier_free,
-                    "toilet_available": shelter.toilet_available,
-                    "food_available": shelter.food_available,
-                    "medical_available": shelter.medical_available,
-                    "wifi_available": shelter.wifi_available,
-                    "charging_available": shelter.charging_available,
-                    "equipment": shelter.equipment or "",
-                },
-                "photos": photos,
-                "contact": shelter.contact,
-                "operator": shelter.operator,
-                "opened_at": shelter.opened_at,
-                "status": shelter.status,
-                "updated_at": shelter.updated_at,
-                "company_id": shelter.company_id,
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error in get_shelters: %s\n%s", str(e), traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"避難所取得に失敗しました: {str(e)}")
+
+
+# 変更フィード（公開エンドポイント、sinceより後に作成・更新された避難所と削除されたIDのみ返す）
+@app.get("/api/shelters/changes", response_model=ShelterChangesSchema)
+async def get_shelter_changes(
+    db: Session = Depends(get_db),
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    current_user: Optional[CompanyModel] = Depends(get_current_user_optional),
+    only_mine: bool = Query(False),
+):
+    try:
+        logger.info("Fetching shelter changes: since=%s, limit=%s", since, limit)
+        query = db.query(ShelterModel)
+        if only_mine and current_user:
+            query = query.filter(ShelterModel.company_id == current_user.id)
+
+        # 初回や、保持期間を過ぎて履歴が消えたカーソル、このサーバーの履歴より先のカーソル（DBの作り直しなど）には全件を返す
+        oldest, latest = db.query(func.min(ShelterChangeModel.id), func.max(ShelterChangeModel.id)).one()
+        if since == 0 or oldest is None or since < oldest - 1 or since > latest:
+            if not (only_mine and current_user):
+                snapshot = await current_shelter_snapshot(db)
+                return FastJSONResponse({"cursor": snapshot.version, "reset": True, "has_more": False, "shelters": snapshot.items, "deleted": []})
+            cursor = settled_shelter_version(db)
+            shelters = fetch_shelters(db, query)
+            logger.info("Returning full shelter list for change feed: %d shelters", len(shelters))
+            return FastJSONResponse({"cursor": cursor, "reset": True, "has_more": False, "shelters": shelters, "deleted": []})
+
+        rows = (
+            db.query(ShelterChangeModel.id, ShelterChangeModel.shelter_id, ShelterChangeModel.changed_at, ShelterChangeModel.action)
+            .filter(ShelterChangeModel.id > since)
+            .order_by(ShelterChangeModel.id)
+            .limit(limit + 1)
+            .all()
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        # 番号は採番順でコミット順ではないため、直近の欠番（コミット待ちの可能性）の手前でカーソルを止める
+        cursor = since
+        settle_before = datetime.utcnow() - timedelta(seconds=CHANGE_FEED_SETTLE_SECONDS)
+        for i, (change_id, _, changed_at, _) in enumerate(rows):
+            if change_id != cursor + 1 and changed_at > settle_before:
+                rows = rows[:i]
+                has_more = False
+                break
+            cursor = change_id
+
+        changed_ids = list(dict.fromkeys(shelter_id for _, shelter_id, _, action in rows if action != "init"))
+        shelters = []
+        deleted = []
+        if changed_ids:
+            shelters = fetch_shelters(db, query.filter(ShelterModel.id.in_(changed_ids)))
+            existing = {
+                shelter_id for (shelter_id,) in
+                db.query(ShelterModel.id).filter(ShelterModel.id.in_(changed_ids)).all()
             }
-            result.append(shelter_data)
+            deleted = [shelter_id for shelter_id in changed_ids if shelter_id not in existing]
 
-        logger.info("Returning %d shelters", len(result))
+        logger.info("Returning shelter changes: %d updated, %d deleted, cursor=%s", len(shelters), len(deleted), cursor)
+        return FastJSONResponse({"cursor": cursor, "reset": False, "has_more": has_more, "shelters": shelters, "deleted": deleted})
+
+    except Exception as e:
+        logger.error("Error in get_shelter_changes: %s\n%s", str(e), traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"変更履歴の取得に失敗しました: {str(e)}")
+
+
+# 最寄り避難所取得（公開エンドポイント、距離順・空き容量で絞り込み）
+@app.get("/api/shelters/nearest", response_model=List[NearestShelterSchema])
+async def get_nearest_shelters(
+    db: Session = Depends(get_db),
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=100),
+    max_distance: Optional[float] = Query(None, gt=0),
+    status: Optional[str] = Query("open", pattern="^(open|closed)?$"),
+    min_available: int = Query(1, ge=0),
+    pets_allowed: Optional[bool] = Query(None),
+    barrier_free: Optional[bool] = Query(None),
+    toilet_available: Optional[bool] = Query(None),
+    food_available: Optional[bool] = Query(None),
+    medical_available: Optional[bool] = Query(None),
+    wifi_available: Optional[bool] = Query(None),
+    charging_available: Optional[bool] = Query(None),
+):
+    try:
+        logger.info("Fetching nearest shelters: lat=%s, lon=%s, k=%s, status=%s", latitude, longitude, k, status)
+        refresh_shelter_index(db)
+        query = db.query(
+            ShelterModel.id,
+            ShelterModel.name,
+            ShelterModel.address,
+            ShelterModel.latitude,
+            ShelterModel.longitude,
+            ShelterModel.capacity,
+            ShelterModel.current_occupancy,
+            ShelterModel.status,
+        )
+        if status:
+            query = query.filter(ShelterModel.status == status)
+        if min_available:
+            query = query.filter(ShelterModel.capacity - ShelterModel.current_occupancy >= min_available)
+        flags = {
+            "pets_allowed": pets_allowed,
+            "barrier_free": barrier_free,
+            "toilet_available": toilet_available,
+            "food_available": food_available,
+            "medical_available": medical_available,
+            "wifi_available": wifi_available,
+            "charging_available": charging_available,
+        }
+        for name, value in flags.items():
+            if value is not None:
+                query = query.filter(getattr(ShelterModel, name) == value)
+
+        # 近い順に候補をまとめてDBで絞り込み、k件そろった時点で打ち切る
+        # （条件に合う避難所が少ない場合でも問い合わせ回数が増えすぎないよう、バッチは倍々に広げる）
+        candidates = shelter_index.iter_nearest(latitude, longitude, max_distance)
+        batch_size = max(k * 4, 32)
+        result = []
+        while len(result) < k:
+            batch = dict(islice(candidates, batch_size))
+            if not batch:
+                break
+            batch_size = min(batch_size * 2, NEAREST_MAX_BATCH)
+            rows = query.filter(ShelterModel.id.in_(list(batch))).all()
+            rows.sort(key=lambda row: batch[row.id])
+            for row in rows[: k - len(result)]:
+                result.append({
+                    "id": row.id,
+                    "name": row.name,
+                    "address": row.address,
+                    "latitude": row.latitude,
+                    "longitude": row.longitude,
+                    "capacity": row.capacity,
+                    "current_occupancy": row.current_occupancy,
+                    "available": max(row.capacity - row.current_occupancy, 0),
+                    "status": row.status,
+                    "distance_km": round(batch[row.id], 3),
+                })
+
+        logger.info("Returning %d nearest shelters", len(result))
         return result
 
     except Exception as e:
-        logger.error("Error in get_shelters: %s\n%s", str(e), traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"避難所取得に失敗しました: {str(e)}")
+        logger.error("Error in get_nearest_shelters: %s\n%s", str(e), traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"最寄り避難所取得に失敗しました: {str(e)}")
 
 
 # 避難所作成（認証必要）
@@ -635,16 +1157,16 @@ async def create_shelter(
             updated_at=datetime.utcnow(),
             company_id=current_user.id,
         )
+        # 避難所・写真の関連付け・変更履歴を1つのトランザクションで確定させる
         db.add(db_shelter)
-        db.commit()
-        db.refresh(db_shelter)
+        db.flush()
 
         # 写真の関連付け
         if shelter.photos:
             for photo_id in shelter.photos:
                 try:
                     photo_id = int(photo_id.split("/")[-1])  # /api/photos/{id} から ID 抽出
-                    photo = db.query(PhotoModel).filter(PhotoModel.id == photo_id).first()
+                    photo = db.query(PhotoModel.id).filter(PhotoModel.id == photo_id).first()
                     if photo:
                         shelter_photo = ShelterPhotoModel(
                             shelter_id=db_shelter.id,
@@ -654,37 +1176,20 @@ async def create_shelter(
                         db.add(shelter_photo)
                 except ValueError:
                     logger.warning("Invalid photo ID format: %s", photo_id)
+        version = record_shelter_changes(db, "create", [db_shelter.id])
         db.commit()
 
+        shelter_index.upsert(db_shelter.id, db_shelter.latitude, db_shelter.longitude)
         log_action(db, "create_shelter", db_shelter.id, current_user.email)
-        await broadcast_shelter_update({"action": "create", "shelter_id": db_shelter.id})
+        payload = serialize_shelter_model(db_shelter, shelter_photo_urls(db, db_shelter.id))
+        await broadcast_shelter_update({
+            "action": "create",
+            "shelter_id": db_shelter.id,
+            "version": version,
+            "shelter": payload,
+        }, [shelter_target(db_shelter)])
         logger.info("Shelter created: id=%s, name=%s", db_shelter.id, db_shelter.name)
-        return {
-            "id": db_shelter.id,
-            "name": db_shelter.name,
-            "address": db_shelter.address,
-            "latitude": db_shelter.latitude,
-            "longitude": db_shelter.longitude,
-            "capacity": db_shelter.capacity,
-            "current_occupancy": db_shelter.current_occupancy,
-            "attributes": {
-                "pets_allowed": db_shelter.pets_allowed,
-                "barrier_free": db_shelter.barrier_free,
-                "toilet_available": db_shelter.toilet_available,
-                "food_available": db_shelter.food_available,
-                "medical_available": db_shelter.medical_available,
-                "wifi_available": db_shelter.wifi_available,
-                "charging_available": db_shelter.charging_available,
-                "equipment": db_shelter.equipment,
-            },
-            "photos": [f"/api/photos/{photo.id}" for photo in db_shelter.photos_rel],
-            "contact": db_shelter.contact,
-            "operator": db_shelter.operator,
-            "opened_at": db_shelter.opened_at,
-            "status": db_shelter.status,
-            "updated_at": db_shelter.updated_at,
-            "company_id": db_shelter.company_id,
-        }
+        return FastJSONResponse(content=payload)
     except ValidationError as e:
         logger.error("Validation error in create_shelter: %s", str(e))
         raise HTTPException(status_code=422, detail=f"データ検証エラー: {str(e)}")
@@ -711,6 +1216,8 @@ async def update_shelter(
             logger.error("Permission denied: user=%s, shelter_id=%s", current_user.email, shelter_id)
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="更新権限がありません")
 
+        before = serialize_shelter_model(db_shelter, shelter_photo_urls(db, shelter_id))
+        targets = [shelter_target(db_shelter)]
         data = shelter.dict(exclude_unset=True)
         for k, v in data.items():
             if k == "attributes" and v:
@@ -737,7 +1244,7 @@ async def update_shelter(
                     for photo_id in v:
                         try:
                             photo_id = int(photo_id.split("/")[-1])
-                            photo = db.query(PhotoModel).filter(PhotoModel.id == photo_id).first()
+                            photo = db.query(PhotoModel.id).filter(PhotoModel.id == photo_id).first()
                             if photo:
                                 shelter_photo = ShelterPhotoModel(
                                     shelter_id=shelter_id,
@@ -750,37 +1257,23 @@ async def update_shelter(
             else:
                 setattr(db_shelter, k, v)
         db_shelter.updated_at = datetime.utcnow()
+        version = record_shelter_changes(db, "update", [shelter_id])
         db.commit()
         db.refresh(db_shelter)
+        shelter_index.upsert(db_shelter.id, db_shelter.latitude, db_shelter.longitude)
         log_action(db, "update_shelter", shelter_id, current_user.email)
-        await broadcast_shelter_update({"action": "update", "shelter_id": shelter_id})
+        after = serialize_shelter_model(db_shelter, shelter_photo_urls(db, shelter_id))
+        # 移動・移管した場合は移動前の範囲の購読者にも届ける
+        if shelter_target(db_shelter) != targets[0]:
+            targets.append(shelter_target(db_shelter))
+        await broadcast_shelter_update({
+            "action": "update",
+            "shelter_id": shelter_id,
+            "version": version,
+            "changes": shelter_delta(before, after),
+        }, targets)
         logger.info("Shelter updated: id=%s", shelter_id)
-        return {
-            "id": db_shelter.id,
-            "name": db_shelter.name,
-            "address": db_shelter.address,
-            "latitude": db_shelter.latitude,
-            "longitude": db_shelter.longitude,
-            "capacity": db_shelter.capacity,
-            "current_occupancy": db_shelter.current_occupancy,
-            "attributes": {
-                "pets_allowed": db_shelter.pets_allowed,
-                "barrier_free": db_shelter.barrier_free,
-                "toilet_available": db_shelter.toilet_available,
-                "food_available": db_shelter.food_available,
-                "medical_available": db_shelter.medical_available,
-                "wifi_available": db_shelter.wifi_available,
-                "charging_available": db_shelter.charging_available,
-                "equipment": db_shelter.equipment,
-            },
-            "photos": [f"/api/photos/{photo.id}" for photo in db_shelter.photos_rel],
-            "contact": db_shelter.contact,
-            "operator": db_shelter.operator,
-            "opened_at": db_shelter.opened_at,
-            "status": db_shelter.status,
-            "updated_at": db_shelter.updated_at,
-            "company_id": db_shelter.company_id,
-        }
+        return FastJSONResponse(content=after)
     except Exception as e:
         logger.error("Error in update_shelter: %s\n%s", str(e), traceback.format_exc())
         db.rollback()
@@ -802,12 +1295,18 @@ async def delete_shelter(
         if db_shelter.company_id != current_user.id and current_user.role != "admin":
             logger.error("Permission denied: user=%s, shelter_id=%s", current_user.email, shelter_id)
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="削除権限がありません")
-        # 関連写真のリンクを削除
+        targets = [shelter_target(db_shelter)]
+        # 関連写真のリンクを削除し、参照の無くなった写真を片付ける
+        photo_ids = shelter_photo_ids(db, [shelter_id])
         db.query(ShelterPhotoModel).filter(ShelterPhotoModel.shelter_id == shelter_id).delete()
         db.delete(db_shelter)
+        orphan_keys = collect_orphan_photos(db, photo_ids)
+        version = record_shelter_changes(db, "delete", [shelter_id])
         db.commit()
+        remove_photo_files(db, orphan_keys)
+        shelter_index.remove(shelter_id)
         log_action(db, "delete_shelter", shelter_id, current_user.email)
-        await broadcast_shelter_update({"action": "delete", "shelter_id": shelter_id})
+        await broadcast_shelter_update({"action": "delete", "shelter_id": shelter_id, "version": version}, targets)
         logger.info("Shelter deleted: id=%s", shelter_id)
         return {"message": "避難所を削除しました"}
     except Exception as e:
@@ -828,6 +1327,8 @@ async def bulk_update_shelters(
         if not shelters:
             logger.error("No shelters found: ids=%s", request.shelter_ids)
             raise HTTPException(status_code=404, detail="避難所が見つかりません")
+        targets = [shelter_target(shelter) for shelter in shelters]
+        updated_at = datetime.utcnow()
         for shelter in shelters:
             if shelter.company_id != current_user.id and current_user.role != "admin":
                 logger.error("Permission denied: user=%s, shelter_id=%s", current_user.email, shelter.id)
@@ -836,10 +1337,22 @@ async def bulk_update_shelters(
                 shelter.status = request.status
             if request.current_occupancy is not None:
                 shelter.current_occupancy = request.current_occupancy
-            shelter.updated_at = datetime.utcnow()
+            shelter.updated_at = updated_at
             log_action(db, "bulk_update", shelter.id, current_user.email)
+        shelter_ids = [shelter.id for shelter in shelters]
+        version = record_shelter_changes(db, "update", shelter_ids)
         db.commit()
-        await broadcast_shelter_update({"action": "bulk_update", "shelter_ids": request.shelter_ids})
+        changes = {"updated_at": updated_at.isoformat()}
+        if request.status is not None:
+            changes["status"] = request.status
+        if request.current_occupancy is not None:
+            changes["current_occupancy"] = request.current_occupancy
+        await broadcast_shelter_update({
+            "action": "bulk_update",
+            "shelter_ids": shelter_ids,
+            "version": version,
+            "changes": changes,
+        }, targets)
         logger.info("Bulk update completed: %d shelters", len(shelters))
         return {"message": "避難所を一括更新しました"}
     except Exception as e:
@@ -860,6 +1373,8 @@ async def bulk_delete_shelters(
         if not shelters:
             logger.error("No shelters found: ids=%s", shelter_ids)
             raise HTTPException(status_code=404, detail="避難所が見つかりません")
+        photo_ids = shelter_photo_ids(db, [shelter.id for shelter in shelters])
+        targets = [shelter_target(shelter) for shelter in shelters]
         for shelter in shelters:
             if shelter.company_id != current_user.id and current_user.role != "admin":
                 logger.error("Permission denied: user=%s, shelter_id=%s", current_user.email, shelter.id)
@@ -867,8 +1382,14 @@ async def bulk_delete_shelters(
             db.query(ShelterPhotoModel).filter(ShelterPhotoModel.shelter_id == shelter.id).delete()
             log_action(db, "bulk_delete", shelter.id, current_user.email)
             db.delete(shelter)
+        deleted_ids = [shelter.id for shelter in shelters]
+        orphan_keys = collect_orphan_photos(db, photo_ids)
+        version = record_shelter_changes(db, "delete", deleted_ids)
         db.commit()
-        await broadcast_shelter_update({"action": "bulk_delete", "shelter_ids": shelter_ids})
+        remove_photo_files(db, orphan_keys)
+        for shelter_id in deleted_ids:
+            shelter_index.remove(shelter_id)
+        await broadcast_shelter_update({"action": "bulk_delete", "shelter_ids": deleted_ids, "version": version}, targets)
         logger.info("Bulk delete completed: %d shelters", len(shelters))
         return {"message": "避難所を一括削除しました"}
     except Exception as e:
@@ -877,39 +1398,221 @@ async def bulk_delete_shelters(
         raise HTTPException(status_code=500, detail=f"一括削除に失敗しました: {str(e)}")
 
 
-@app.get("/api/reverse-geocode")
-async def get_reverse_geocode(lat: float, lon: float):
-    url = f"https://api.geoapify.com/v1/geocode/reverse?lat={lat}&lon={lon}&lang=ja&apiKey={GEOAPIFY_API_KEY}"
+async def fetch_reverse_geocode(lat: float, lon: float) -> dict:
+    """Geoapifyで逆ジオコーディング（キャッシュを通さない）。特定できない項目は空文字"""
+    url = "https://api.geoapify.com/v1/geocode/reverse"
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "lang": "ja",
+        "apiKey": GEOAPIFY_API_KEY
+    }
     headers = {"Accept": "application/json"}
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        res = await client.get(url, headers=headers)
-        res.raise_for_status()
-        data = res.json()
+    res = await http_clients.get("geoapify").get(url, params=params, headers=headers)
+    res.raise_for_status()
+    data = res.json()
 
     features = data.get("features", [])
     if not features:
-        raise HTTPException(status_code=404, detail="Geoapify逆ジオコーディングに失敗しました: featuresなし")
+        return {"prefecture": "", "city": ""}
 
-    prop = features[0].get("properties", {})
+    props = features[0].get("properties", {})
+    logger.debug(f"[Geoapify] reverse props: {props}")
 
     # ★都道府県をできるだけ柔軟に抽出
-    prefecture = prop.get("state") or prop.get("county") or prop.get("region") or ""
-    city = prop.get("city") or prop.get("town") or prop.get("village") or prop.get("district") or ""
+    prefecture = (
+        props.get("state") or
+        props.get("county") or
+        props.get("region") or
+        props.get("province") or
+        ""
+    )
+    city = (
+        props.get("city") or
+        props.get("town") or
+        props.get("village") or
+        props.get("municipality") or
+        props.get("district") or
+        props.get("suburb") or
+        props.get("locality") or
+        ""
+    )
 
     # ★東京都23区のように"city"が"千代田区"などの場合を東京都と仮定
     if not prefecture and city.endswith("区"):
         prefecture = "東京都"
 
-    logger.info(f"[reverse-geocode] extracted -> prefecture: {prefecture}, city: {city}")
+    return {"prefecture": prefecture, "city": city}
+
+
+async def get_reverse_geocode(lat: float, lon: float) -> dict:
+    """逆ジオコーディング（約1km格子でキャッシュ）。警報系APIと /api/reverse-geocode で共有する"""
+    return await reverse_geocode_cache.get(lat, lon, fetch_reverse_geocode)
 
-    if not prefecture:
+
+@app.get("/api/reverse-geocode")
+async def reverse_geocode_endpoint(lat: float, lon: float):
+    # 都道府県は同梱の境界データで判定し、市区町村だけGeoapifyに頼る
+    match = prefecture_index.lookup(lat, lon)
+    try:
+        geo = await get_reverse_geocode(lat, lon)
+    except httpx.HTTPError as e:
+        logger.error("Geoapify reverse geocode failed: %s", str(e))
+        if match is None:
+            raise HTTPException(status_code=502, detail=f"Geoapify逆ジオコーディングに失敗しました: {str(e)}")
+        geo = {"prefecture": "", "city": ""}
+    if match is not None:
+        geo["prefecture"] = match.name
+
+    logger.info(f"[reverse-geocode] extracted -> prefecture: {geo['prefecture']}, city: {geo['city']}")
+
+    if not geo["prefecture"]:
         raise HTTPException(status_code=404, detail="Geoapify逆ジオコーディングに失敗しました: 都道府県が特定できませんでした")
 
-    return {"prefecture": prefecture, "city": city}
+    return geo
+
+
+@app.get("/api/reverse-geocode/metrics")
+async def reverse_geocode_metrics():
+    return reverse_geocode_cache.metrics()
 
 
 
+# アップロードされた写真をチャンク単位でストアへ保存（形式は先頭バイトで判定）
+async def store_uploaded_photo(file: UploadFile):
+    try:
+        return await run_in_threadpool(photo_store.save_stream, file.file, PHOTO_MAX_BYTES)
+    except PhotoTooLarge:
+        logger.error("Photo too large: %s (max %d bytes)", file.filename, PHOTO_MAX_BYTES)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"ファイルサイズが大きすぎます: {file.filename} (上限: {PHOTO_MAX_BYTES // (1024 * 1024)}MB)",
+        )
+    except UnsupportedPhotoType:
+        logger.error("Unsupported photo type: %s", file.filename)
+        raise HTTPException(
+            status_code=400,
+            detail=f"許可されていないファイル形式です: {file.filename} (許可: {ALLOWED_PHOTO_TYPES})",
+        )
+
+# 同じ内容の写真が既にあればそれを再利用（内容ハッシュで重複排除）
+def find_or_create_photo(db: Session, file: UploadFile, stored) -> PhotoModel:
+    photo = db.query(PhotoModel).filter(PhotoModel.sha256 == stored.sha256).order_by(PhotoModel.id).first()
+    if photo:
+        logger.info("Reusing existing photo: id=%s, sha256=%s", photo.id, stored.sha256)
+        return photo
+    photo = PhotoModel(
+        filename=file.filename,
+        content_type=stored.content_type,
+        storage_key=stored.key,
+        sha256=stored.sha256,
+        size=stored.size,
+        created_at=datetime.utcnow(),
+    )
+    db.add(photo)
+    db.flush()
+    return photo
+
+def link_photos(db: Session, shelter_id: int, photo_ids: List[int]):
+    linked = {
+        photo_id for (photo_id,) in
+        db.query(ShelterPhotoModel.photo_id).filter(ShelterPhotoModel.shelter_id == shelter_id)
+    }
+    for photo_id in photo_ids:
+        if photo_id in linked:
+            continue
+        db.add(ShelterPhotoModel(
+            shelter_id=shelter_id,
+            photo_id=photo_id,
+            created_at=datetime.utcnow(),
+        ))
+        linked.add(photo_id)
+
+# どの避難所からも参照されなくなった写真を削除（コミット前に呼ぶ）。ストアから消せるキーを返す
+def collect_orphan_photos(db: Session, photo_ids) -> set:
+    photo_ids = set(photo_ids)
+    if not photo_ids:
+        return set()
+    db.flush()
+    referenced = {
+        photo_id for (photo_id,) in
+        db.query(ShelterPhotoModel.photo_id).filter(ShelterPhotoModel.photo_id.in_(photo_ids)).distinct()
+    }
+    orphan_ids = photo_ids - referenced
+    if not orphan_ids:
+        return set()
+    keys = {
+        key for (key,) in
+        db.query(PhotoModel.storage_key).filter(PhotoModel.id.in_(orphan_ids))
+        if key
+    }
+    db.query(PhotoModel).filter(PhotoModel.id.in_(orphan_ids)).delete(synchronize_session=False)
+    logger.info("Orphaned photos deleted: ids=%s", sorted(orphan_ids))
+    return keys
+
+# コミット後、まだ他の写真行が使っていないファイルだけをストアから削除
+# 確認から削除までの間に同じ内容のアップロードが登録される場合に備え、直近に書き込み・再利用されたファイルは
+# 猶予を置いてから確認し直す
+def remove_photo_files(db: Session, keys: set, touched_before: Optional[float] = None):
+    if not keys:
+        return
+    in_use = {
+        key for (key,) in
+        db.query(PhotoModel.storage_key).filter(PhotoModel.storage_key.in_(keys)).distinct()
+    }
+    if touched_before is None:
+        touched_before = time.time() - PHOTO_DELETE_GRACE_SECONDS
+    deferred = set()
+    for key in keys - in_use:
+        try:
+            if not photo_store.delete(key, touched_before=touched_before):
+                deferred.add(key)
+        except Exception as e:
+            logger.error("Failed to remove photo file: key=%s, error=%s", key, str(e))
+    if deferred:
+        logger.info("Deferring removal of recently used photo files: keys=%s", sorted(deferred))
+        task = asyncio.get_running_loop().create_task(remove_photo_files_later(deferred))
+        pending_photo_removals.add(task)
+        task.add_done_callback(pending_photo_removals.discard)
+
+async def remove_photo_files_later(keys: set):
+    await asyncio.sleep(PHOTO_DELETE_GRACE_SECONDS)
+    try:
+        with SessionLocal() as db:
+            remove_photo_files(db, keys)
+    except Exception as e:
+        logger.error("Failed to remove photo files: keys=%s, error=%s", sorted(keys), str(e))
+
+# 登録に失敗したアップロードのファイルを片付ける（ロールバック後に呼ぶ。他の写真行が使っているものは残す）
+# stored_at: 保存し終えた時刻。それ以降に他のアップロードが再利用したファイルは猶予を置いて確認し直す
+def discard_uploaded_photos(db: Session, keys, stored_at: Optional[float]):
+    if not keys:
+        return
+    try:
+        remove_photo_files(db, set(keys), touched_before=stored_at)
+    except Exception as e:
+        logger.error("Failed to discard uploaded photo files: keys=%s, error=%s", sorted(keys), str(e))
+
+def shelter_photo_ids(db: Session, shelter_ids: List[int]) -> List[int]:
+    return [
+        photo_id for (photo_id,) in
+        db.query(ShelterPhotoModel.photo_id).filter(ShelterPhotoModel.shelter_id.in_(shelter_ids))
+    ]
+
+# 写真の追加も避難所の更新として変更履歴に記録してコミットし、配信する（beforeは追加前の内容）
+async def commit_photo_update(db: Session, db_shelter: ShelterModel, before: dict):
+    db_shelter.updated_at = datetime.utcnow()
+    version = record_shelter_changes(db, "update", [db_shelter.id])
+    db.commit()
+    after = serialize_shelter_model(db_shelter, shelter_photo_urls(db, db_shelter.id))
+    await broadcast_shelter_update({
+        "action": "update",
+        "shelter_id": db_shelter.id,
+        "version": version,
+        "changes": shelter_delta(before, after),
+    }, [shelter_target(db_shelter)])
+
 # 写真アップロード（単一、認証必要）
 @app.post("/api/shelters/upload-photo", response_model=PhotoUploadResponse)
 async def upload_photo(
@@ -918,6 +1621,8 @@ async def upload_photo(
     db: Session = Depends(get_db),
     current_user: CompanyModel = Depends(get_current_user),
 ):
+    stored_keys = []
+    stored_at = None
     try:
         logger.info("Uploading photo for shelter_id=%s, user=%s", shelter_id, current_user.email)
         db_shelter = db.query(ShelterModel).filter(ShelterModel.id == shelter_id).first()
@@ -928,32 +1633,13 @@ async def upload_photo(
             logger.error("Permission denied: user=%s, shelter_id=%s", current_user.email, shelter_id)
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="アップロード権限がありません")
 
-        file_ext = file.filename.split(".")[-1].lower()
-        allowed_extensions = ["jpg", "jpeg", "png", "gif"]
-        if file_ext not in allowed_extensions:
-            logger.error("Invalid file extension: %s for file %s", file_ext, file.filename)
-            raise HTTPException(
-                status_code=400,
-                detail=f"許可されていないファイル形式です: {file.filename} (許可: {', '.join(allowed_extensions)})"
-            )
-
-        content = await file.read()
-        photo = PhotoModel(
-            filename=file.filename,
-            content_type=file.content_type or f"image/{file_ext}",
-            data=content,
-        )
-        db.add(photo)
-        db.commit()
-        db.refresh(photo)
-
-        shelter_photo = ShelterPhotoModel(
-            shelter_id=shelter_id,
-            photo_id=photo.id,
-            created_at=datetime.utcnow(),
-        )
-        db.add(shelter_photo)
-        db.commit()
+        stored = await store_uploaded_photo(file)
+        stored_keys.append(stored.key)
+        stored_at = time.time()
+        photo = find_or_create_photo(db, file, stored)
+        before = serialize_shelter_model(db_shelter, shelter_photo_urls(db, shelter_id))
+        link_photos(db, shelter_id, [photo.id])
+        await commit_photo_update(db, db_shelter, before)
 
         log_action(db, "upload_photo", shelter_id, current_user.email)
         logger.info("Photo uploaded: id=%s, url=/api/photos/%s", photo.id, photo.id)
@@ -963,6 +1649,7 @@ async def upload_photo(
     except Exception as e:
         logger.error("Error in upload_photo: %s\n%s", str(e), traceback.format_exc())
         db.rollback()
+        discard_uploaded_photos(db, stored_keys, stored_at)
         raise HTTPException(status_code=500, detail=f"写真アップロードに失敗しました: {str(e)}")
 
 # 写真アップロード（複数、認証必要）
@@ -973,6 +1660,8 @@ async def upload_photos(
     db: Session = Depends(get_db),
     current_user: CompanyModel = Depends(get_current_user),
 ):
+    stored_keys = []
+    stored_at = None
     try:
         logger.info("Uploading %d photos for shelter_id=%s, user=%s", len(files), shelter_id, current_user.email)
         db_shelter = db.query(ShelterModel).filter(ShelterModel.id == shelter_id).first()
@@ -983,43 +1672,37 @@ async def upload_photos(
             logger.error("Permission denied: user=%s, shelter_id=%s", current_user.email, shelter_id)
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="アップロード権限がありません")
 
+        if len(files) > PHOTO_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"一度にアップロードできる写真は{PHOTO_MAX_FILES}枚までです")
+
+        # ストアへの保存は並列に行い、DBへの登録は1トランザクションにまとめる
+        results = await asyncio.gather(*(store_uploaded_photo(file) for file in files), return_exceptions=True)
+        stored_keys.extend(result.key for result in results if not isinstance(result, BaseException))
+        stored_at = time.time()
         photo_ids = []
-        allowed_extensions = ["jpg", "jpeg", "png", "gif"]
         invalid_files = []
-        for file in files:
-            file_ext = file.filename.split(".")[-1].lower()
-            if file_ext not in allowed_extensions:
-                logger.error("Invalid file extension: %s for file %s", file_ext, file.filename)
+        for file, result in zip(files, results):
+            if isinstance(result, HTTPException):
                 invalid_files.append(file.filename)
                 continue
+            if isinstance(result, BaseException):
+                raise result
+            photo = find_or_create_photo(db, file, result)
+            if photo.id not in photo_ids:
+                photo_ids.append(photo.id)
 
-            content = await file.read()
-            photo = PhotoModel(
-                filename=file.filename,
-                content_type=file.content_type or f"image/{file_ext}",
-                data=content,
-            )
-            db.add(photo)
-            db.commit()
-            db.refresh(photo)
-
-            shelter_photo = ShelterPhotoModel(
-                shelter_id=shelter_id,
-                photo_id=photo.id,
-                created_at=datetime.utcnow(),
-            )
-            db.add(shelter_photo)
-            photo_ids.append(photo.id)
-
-        db.commit()
         if invalid_files:
             logger.warning("Invalid files skipped: %s", ", ".join(invalid_files))
         if not photo_ids:
             raise HTTPException(
                 status_code=400,
-                detail=f"有効な写真がありません。無効なファイル: {', '.join(invalid_files)} (許可: {', '.join(allowed_extensions)})"
+                detail=f"有効な写真がありません。無効なファイル: {', '.join(invalid_files)} (許可: {ALLOWED_PHOTO_TYPES}, 上限: {PHOTO_MAX_BYTES // (1024 * 1024)}MB)"
             )
 
+        before = serialize_shelter_model(db_shelter, shelter_photo_urls(db, shelter_id))
+        link_photos(db, shelter_id, photo_ids)
+        await commit_photo_update(db, db_shelter, before)
+
         log_action(db, "upload_photos", shelter_id, current_user.email)
         logger.info("Photos uploaded: ids=%s", photo_ids)
         return {"ids": photo_ids, "photo_urls": [f"/api/photos/{id}" for id in photo_ids]}
@@ -1028,23 +1711,95 @@ async def upload_photos(
     except Exception as e:
         logger.error("Error in upload_photos: %s\n%s", str(e), traceback.format_exc())
         db.rollback()
+        discard_uploaded_photos(db, stored_keys, stored_at)
         raise HTTPException(status_code=500, detail=f"写真アップロードに失敗しました: {str(e)}")
 
+# 写真は一度アップロードされたら不変のため、長期キャッシュさせる
+PHOTO_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
 # 写真取得（バイナリ）
 @app.get("/api/photos/{photo_id}")
-async def get_photo(photo_id: int, db: Session = Depends(get_db)):
+async def get_photo(
+    photo_id: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=4096),
+    size: Optional[str] = Query(None, pattern="^(thumb|small|medium|large)$"),
+    fmt: Optional[str] = Query(None, alias="format", pattern="^(webp|jpeg)$"),
+    db: Session = Depends(get_db),
+):
     try:
-        logger.info("Fetching photo: id=%d", photo_id)
-        row = db.query(PhotoModel.data, PhotoModel.content_type).filter(PhotoModel.id == photo_id).first()
+        logger.info("Fetching photo: id=%d, w=%s, size=%s", photo_id, w, size)
+        row = (
+            db.query(PhotoModel.storage_key, PhotoModel.content_type, PhotoModel.sha256, PhotoModel.created_at)
+            .filter(PhotoModel.id == photo_id)
+            .first()
+        )
         if not row:
             logger.warning("Photo not found: id=%d, serving placeholder", photo_id)
             placeholder_path = os.path.join(STATIC_DIR, "placeholder.jpg")
             if os.path.exists(placeholder_path):
-                with open(placeholder_path, "rb") as f:
-                    return StreamingResponse(io.BytesIO(f.read()), media_type="image/jpeg")
+                return FileResponse(placeholder_path, media_type="image/jpeg", headers={"Cache-Control": "no-cache"})
             raise HTTPException(status_code=404, detail="写真が見つかりません")
-        data, content_type = row
-        return StreamingResponse(io.BytesIO(data), media_type=content_type)
+        storage_key, content_type, sha256, created_at = row
+
+        headers = {"Cache-Control": PHOTO_CACHE_CONTROL}
+        if created_at:
+            headers["Last-Modified"] = format_datetime(created_at.replace(tzinfo=timezone.utc), usegmt=True)
+        # 縮小版（ストア上の写真のみ。初回リクエスト時に生成してキャッシュ）
+        width = resolve_width(size, w)
+        if width and storage_key and sha256 and variants_available():
+            variant_fmt = negotiate_format(fmt, request.headers.get("accept"))
+            variant = variant_name(width, variant_fmt)
+            headers["ETag"] = f'"{sha256}-{variant}"'
+            if not fmt:
+                headers["Vary"] = "Accept"
+            if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+                return Response(status_code=304, headers=headers)
+            db.close()  # 生成・配信中はDB接続を保持しない
+            path = photo_store.variant_path(storage_key, variant)
+            # 直近に生成できなかった縮小版は原本を読み直さず、原寸で返す
+            if not path and not variant_failures.is_failed(storage_key, variant):
+                original = await run_in_threadpool(photo_store.read, storage_key)
+                if original is not None:
+                    try:
+                        data = await run_in_threadpool(render_variant, original, width, variant_fmt)
+                        path = await run_in_threadpool(photo_store.save_variant, storage_key, variant, data)
+                    except Exception as e:
+                        variant_failures.add(storage_key, variant)
+                        logger.warning("Failed to render photo variant: id=%d, variant=%s, error=%s", photo_id, variant, str(e))
+            if path:
+                return FileResponse(path, media_type=VARIANT_MEDIA_TYPES[variant_fmt], headers=headers)
+            headers.pop("Vary", None)
+
+        if sha256:
+            headers["ETag"] = f'"{sha256}"'
+            # 変更なしならファイルに触れずに304を返す
+            if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+                return Response(status_code=304, headers=headers)
+
+        if storage_key:
+            path = photo_store.path(storage_key)
+            if path:
+                db.close()  # ファイル配信中はDB接続を保持しない
+                # FileResponseはRangeリクエスト（206）にも対応
+                return FileResponse(path, media_type=content_type, headers=headers)
+            logger.error("Photo file missing in store: id=%d, key=%s", photo_id, storage_key)
+        # 未移行の写真はDBのバイナリから返す
+        data = db.query(PhotoModel.data).filter(PhotoModel.id == photo_id).scalar()
+        if data is None:
+            raise HTTPException(status_code=404, detail="写真が見つかりません")
+        headers.setdefault("ETag", f'"{hashlib.sha256(data).hexdigest()}"')
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        return Response(content=data, media_type=content_type, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Error in get_photo: %s\n%s", str(e), traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"写真取得に失敗しました: {str(e)}")
@@ -1071,8 +1826,7 @@ async def geocode_address_endpoint(address: str):
 
     try:
         logger.info(f"📍 国土地理院でジオコーディング: {address}")
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(url)
+        resp = await http_clients.get("gsi").get(url)
 
         logger.info("🔁 GSI response status: %d", resp.status_code)
         logger.debug("📨 Raw response text: %s", resp.text)
@@ -1104,17 +1858,21 @@ async def geocode_address_endpoint(address: str):
 # プロキシエンドポイント（JMA API）
 @app.get("/api/proxy")
 async def proxy_endpoint(url: str):
+    target = urlsplit(url)
+    client_name = PROXY_HOST_CLIENTS.get(target.hostname or "")
+    if target.scheme != "https" or client_name is None:
+        logger.warning("Proxy target not allowed: %s", url)
+        raise HTTPException(status_code=400, detail="中継できないURLです")
     try:
         logger.info("Proxying request: url=%s", url)
         if "jma.go.jp" in url and "warning/00.json" in url:
             url = "https://www.jma.go.jp/bosai/warning/data/warning/080000.json"
             logger.info("Redirected JMA URL to: %s", url)
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            data = response.json()
-            logger.info("Proxy response: keys=%s", list(data.keys()))
-            return JSONResponse(content=data)
+        response = await http_clients.get(client_name).get(url)
+        response.raise_for_status()
+        data = response.json()
+        logger.info("Proxy response: keys=%s", list(data.keys()))
+        return JSONResponse(content=data)
     except httpx.HTTPStatusError as e:
         logger.error("Proxy HTTP error: %s, status=%d", str(e), e.response.status_code)
         if e.response.status_code in (404, 405):
@@ -1177,66 +1935,90 @@ PREF_CODE_MAP = {
     "沖縄県": "471000"
 }
 
+# 気象庁の警報・注意報（全府県を定期取得し、APIはキャッシュから答える）
+warning_poller = WarningFeedPoller(
+    http_clients.get("jma"),
+    PREF_CODE_MAP.values(),
+    interval=float(os.getenv("JMA_WARNING_POLL_INTERVAL", "120")),
+    stale_after=float(os.getenv("JMA_WARNING_STALE_AFTER", "600")),
+)
+
+# 津波警報（フィードを定期取得し、新しい電文だけ取得・解析する）
+tsunami_poller = TsunamiFeedPoller(
+    http_clients.get("jma_xml"),
+    PREF_CODE_MAP.keys(),
+    interval=float(os.getenv("JMA_TSUNAMI_POLL_INTERVAL", "60")),
+)
 
-async def get_prefecture_code(lat: float, lon: float) -> str:
-    GEOAPIFY_API_KEY = os.getenv("GEOAPIFY_API_KEY")
+# 地震情報（一覧を定期取得し、イベントIDで重複を除いた履歴を持つ）
+quake_poller = QuakeFeedPoller(
+    http_clients.get("jma"),
+    interval=float(os.getenv("JMA_QUAKE_POLL_INTERVAL", "60")),
+    stale_after=float(os.getenv("JMA_QUAKE_STALE_AFTER", "600")),
+    history=QuakeHistory(
+        max_events=int(os.getenv("QUAKE_HISTORY_SIZE", "1000")),
+        max_age_seconds=float(os.getenv("QUAKE_HISTORY_DAYS", "7")) * 24 * 3600,
+    ),
+)
+
+
+def normalize_prefecture(name: Optional[str]) -> Optional[str]:
+    """Geoapifyの表記（"茨城"・"茨城県"など）をPREF_CODE_MAPのキーにそろえる"""
+    if not name:
+        return None
+    if name in PREF_CODE_MAP:
+        return name
+    return next((name + s for s in ("県", "府", "都", "道") if name + s in PREF_CODE_MAP), None)
+
+
+async def resolve_prefecture(lat: float, lon: float) -> Optional[str]:
+    """同梱の境界データで判定し、範囲外（離島など）のときだけGeoapifyに問い合わせる"""
+    match = prefecture_index.lookup(lat, lon)
+    if match is not None:
+        return match.name
     if not GEOAPIFY_API_KEY:
-        raise HTTPException(status_code=500, detail="Geoapify API key is not set")
+        logger.warning("Prefecture not resolved locally and GEOAPIFY_API_KEY is not set: lat=%s, lon=%s", lat, lon)
+        return None
+    geo = await get_reverse_geocode(lat, lon)
+    return normalize_prefecture(geo["prefecture"])
 
-    url = f"https://api.geoapify.com/v1/geocode/reverse?lat={lat}&lon={lon}&lang=ja&apiKey={GEOAPIFY_API_KEY}"
-    headers = {"User-Agent": "smart-shelter"}
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        res = await client.get(url, headers=headers)
-        res.raise_for_status()
-        data = res.json()
+async def get_prefecture_code(lat: float, lon: float) -> Tuple[str, str]:
+    """(都道府県名, 気象庁の府県予報区コード)"""
+    prefecture_name = await resolve_prefecture(lat, lon)
+    if not prefecture_name:
+        raise HTTPException(status_code=404, detail="都道府県が特定できませんでした")
+    return prefecture_name, PREF_CODE_MAP[prefecture_name]
 
-    try:
-        return data["features"][0]["properties"]["state"]
-    except (IndexError, KeyError):
-        raise HTTPException(status_code=500, detail="都道府県コード取得に失敗しました")
 
 
 
 
 
+# 単独地点のAPIは一次細分区域の単位で返す（市町村等の階層まで含めると同じ警報が重複する）
+PRIMARY_AREA_LEVEL = 0
 
-@app.get("/api/disaster-alerts")
-async def get_disaster_alerts(lat: float = Query(...), lon: float = Query(...)):
-    prefecture_name = await get_prefecture_code(lat, lon)  # 例: "茨城"
 
-    # 「茨城県」などに補完してコードを探す
-    suffixes = ["県", "府", "都", "道"]
-    possible_keys = [prefecture_name + s for s in suffixes]
-    prefecture_code = next((PREF_CODE_MAP.get(k) for k in possible_keys if PREF_CODE_MAP.get(k)), None)
+def get_area_bounds(prefecture_name: str) -> Optional[List[List[float]]]:
+    """警報を地図に描く範囲（都道府県の境界）"""
+    return prefecture_index.outline(prefecture_name)
 
-    if not prefecture_code:
-        raise HTTPException(status_code=400, detail=f"{prefecture_name} のJMAコードが見つかりません")
 
-    jma_url = f"https://www.jma.go.jp/bosai/warning/data/warning/{prefecture_code}.json"
+@app.get("/api/disaster-alerts")
+async def get_disaster_alerts(lat: float = Query(...), lon: float = Query(...)):
+    prefecture_name, prefecture_code = await get_prefecture_code(lat, lon)  # 例: ("茨城県", "080000")
 
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            res = await client.get(jma_url)
-            res.raise_for_status()
-            jma_data = res.json()
-
-        alerts = []
-        for area_type in jma_data.get("areaTypes", []):
-            for area in area_type.get("areas", []):
-                area_name = area.get("name", "")
-                if prefecture_name not in area_name:
-                    continue
-                for warn in area.get("warnings", []):
-                    if warn.get("status") == "解除":
-                        continue
-                    alerts.append({
-                        "area": area_name,
-                        "type": warn.get("kind", {}).get("name", ""),
-                        "status": warn.get("status", ""),
-                        "issued": warn.get("issued", "")
-                    })
-
+        warnings = await warning_poller.get(prefecture_code)
+        alerts = [
+            {
+                "area": item.area,
+                "type": item.kind,
+                "status": item.status,
+                "issued": item.issued,
+            }
+            for item in warnings.query(level=PRIMARY_AREA_LEVEL)
+        ]
         return {"alerts": alerts}
 
     except Exception as e:
@@ -1250,89 +2032,158 @@ async def api_weather_alerts(lat: float = Query(...), lon: float = Query(...)):
 
 async def fetch_weather_alerts(lat: float, lon: float) -> dict:
     try:
-        geo = await get_reverse_geocode(lat, lon)
-        prefecture_name = geo.get("prefecture", "")
-        logger.debug(f"[気象警報] Reverse geocode: {geo}")
-
-        if not prefecture_name:
-            raise HTTPException(status_code=404, detail="都道府県が特定できませんでした")
-
-        suffixes = ["県", "府", "都", "道"]
-        possible_keys = [prefecture_name + s for s in suffixes]
-        prefecture_code = next((PREF_CODE_MAP.get(k) for k in possible_keys if PREF_CODE_MAP.get(k)), None)
-
-        logger.debug(f"[気象警報] 想定キー: {possible_keys}")
-        logger.debug(f"[気象警報] 適用コード: {prefecture_code}")
-
-        if not prefecture_code:
-            raise HTTPException(status_code=400, detail=f"{prefecture_name} のJMAコードが見つかりません")
-
-        jma_url = f"https://www.jma.go.jp/bosai/warning/data/warning/{prefecture_code}.json"
-        logger.info(f"[気象警報] JMA URL: {jma_url}")
-
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            res = await client.get(jma_url)
-            res.raise_for_status()
-            jma_data = res.json()
-
-        logger.debug(f"[気象警報] JMAデータ: {json.dumps(jma_data)[:500]}...")  # 先頭だけ出力
-
-        alerts = []
-        for area_type in jma_data.get("areaTypes", []):
-            for area in area_type.get("areas", []):
-                area_name = area.get("name", "")
-                logger.debug(f"[気象警報] エリア名: {area_name}")
-                if prefecture_name not in area_name:
-                    continue
-                for warn in area.get("warnings", []):
-                    if warn.get("status") == "解除":
-                        continue
-                    alert = {
-                        "area": area_name,
-                        "warning_type": warn.get("kind", {}).get("name", ""),
-                        "status": warn.get("status", ""),
-                        "issued_at": warn.get("issued", ""),
-                        "description": f"{area_name}における{warn.get('kind', {}).get('name', '')}",
-                        "polygon": get_area_bounds(prefecture_name),
-                    }
-                    logger.debug(f"[気象警報] 抽出警報: {alert}")
-                    alerts.append(alert)
+        prefecture_name, prefecture_code = await get_prefecture_code(lat, lon)
+        logger.debug(f"[気象警報] 都道府県: {prefecture_name}, 適用コード: {prefecture_code}")
+
+        warnings = await warning_poller.get(prefecture_code)
+        polygon = get_area_bounds(prefecture_name)
+
+        alerts = [
+            {
+                "area": item.area,
+                "warning_type": item.kind,
+                "status": item.status,
+                "issued_at": item.issued,
+                "description": f"{item.area}における{item.kind}",
+                "polygon": polygon,
+            }
+            for item in warnings.query(level=PRIMARY_AREA_LEVEL)
+        ]
 
         logger.info(f"[気象警報] 最終警報数: {len(alerts)} 件")
         return {"alerts": alerts}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("[気象警報] 取得失敗: %s\n%s", str(e), traceback.format_exc())
         raise HTTPException(status_code=500, detail="気象警報データの取得に失敗しました")
 
 
+# 複数地点の照会1回でGeoapify（従量課金）に問い合わせてよい格子の数。超えた地点は prefecture: null で返す
+ALERT_QUERY_MAX_REMOTE_LOOKUPS = int(os.getenv("ALERT_QUERY_MAX_REMOTE_LOOKUPS", "5"))
+
+# 複数地点の警報・注意報をまとめて取得（都道府県ごとに1回だけ引く）
+@app.post("/api/alerts/query")
+async def query_alerts(query: AlertQuery):
+    try:
+        # 同梱の境界で判定できない地点（海上・離島）は、同じ格子をまとめたうえで上限までだけ問い合わせる
+        local = [prefecture_index.lookup(p.lat, p.lon) for p in query.points]
+        remote_cells = list(dict.fromkeys(
+            reverse_geocode_cache.key(p.lat, p.lon) for p, match in zip(query.points, local) if match is None
+        ))
+        allowed_cells = set(remote_cells[:ALERT_QUERY_MAX_REMOTE_LOOKUPS])
+        if len(remote_cells) > len(allowed_cells):
+            logger.warning("Alert query skipped %d remote prefecture lookups", len(remote_cells) - len(allowed_cells))
+        skipped = [
+            match is None and reverse_geocode_cache.key(p.lat, p.lon) not in allowed_cells
+            for p, match in zip(query.points, local)
+        ]
+
+        async def resolve(point, match, skip):
+            if match is not None:
+                return match.name
+            return None if skip else await resolve_prefecture(point.lat, point.lon)
+
+        resolved = await asyncio.gather(*(resolve(*args) for args in zip(query.points, local, skipped)), return_exceptions=True)
+        prefectures = [None if isinstance(name, Exception) else name for name in resolved]
+        offices = list(dict.fromkeys(PREF_CODE_MAP[name] for name in prefectures if name))
+        fetched = await asyncio.gather(*(warning_poller.get(code) for code in offices), return_exceptions=True)
+        warnings_by_office = dict(zip(offices, fetched))
+
+        alerts_by_office = {}
+        for code, warnings in warnings_by_office.items():
+            if isinstance(warnings, Exception):
+                logger.warning("Failed to load JMA warnings for %s: %s", code, str(warnings))
+                continue
+            alerts_by_office[code] = [
+                {
+                    "area": item.area,
+                    "area_code": item.area_code,
+                    "type": item.kind,
+                    "kind_code": item.kind_code,
+                    "status": item.status,
+                    "issued": item.issued,
+                }
+                for item in warnings.query(kinds=query.kinds, level=query.level, include_inactive=query.include_inactive)
+            ]
+
+        results = []
+        for point, name, skip in zip(query.points, prefectures, skipped):
+            code = PREF_CODE_MAP[name] if name else None
+            result = {"lat": point.lat, "lon": point.lon, "prefecture": name, "office_code": code, "alerts": alerts_by_office.get(code, [])}
+            if skip:
+                result["error"] = "都道府県を特定できる地点数の上限を超えました"
+            elif code and code not in alerts_by_office:
+                result["error"] = "警報データを取得できませんでした"
+            results.append(result)
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error in query_alerts: %s\n%s", str(e), traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"警報データ取得に失敗しました: {str(e)}")
+
 
+# 気象庁フィードの取得状況
+@app.get("/api/alerts/metrics")
+async def alerts_metrics():
+    return {"warnings": warning_poller.metrics(), "quakes": quake_poller.metrics(), "tsunami": tsunami_poller.metrics()}
 
 
 
 
 
 
+
+
+
+# 気象庁の時刻は日本時間
+JST = timezone(timedelta(hours=9))
+
 @app.get("/api/quake-alerts")
-async def get_quake_alerts():
+async def get_quake_alerts(
+    hours: Optional[float] = Query(None, gt=0, description="直近何時間の地震か"),
+    since: Optional[datetime] = Query(None, description="この時刻以降に発生した地震（hoursより優先）"),
+    min_scale: Optional[int] = Query(None, ge=0, le=70, description="最大震度の下限（10=震度1, 45=5弱, 50=5強, ..., 70=7）"),
+    lat: Optional[float] = Query(None),
+    lon: Optional[float] = Query(None),
+    radius_km: Optional[float] = Query(None, gt=0, description="lat/lonからの震央距離の上限"),
+    limit: int = Query(20, ge=1, le=200),
+):
+    if radius_km is not None and (lat is None or lon is None):
+        raise HTTPException(status_code=400, detail="radius_km を指定する場合は lat と lon も指定してください")
     try:
-        url = "https://www.jma.go.jp/bosai/quake/data/list.json"
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            res = await client.get(url)
-            res.raise_for_status()
-            data = res.json()
-        
-        if not data:
-            return {"quakes": []}
-        
-        latest = data[0]  # 最新の1件のみ
-        return {
-            "quakes": [{
-                "time": latest.get("time"),
-                "place": latest.get("hypoCenter", {}).get("name"),
-                "maxScale": latest.get("maxScale")  # 震度（整数：10=1, 20=2, ..., 70=7）
-            }]
-        }
+        await quake_poller.ensure_loaded()
+
+        if since is not None:
+            # タイムゾーンの無い時刻は、フィード・画面と同じく日本時間とみなす
+            since_ts = since.timestamp() if since.tzinfo else since.replace(tzinfo=JST).timestamp()
+        elif hours is not None:
+            since_ts = time.time() - hours * 3600
+        else:
+            since_ts = None
+
+        quakes = []
+        for quake, distance in quake_poller.history.query(
+            since=since_ts, min_scale=min_scale, lat=lat, lon=lon, radius_km=radius_km, limit=limit,
+        ):
+            item = {
+                "event_id": quake.event_id,
+                "time": quake.time,
+                "place": quake.place,
+                "maxScale": quake.max_scale,  # 震度（整数：10=1, 20=2, ..., 70=7）
+                "magnitude": quake.magnitude,
+                "latitude": quake.latitude,
+                "longitude": quake.longitude,
+                "depth_km": quake.depth_km,
+                "title": quake.title,
+            }
+            if distance is not None:
+                item["distance_km"] = round(distance, 1)
+            quakes.append(item)
+        # 新しい順（先頭が最新）
+        return {"quakes": quakes}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"地震データ取得に失敗: {str(e)}")
@@ -1341,57 +2192,22 @@ async def get_quake_alerts():
 @app.get("/api/tsunami-alerts")
 async def get_tsunami_alerts(lat: float = Query(...), lon: float = Query(...)):
     try:
-        geo = await get_reverse_geocode(lat, lon)
-        prefecture = geo.get("prefecture", "")
-        print(f"[津波API] 逆ジオ取得結果: {geo}")
+        prefecture = await resolve_prefecture(lat, lon) or ""
+        print(f"[津波API] 都道府県: {prefecture}")
 
         if not prefecture:
             print("[津波API] 都道府県の取得に失敗")
             return {"tsunami_alerts": []}
 
-        rss_url = "https://www.data.jma.go.jp/developer/xml/feed/eqvol.xml"
-        headers = {"User-Agent": "SafeShelterApp/1.0 (contact@example.com)"}
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            rss_res = await client.get(rss_url, headers=headers)
-            rss_res.raise_for_status()
-            rss_dict = xmltodict.parse(rss_res.text)
-
-        entries = rss_dict.get("feed", {}).get("entry", [])
-        if not isinstance(entries, list):
-            entries = [entries]
-
-        tsunami_link = None
-        for entry in entries:
-            title = entry.get("title", "")
-            if "津波警報" in title:
-                tsunami_link = entry.get("link", {}).get("@href")
-                break
-
-        if not tsunami_link:
-            print("[津波API] 津波警報のリンクが見つかりません")
-            return {"tsunami_alerts": []}
-
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            xml_res = await client.get(tsunami_link, headers=headers)
-            xml_res.raise_for_status()
-            xml_dict = xmltodict.parse(xml_res.text)
-
-        alerts = []
-        items = xml_dict.get("Report", {}).get("Body", {}).get("Tsunami", {}).get("TsunamiArea", [])
-        if not isinstance(items, list):
-            items = [items]
-
-        for item in items:
-            area_name = item.get("Name")
-            category = item.get("Category", {}).get("Name")
-            grade = item.get("MaxHeight", {}).get("Value") or "不明"
-
-            if prefecture in area_name:
-                alerts.append({
-                    "name": area_name,
-                    "category": category,
-                    "grade": grade,
-                })
+        await tsunami_poller.ensure_loaded()
+        alerts = [
+            {
+                "name": area.name,
+                "category": area.category,
+                "grade": area.grade,
+            }
+            for area in tsunami_poller.areas_for(prefecture)
+        ]
 
         print(f"[津波API] 該当津波警報: {alerts}")
         return {"tsunami_alerts": alerts}
@@ -1402,47 +2218,6 @@ async def get_tsunami_alerts(lat: float = Query(...), lon: float = Query(...)):
 
 
 
-async def get_reverse_geocode(lat: float, lon: float) -> dict:
-    url = "https://api.geoapify.com/v1/geocode/reverse"
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "lang": "ja",
-        "apiKey": GEOAPIFY_API_KEY
-    }
-
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        res = await client.get(url, params=params)
-        res.raise_for_status()
-        data = res.json()
-
-    features = data.get("features", [])
-    if not features:
-        return {"prefecture": "", "city": ""}
-
-    props = features[0].get("properties", {})
-    logger.debug(f"[Geoapify] reverse props: {props}")
-
-    prefecture = (
-        props.get("state") or
-        props.get("county") or
-        props.get("region") or
-        props.get("province") or
-        ""
-    )
-
-    city = (
-        props.get("city") or
-        props.get("county") or
-        props.get("municipality") or
-        props.get("suburb") or
-        props.get("locality") or
-        ""
-    )
-
-    return {"prefecture": prefecture, "city": city}
-
-
 
 
 
@@ -1451,37 +2226,8 @@ async def get_reverse_geocode(lat: float, lon: float) -> dict:
 async def read_root(request: Request, db: Session = Depends(get_db)):
     try:
         logger.info("Rendering index.html")
-        shelters = db.query(ShelterModel).all()
-        shelters_data = []
-        for shelter in shelters:
-            photos = [f"/api/photos/{photo.id}" for photo in shelter.photos_rel]
-            shelters_data.append({
-                "id": shelter.id,
-                "name": shelter.name,
-                "address": shelter.address,
-                "latitude": shelter.latitude,
-                "longitude": shelter.longitude,
-                "capacity": shelter.capacity,
-                "current_occupancy": shelter.current_occupancy,
-                "attributes": {
-                    "pets_allowed": shelter.pets_allowed,
-                    "barrier_free": shelter.barrier_free,
-                    "toilet_available": shelter.toilet_available,
-                    "food_available": shelter.food_available,
-                    "medical_available": shelter.medical_available,
-                    "wifi_available": shelter.wifi_available,
-                    "charging_available": shelter.charging_available,
-                    "equipment": shelter.equipment or "",
-                },
-                "photos": photos,
-                "contact": shelter.contact,
-                "operator": shelter.operator,
-                "opened_at": shelter.opened_at.isoformat(),
-                "status": shelter.status,
-                "updated_at": shelter.updated_at.isoformat() if shelter.updated_at else None,
-                "company_id": shelter.company_id,
-            })
-
+        snapshot = await current_shelter_snapshot(db)
+        shelters_data = snapshot.items
 
         return templates.TemplateResponse(
             "index.html",
@@ -1506,46 +2252,17 @@ async def get_dashboard(
 ):
     try:
         logger.info("Rendering dashboard for user=%s", current_user.email)
-        shelters = db.query(ShelterModel).filter(ShelterModel.company_id == current_user.id).all()
+        shelters = fetch_shelters(db, db.query(ShelterModel).filter(ShelterModel.company_id == current_user.id))
         token = request.cookies.get("token")
         if not token:
             logger.error("No token found in cookies")
             raise HTTPException(status_code=401, detail="ログインしてください")
-        shelters_data = []
-        for shelter in shelters:
-            photos = [f"/api/photos/{photo.id}" for photo in shelter.photos_rel]
-            shelters_data.append({
-                "id": shelter.id,
-                "name": shelter.name,
-                "address": shelter.address,
-                "latitude": shelter.latitude,
-                "longitude": shelter.longitude,
-                "capacity": shelter.capacity,
-                "current_occupancy": shelter.current_occupancy,
-                "attributes": {
-                    "pets_allowed": shelter.pets_allowed,
-                    "barrier_free": shelter.barrier_free,
-                    "toilet_available": shelter.toilet_available,
-                    "food_available": shelter.food_available,
-                    "medical_available": shelter.medical_available,
-                    "wifi_available": shelter.wifi_available,
-                    "charging_available": shelter.charging_available,
-                    "equipment": shelter.equipment or "",
-                },
-                "photos": photos,
-                "contact": shelter.contact,
-                "operator": shelter.operator,
-                "opened_at": shelter.opened_at.isoformat(),
-                "status": shelter.status,
-                "updated_at": shelter.updated_at.isoformat() if shelter.updated_at else None,
-                "company_id": shelter.company_id,
-            })
         return templates.TemplateResponse(
             "index.html",
             {
                 "request": request,
                 "company": current_user,
-                "shelters": shelters_data,
+                "shelters": shelters,
                 "token": token,
                 "api_url": "/api",
                 "ws_url": "ws://localhost:8000/ws/shelters" if ENV == "local" else "wss://safeshelter.onrender.com/ws/shelters",
@@ -1575,37 +2292,39 @@ async def upload_photo_binary(
     db: Session = Depends(get_db),
     current_user: CompanyModel = Depends(get_current_user),
 ):
+    stored_keys = []
+    stored_at = None
     try:
         logger.info("Uploading photo: filename=%s", file.filename)
-        file_ext = file.filename.split(".")[-1].lower()
-        if file_ext not in ["jpg", "jpeg", "png", "gif"]:
-            logger.error("Invalid file extension: %s", file_ext)
-            raise HTTPException(status_code=400, detail="無効な画像形式です")
-        content = await file.read()
-        photo = PhotoModel(
-            filename=file.filename,
-            content_type=file.content_type or f"image/{file_ext}",
-            data=content,
-        )
-        db.add(photo)
+        stored = await store_uploaded_photo(file)
+        stored_keys.append(stored.key)
+        stored_at = time.time()
+        photo = find_or_create_photo(db, file, stored)
         db.commit()
-        db.refresh(photo)
         logger.info("Photo uploaded: id=%s", photo.id)
         return {"ids": [photo.id], "photo_urls": [f"/api/photos/{photo.id}"]}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Error in upload_photo_binary: %s\n%s", str(e), traceback.format_exc())
         db.rollback()
+        discard_uploaded_photos(db, stored_keys, stored_at)
         raise HTTPException(status_code=500, detail=f"写真アップロードに失敗しました: {str(e)}")
 
 # WebSocketエンドポイント
 @app.websocket("/ws/shelters")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    try:
-        while True:
-            await asyncio.sleep(60)  # keep-alive or dummy wait
-    except WebSocketDisconnect:
-        logger.info("WebSocket disconnected")
+    await ws_hub.serve(websocket)
+
+# 上流ごとのHTTPリクエスト数・エラー・レイテンシ
+@app.get("/api/http/metrics")
+async def http_metrics():
+    return http_clients.metrics()
+
+# WebSocket接続状況
+@app.get("/api/ws/metrics")
+async def websocket_metrics():
+    return ws_hub.metrics()
 
 # ファビコン
 @app.get("/favicon.ico", response_class=Response)
@@ -1,7 +1,7 @@
 from sqlalchemy import (
     Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, LargeBinary
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from database import Base
 from datetime import datetime
 
@@ -60,7 +60,11 @@ class Photo(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)  # ファイル名（例：image.jpg）
     content_type = Column(String, nullable=False)  # MIMEタイプ（例：image/jpeg）
-    data = Column(LargeBinary, nullable=False)  # 画像バイナリデータ
+    data = deferred(Column(LargeBinary, nullable=True))  # 旧画像バイナリデータ（photo_storeへ移行後はNULL）
+    storage_key = Column(String, nullable=True, index=True)  # photo_store上のキー
+    sha256 = Column(String(64), nullable=True, index=True)  # 内容ハッシュ（ETag）
+    size = Column(Integer, nullable=True)  # バイト数
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=True)  # アップロード日時
 
     # 関連
     shelters = relationship("Shelter", secondary="shelter_photos", back_populates="photos_rel")
@@ -75,6 +79,16 @@ class ShelterPhoto(Base):
         Index('idx_shelter_photo', 'shelter_id', 'photo_id'),
     )
 
+class ShelterChange(Base):
+    __tablename__ = "shelter_changes"
+    id = Column(Integer, primary_key=True, index=True)  # 変更番号（単調増加、WebSocket差分の版数）
+    shelter_id = Column(Integer, nullable=False, index=True)  # 対象避難所（削除後も残すため外部キーにしない）
+    action = Column(String, nullable=False)  # 変更種別（create/update/delete、履歴の起点はinit）
+    changed_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # 変更日時
+
+    # SQLiteでも削除した番号を再利用させない（クライアントの持つカーソルが巻き戻らないように）
+    __table_args__ = {"sqlite_autoincrement": True}
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
     id = Column(Integer, primary_key=True, index=True)
@@ -0,0 +1,266 @@
+import os
+import sys
+import uuid
+import hashlib
+import logging
+import tempfile
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PHOTO_STORAGE_DIR = os.path.join(BASE_DIR, "data", "photos")
+
+CHUNK_SIZE = 64 * 1024
+
+# 保存結果（key: ストア上のキー、sha256: 内容ハッシュ（ETagに使用）、size: バイト数、content_type: 判定したMIMEタイプ）
+StoredPhoto = namedtuple("StoredPhoto", ["key", "sha256", "size", "content_type"], defaults=[None])
+
+
+class PhotoTooLarge(ValueError):
+    pass
+
+
+class UnsupportedPhotoType(ValueError):
+    pass
+
+
+# 先頭バイトで画像形式を判定（拡張子やクライアント申告のMIMEタイプは信用しない）
+def sniff_image_type(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class PhotoStore(ABC):
+    """写真バイナリの保存先（DBにはメタデータのみを持つ）"""
+
+    @abstractmethod
+    def save(self, data: bytes) -> StoredPhoto:
+        ...
+
+    @abstractmethod
+    def save_stream(self, fileobj, max_size: int) -> StoredPhoto:
+        """ファイルオブジェクトからチャンク単位で保存（max_size超過・非画像は例外）"""
+
+    @abstractmethod
+    def path(self, key: str) -> Optional[str]:
+        """FileResponseで返せるローカルパス（存在しなければNone）"""
+
+    @abstractmethod
+    def read(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str, touched_before: Optional[float] = None) -> bool:
+        """本体と縮小版を削除
+
+        touched_before（UNIX時刻）を指定すると、それ以降に書き込み・再利用されたファイルは消さずにFalseを返す
+        """
+
+    @abstractmethod
+    def variant_path(self, key: str, variant: str) -> Optional[str]:
+        """縮小版（例: w200.webp）のローカルパス（未生成ならNone）"""
+
+    @abstractmethod
+    def save_variant(self, key: str, variant: str, data: bytes) -> str:
+        ...
+
+
+class LocalPhotoStore(PhotoStore):
+    """SHA-256をキーにしたローカルディレクトリ保存（同一内容は1ファイル）"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def _check_key(key: str) -> None:
+        if len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+            raise ValueError(f"Invalid photo storage key: {key}")
+
+    def _path(self, key: str) -> str:
+        self._check_key(key)
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _variant_path(self, key: str, variant: str) -> str:
+        self._check_key(key)
+        if not variant.replace(".", "").isalnum():
+            raise ValueError(f"Invalid photo variant: {variant}")
+        return os.path.join(self.root, "variants", key[:2], f"{key}.{variant}")
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 一時ファイルに書いてからリネーム（書きかけのファイルを配信しない）
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        # 同じ内容が既にあれば更新時刻を進めて再利用する（削除側はこの時刻を見て削除を見送る）
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def save(self, data: bytes) -> StoredPhoto:
+        key = hashlib.sha256(data).hexdigest()
+        stored = StoredPhoto(key=key, sha256=key, size=len(data))
+        path = self._path(key)
+        if self._touch(path):
+            return stored
+        self._write_atomic(path, data)
+        logger.info("Photo stored: key=%s, size=%d", key, len(data))
+        return stored
+
+    def save_stream(self, fileobj, max_size: int) -> StoredPhoto:
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix=".upload-")
+        digest = hashlib.sha256()
+        size = 0
+        content_type = None
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if content_type is None:
+                        content_type = sniff_image_type(chunk[:16])
+                        if content_type is None:
+                            raise UnsupportedPhotoType("unsupported image type")
+                    size += len(chunk)
+                    if size > max_size:
+                        raise PhotoTooLarge(f"photo exceeds {max_size} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            if content_type is None:
+                raise UnsupportedPhotoType("empty file")
+            key = digest.hexdigest()
+            path = self._path(key)
+            if self._touch(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                logger.info("Photo stored: key=%s, size=%d", key, size)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return StoredPhoto(key=key, sha256=key, size=size, content_type=content_type)
+
+    def path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def read(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def delete(self, key: str, touched_before: Optional[float] = None) -> bool:
+        path = self._path(key)
+        if touched_before is None:
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info("Photo removed from store: key=%s", key)
+        else:
+            # 先に退避してから更新時刻を確かめる。退避後に来たアップロードは本体が無いので自分で書き直す
+            trash_path = f"{path}.deleting-{uuid.uuid4().hex}"
+            try:
+                os.replace(path, trash_path)
+            except FileNotFoundError:
+                pass
+            else:
+                if os.stat(trash_path).st_mtime > touched_before:
+                    # 同じ内容が使われ始めたので戻す（内容は同じなので、先に書き直されていても上書きしてよい）
+                    os.replace(trash_path, path)
+                    return False
+                os.remove(trash_path)
+                logger.info("Photo removed from store: key=%s", key)
+        # 縮小版もまとめて削除
+        variant_dir = os.path.dirname(self._variant_path(key, "x"))
+        if os.path.isdir(variant_dir):
+            for name in os.listdir(variant_dir):
+                if name.startswith(key + "."):
+                    os.remove(os.path.join(variant_dir, name))
+        return True
+
+    def variant_path(self, key: str, variant: str) -> Optional[str]:
+        path = self._variant_path(key, variant)
+        return path if os.path.exists(path) else None
+
+    def save_variant(self, key: str, variant: str, data: bytes) -> str:
+        path = self._variant_path(key, variant)
+        self._write_atomic(path, data)
+        logger.info("Photo variant stored: key=%s, variant=%s, size=%d", key, variant, len(data))
+        return path
+
+
+def create_photo_store() -> PhotoStore:
+    root = os.getenv("PHOTO_STORAGE_DIR", DEFAULT_PHOTO_STORAGE_DIR)
+    logger.info("Photo storage directory: %s", root)
+    return LocalPhotoStore(root)
+
+
+def migrate_db_photos(batch_size: int = 50) -> int:
+    """photos.data に残っているバイナリをストアへ移し、DB側はメタデータのみにする"""
+    from database import SessionLocal, engine, upgrade_schema
+    from models import Photo as PhotoModel
+
+    upgrade_schema(engine)
+    store = create_photo_store()
+    moved = 0
+    with SessionLocal() as db:
+        ids = [
+            photo_id for (photo_id,) in
+            db.query(PhotoModel.id)
+            .filter(PhotoModel.storage_key.is_(None), PhotoModel.data.isnot(None))
+            .order_by(PhotoModel.id)
+            .all()
+        ]
+        logger.info("Photos to migrate: %d", len(ids))
+        for photo_id in ids:
+            # 1件ずつ読み込み、大きなBLOBをまとめてメモリに載せない
+            (data,) = db.query(PhotoModel.data).filter(PhotoModel.id == photo_id).one()
+            stored = store.save(data)
+            db.query(PhotoModel).filter(PhotoModel.id == photo_id).update(
+                {"storage_key": stored.key, "sha256": stored.sha256, "size": stored.size, "data": None},
+                synchronize_session=False,
+            )
+            moved += 1
+            if moved % batch_size == 0:
+                db.commit()
+                logger.info("Migrated %d/%d photos", moved, len(ids))
+        db.commit()
+    logger.info("Photo migration completed: %d photos", moved)
+    return moved
+
+
+if __name__ == "__main__":
+    # 使い方: python photo_store.py migrate
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python photo_store.py migrate")
+        sys.exit(1)
+    migrate_db_photos()
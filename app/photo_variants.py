@@ -0,0 +1,86 @@
+import io
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillowが無い環境では縮小版を作らず原寸を返す
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# 名前付きサイズ（横幅px）。任意の w= もこの幅に丸めてキャッシュの種類を抑える
+VARIANT_SIZES = {"thumb": 200, "small": 400, "medium": 800, "large": 1600}
+VARIANT_WIDTHS = sorted(VARIANT_SIZES.values())
+VARIANT_MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def variants_available() -> bool:
+    return Image is not None
+
+
+def resolve_width(size: Optional[str] = None, width: Optional[int] = None) -> Optional[int]:
+    if size:
+        return VARIANT_SIZES[size]
+    if width:
+        return next((w for w in VARIANT_WIDTHS if w >= width), VARIANT_WIDTHS[-1])
+    return None
+
+
+def negotiate_format(requested: Optional[str], accept: Optional[str]) -> str:
+    if requested:
+        return requested
+    return "webp" if accept and "image/webp" in accept else "jpeg"
+
+
+def variant_name(width: int, fmt: str) -> str:
+    return f"w{width}.{fmt}"
+
+
+def render_variant(data: bytes, width: int, fmt: str) -> bytes:
+    """指定幅以下に縮小し、WebP/JPEGで再圧縮する"""
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            img.thumbnail((width, img.height), Image.LANCZOS)
+        if fmt == "jpeg":
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            options = {"quality": 80, "optimize": True, "progressive": True}
+        else:
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+            options = {"quality": 75, "method": 4}
+        out = io.BytesIO()
+        img.save(out, format=fmt.upper(), **options)
+    return out.getvalue()
+
+
+class VariantFailures:
+    """生成に失敗した縮小版（壊れた原本など）をしばらく覚えておき、リクエストごとに読み直さない"""
+
+    def __init__(self, ttl_seconds: float = 300.0, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._failed: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._failed)
+
+    def add(self, key: str, variant: str) -> None:
+        self._failed[(key, variant)] = time.monotonic()
+        self._failed.move_to_end((key, variant))
+        while len(self._failed) > self.max_entries:
+            self._failed.popitem(last=False)
+
+    def is_failed(self, key: str, variant: str) -> bool:
+        failed_at = self._failed.get((key, variant))
+        if failed_at is None:
+            return False
+        if time.monotonic() - failed_at > self.ttl_seconds:
+            del self._failed[(key, variant)]
+            return False
+        return True
@@ -0,0 +1,114 @@
+import os
+import json
+import math
+import logging
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+from spatial import KM_PER_DEG_LAT
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 同梱の都道府県境界（本土部分のみ。離島はGeoapifyで補う）
+DEFAULT_BOUNDARY_PATH = os.path.join(BASE_DIR, "data", "prefectures.json")
+
+# code: JIS都道府県コード（"01"〜"47"）、distance_km: 境界の外側で最寄りとした場合の距離（内側なら0）
+PrefectureMatch = namedtuple("PrefectureMatch", ["code", "name", "distance_km"])
+
+Ring = List[Tuple[float, float]]  # (経度, 緯度)
+
+
+def _point_in_ring(ring: Ring, lon: float, lat: float) -> bool:
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y2 > lat) != (y1 > lat):
+            x = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+            if lon < x:
+                inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def _distance_to_ring_km(ring: Ring, lon: float, lat: float) -> float:
+    # 狭い範囲なので正距円筒図法で近似する
+    kx = KM_PER_DEG_LAT * math.cos(math.radians(lat))
+    ky = KM_PER_DEG_LAT
+    best = float("inf")
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        ax, ay = (x1 - lon) * kx, (y1 - lat) * ky
+        bx, by = (x2 - lon) * kx, (y2 - lat) * ky
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        t = 0.0 if length2 == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length2))
+        best = min(best, math.hypot(ax + t * dx, ay + t * dy))
+        x1, y1 = x2, y2
+    return best
+
+
+class PrefectureIndex:
+    """緯度経度から都道府県を引く（境界ポリゴンの包含判定。候補は格子で絞り込む）"""
+
+    def __init__(self, prefectures: List[dict], cell_size_deg: float = 0.5, snap_km: float = 10.0):
+        self.cell_size_deg = cell_size_deg
+        # 境界データは海岸線を簡略化しているため、外側でもこの距離以内なら最寄りの都道府県とする
+        self.snap_km = snap_km
+        self._rings: List[Tuple[str, str, Ring, Tuple[float, float, float, float]]] = []
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        self._outlines: Dict[str, List[List[float]]] = {}
+        for pref in prefectures:
+            for polygon in pref["polygons"]:
+                ring = [(float(lon), float(lat)) for lon, lat in polygon]
+                if len(ring) < 3:
+                    continue
+                lons = [p[0] for p in ring]
+                lats = [p[1] for p in ring]
+                bbox = (min(lons), min(lats), max(lons), max(lats))
+                self._rings.append((pref["code"], pref["name"], ring, bbox))
+                self._outlines.setdefault(pref["name"], [[lat, lon] for lon, lat in ring])
+        margin = snap_km / KM_PER_DEG_LAT * 2
+        for i, (_, _, _, (west, south, east, north)) in enumerate(self._rings):
+            lat_lo, lon_lo = self._cell(south - margin, west - margin)
+            lat_hi, lon_hi = self._cell(north + margin, east + margin)
+            for ci in range(lat_lo, lat_hi + 1):
+                for cj in range(lon_lo, lon_hi + 1):
+                    self._cells.setdefault((ci, cj), []).append(i)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_BOUNDARY_PATH, **kwargs) -> "PrefectureIndex":
+        """境界データを読み込む。無い・壊れている場合は空のインデックス（常にNone）を返す"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                prefectures = json.load(f)["prefectures"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Prefecture boundaries not available (%s): %s", path, str(e))
+            prefectures = []
+        index = cls(prefectures, **kwargs)
+        logger.info("Prefecture index loaded: %d polygons, %d cells", len(index._rings), len(index._cells))
+        return index
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_size_deg)), int(math.floor(lon / self.cell_size_deg))
+
+    def outline(self, name: str) -> Optional[List[List[float]]]:
+        """地図表示用の境界（[緯度, 経度] の列。Leafletのpolygonにそのまま渡せる）"""
+        return self._outlines.get(name)
+
+    def lookup(self, lat: float, lon: float) -> Optional[PrefectureMatch]:
+        candidates = self._cells.get(self._cell(lat, lon), ())
+        for i in candidates:
+            code, name, ring, (west, south, east, north) = self._rings[i]
+            if west <= lon <= east and south <= lat <= north and _point_in_ring(ring, lon, lat):
+                return PrefectureMatch(code, name, 0.0)
+        nearest: Optional[PrefectureMatch] = None
+        for i in candidates:
+            code, name, ring, _ = self._rings[i]
+            distance = _distance_to_ring_km(ring, lon, lat)
+            if distance <= self.snap_km and (nearest is None or distance < nearest.distance_km):
+                nearest = PrefectureMatch(code, name, round(distance, 3))
+        return nearest
@@ -0,0 +1,227 @@
+import re
+import time
+import asyncio
+import bisect
+import hashlib
+import logging
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from jma_feeds import FeedEntry, FeedPoller, conditional_get
+from spatial import haversine
+
+logger = logging.getLogger(__name__)
+
+JMA_QUAKE_LIST_URL = "https://www.jma.go.jp/bosai/quake/data/list.json"
+
+# 気象庁の震度表記 → 整数の震度（従来のmaxScaleと同じく 10=震度1 … 70=震度7）
+INTENSITY_SCALES = {
+    "1": 10,
+    "2": 20,
+    "3": 30,
+    "4": 40,
+    "5-": 45,
+    "5+": 50,
+    "6-": 55,
+    "6+": 60,
+    "7": 70,
+}
+
+# 震源の座標（ISO 6709、例: "+35.7+140.1-30000/"。深さはメートル）
+_COORDINATE_RE = re.compile(r"([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)?/")
+
+Quake = namedtuple("Quake", [
+    "event_id", "time", "timestamp", "place", "max_scale", "magnitude",
+    "latitude", "longitude", "depth_km", "title", "reported_at",
+])
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_quake(item: dict) -> Optional[Quake]:
+    """list.json の1件を Quake にする。イベントIDか発生時刻が無いものは捨てる"""
+    event_id = item.get("eid")
+    origin_time = item.get("at")
+    timestamp = _parse_time(origin_time)
+    if not event_id or timestamp is None:
+        return None
+    latitude = longitude = depth_km = None
+    match = _COORDINATE_RE.match(item.get("cod") or "")
+    if match:
+        latitude, longitude = float(match.group(1)), float(match.group(2))
+        if match.group(3) is not None:
+            depth_km = round(-float(match.group(3)) / 1000, 1)
+    try:
+        magnitude = float(item["mag"]) if item.get("mag") not in (None, "") else None
+    except ValueError:
+        magnitude = None  # "Ｍ不明" など
+    return Quake(
+        event_id=str(event_id),
+        time=origin_time,
+        timestamp=timestamp,
+        place=item.get("anm") or None,
+        max_scale=INTENSITY_SCALES.get(item.get("maxi") or ""),
+        magnitude=magnitude,
+        latitude=latitude,
+        longitude=longitude,
+        depth_km=depth_km,
+        title=item.get("ttl") or None,
+        reported_at=item.get("rdt") or None,
+    )
+
+
+def merge_quake(old: Quake, new: Quake) -> Quake:
+    """同じ地震の続報で上書きする（震度速報には震源が無いなど、空の項目は前の報を残す）"""
+    if (new.reported_at or "") < (old.reported_at or ""):
+        old, new = new, old
+    return new._replace(**{field: getattr(old, field) for field in Quake._fields if getattr(new, field) is None})
+
+
+class QuakeHistory:
+    """地震の履歴（イベントIDで重複を除き、発生時刻順に保持する）"""
+
+    def __init__(self, max_events: int = 1000, max_age_seconds: float = 7 * 24 * 3600):
+        self.max_events = max_events
+        self.max_age_seconds = max_age_seconds
+        self._events: Dict[str, Quake] = {}
+        self._order: List[Tuple[float, str]] = []  # (発生時刻, イベントID) の昇順
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def ingest(self, items: List[dict]) -> int:
+        """新規または更新された地震の数を返す"""
+        changed = 0
+        # 一覧にはまだ残っていても、保持期間を過ぎた地震は取り込まない（毎回入れ直して捨てることになる）
+        cutoff = time.time() - self.max_age_seconds
+        for item in items:
+            quake = parse_quake(item)
+            if quake is None or quake.timestamp < cutoff:
+                continue
+            old = self._events.get(quake.event_id)
+            merged = quake if old is None else merge_quake(old, quake)
+            if merged != old:
+                self._events[quake.event_id] = merged
+                changed += 1
+        if changed:
+            self._rebuild()
+        return changed
+
+    def _rebuild(self) -> None:
+        order = sorted((quake.timestamp, event_id) for event_id, quake in self._events.items())
+        cutoff = time.time() - self.max_age_seconds
+        drop = max(bisect.bisect_left(order, (cutoff, "")), len(order) - self.max_events)
+        for _, event_id in order[:drop]:
+            del self._events[event_id]
+        self._order = order[drop:]
+
+    def query(self, since: Optional[float] = None, min_scale: Optional[int] = None,
+              lat: Optional[float] = None, lon: Optional[float] = None, radius_km: Optional[float] = None,
+              limit: int = 20) -> List[Tuple[Quake, Optional[float]]]:
+        """新しい順に (Quake, 指定地点からの距離km) を返す"""
+        start = bisect.bisect_left(self._order, (since, "")) if since is not None else 0
+        results: List[Tuple[Quake, Optional[float]]] = []
+        for _, event_id in reversed(self._order[start:]):
+            quake = self._events[event_id]
+            if min_scale is not None and (quake.max_scale is None or quake.max_scale < min_scale):
+                continue
+            distance = None
+            if lat is not None and lon is not None and quake.latitude is not None:
+                distance = haversine(lat, lon, quake.latitude, quake.longitude)
+            if radius_km is not None and (distance is None or distance > radius_km):
+                continue
+            results.append((quake, distance))
+            if len(results) >= limit:
+                break
+        return results
+
+
+class QuakeFeedPoller(FeedPoller):
+    """気象庁の地震情報の一覧を定期取得して QuakeHistory に取り込む（変化が無ければ解析しない）"""
+
+    name = "quake"
+
+    def __init__(self, client: httpx.AsyncClient, interval: float = 60.0, history: Optional[QuakeHistory] = None,
+                 stale_after: float = 600.0):
+        super().__init__(interval)
+        self.client = client
+        # これより古い（ポーリングが止まっている・失敗し続けている）場合は、リクエスト時に取り直しを試みる
+        self.stale_after = stale_after
+        self.history = history or QuakeHistory()
+        self._entry: Optional[FeedEntry] = None
+        self._digest: Optional[str] = None
+        self._load_lock = asyncio.Lock()
+        self.polls = 0
+        self.fetches = 0
+        self.not_modified = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.last_poll_at: Optional[float] = None
+
+    async def poll(self) -> int:
+        self.polls += 1
+        try:
+            res = await conditional_get(self.client, JMA_QUAKE_LIST_URL, self._entry)
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        self.last_poll_at = time.time()
+        if res is None:
+            self.not_modified += 1
+            self._entry.checked_at = self.last_poll_at
+            return 0
+        self.fetches += 1
+        # ETagが付かない・変わる場合に備えて本文のハッシュでも比較する
+        digest = hashlib.sha256(res.content).hexdigest()
+        entry = FeedEntry(None, etag=res.headers.get("etag"), last_modified=res.headers.get("last-modified"))
+        if digest == self._digest:
+            self._entry = entry
+            self.unchanged += 1
+            return 0
+        changed = self.history.ingest(res.json())
+        # 取り込めた本文の検証子だけを保存する（壊れた本文に304を返され続けないように）
+        self._entry = entry
+        self._digest = digest
+        if changed:
+            logger.info("JMA quake list ingested: %d new or updated, %d in history", changed, len(self.history))
+        return changed
+
+    def _is_stale(self) -> bool:
+        return self.last_poll_at is None or time.time() - self.last_poll_at > self.stale_after
+
+    async def ensure_loaded(self) -> None:
+        """まだ1度も取得できていない、または古すぎる場合だけ取りに行く"""
+        if self._digest is not None and not self._is_stale():
+            return
+        async with self._load_lock:
+            if self._digest is None:
+                await self.poll()
+            elif self._is_stale():
+                try:
+                    await self.poll()
+                except (httpx.HTTPError, ValueError) as e:
+                    # 取得できなければ古い履歴で答える
+                    logger.warning("Serving stale JMA quake list (polled %.0fs ago): %s", time.time() - self.last_poll_at, str(e))
+
+    def metrics(self) -> dict:
+        now = time.time()
+        return {
+            "events": len(self.history),
+            "interval": self.interval,
+            "polls": self.polls,
+            "fetches": self.fetches,
+            "not_modified": self.not_modified,
+            "unchanged": self.unchanged,
+            "errors": self.errors,
+            "last_poll_age_seconds": round(now - self.last_poll_at, 1) if self.last_poll_at else None,
+        }
@@ -96,6 +96,35 @@ class Shelter(BaseModel):
     class Config:
         from_attributes = True
 
+class NearestShelter(BaseModel):
+    id: int
+    name: str
+    address: str
+    latitude: float
+    longitude: float
+    capacity: int
+    current_occupancy: int
+    available: int
+    status: str
+    distance_km: float
+
+class ShelterChanges(BaseModel):
+    cursor: int  # 次回のsinceに渡す値
+    reset: bool = False  # Trueならsheltersは全件（手元の一覧を置き換える）
+    has_more: bool = False  # Trueならcursorで続きを取得する
+    shelters: List[Shelter] = []  # 作成・更新された避難所（現在の内容）
+    deleted: List[int] = []  # 削除された避難所ID
+
+class AlertPoint(BaseModel):
+    lat: float
+    lon: float
+
+class AlertQuery(BaseModel):
+    points: List[AlertPoint] = Field(..., min_length=1, max_length=500)
+    kinds: Optional[List[str]] = None  # 警報・注意報の種別コード（"03"）または名称（"大雨警報"）
+    include_inactive: bool = False  # Trueなら解除されたものも含める
+    level: Optional[int] = 0  # 区域の階層（0=一次細分区域、1=市町村等、Noneなら全て）
+
 class CompanyCreateSchema(BaseModel):
     name: str
     email: EmailStr
@@ -0,0 +1,105 @@
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+from fastapi.responses import JSONResponse
+
+from models import Shelter as ShelterModel
+
+try:
+    import orjson
+except ImportError:  # orjsonが無ければ標準のjsonで出力する
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# 避難所の属性（APIではattributesにまとめる）
+SHELTER_ATTRIBUTE_COLUMNS = [
+    ShelterModel.pets_allowed,
+    ShelterModel.barrier_free,
+    ShelterModel.toilet_available,
+    ShelterModel.food_available,
+    ShelterModel.medical_available,
+    ShelterModel.wifi_available,
+    ShelterModel.charging_available,
+    ShelterModel.equipment,
+]
+
+# APIの項目とSELECTする列（photosはshelter_photosから別に取得）
+SHELTER_FIELD_COLUMNS = {
+    "id": [ShelterModel.id],
+    "name": [ShelterModel.name],
+    "address": [ShelterModel.address],
+    "latitude": [ShelterModel.latitude],
+    "longitude": [ShelterModel.longitude],
+    "capacity": [ShelterModel.capacity],
+    "current_occupancy": [ShelterModel.current_occupancy],
+    "attributes": SHELTER_ATTRIBUTE_COLUMNS,
+    "photos": [],
+    "contact": [ShelterModel.contact],
+    "operator": [ShelterModel.operator],
+    "opened_at": [ShelterModel.opened_at],
+    "status": [ShelterModel.status],
+    "updated_at": [ShelterModel.updated_at],
+    "company_id": [ShelterModel.company_id],
+}
+SHELTER_FIELDS = list(SHELTER_FIELD_COLUMNS)
+SHELTER_COLUMNS = [column for name in SHELTER_FIELDS for column in SHELTER_FIELD_COLUMNS[name]]
+
+
+def shelter_columns(fields: Iterable[str] = SHELTER_FIELDS) -> list:
+    columns = []
+    for name in fields:
+        columns.extend(SHELTER_FIELD_COLUMNS[name])
+    return columns
+
+
+def serialize_shelter(values: Mapping, fields: Iterable[str] = SHELTER_FIELDS, photos: Optional[List[str]] = None) -> dict:
+    """列名→値のマッピング（SQLの行またはORMから作ったもの）をAPIの形にする"""
+    item = {}
+    for name in fields:
+        if name == "attributes":
+            item["attributes"] = {
+                "pets_allowed": values["pets_allowed"],
+                "barrier_free": values["barrier_free"],
+                "toilet_available": values["toilet_available"],
+                "food_available": values["food_available"],
+                "medical_available": values["medical_available"],
+                "wifi_available": values["wifi_available"],
+                "charging_available": values["charging_available"],
+                "equipment": values["equipment"] or "",
+            }
+        elif name == "photos":
+            item["photos"] = photos or []
+        elif name == "opened_at" or name == "updated_at":
+            value = values[name]
+            item[name] = value.isoformat() if value else None
+        else:
+            item[name] = values[name]
+    return item
+
+
+def serialize_shelter_rows(rows, fields: Iterable[str] = SHELTER_FIELDS, photos_by_shelter: Optional[Dict[int, List[str]]] = None) -> List[dict]:
+    """query.with_entities(*shelter_columns(fields)) の結果をそのまま変換（ORMオブジェクトを作らない）"""
+    fields = list(fields)
+    photos_by_shelter = photos_by_shelter or {}
+    return [serialize_shelter(row._mapping, fields, photos_by_shelter.get(row.id)) for row in rows]
+
+
+def serialize_shelter_model(shelter: ShelterModel, photos: Optional[List[str]] = None) -> dict:
+    """作成・更新直後など、ORMオブジェクトが手元にある場合"""
+    values = {column.key: getattr(shelter, column.key) for column in SHELTER_COLUMNS}
+    return serialize_shelter(values, SHELTER_FIELDS, photos)
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """シリアライズ済みの辞書をそのまま出力する（response_modelでの再検証を行わない）"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
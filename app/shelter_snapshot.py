@@ -0,0 +1,91 @@
+import gzip
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from compression import accepted_encodings, brotli
+from serializers import dumps
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """エンコード済みの一覧（本文・圧縮版・ETagを1回だけ作って使い回す）"""
+
+    def __init__(self, items: List[dict], version: int):
+        self.items = items
+        self.version = version
+        self.body = dumps(items)
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self.gzip = gzip.compress(self.body, compresslevel=6, mtime=0)
+        self.br = brotli.compress(self.body, quality=5) if brotli is not None else None
+        self.built_at = time.monotonic()
+        self.latest: Optional[int] = None  # 作成前に読んだ最新の変更番号
+
+    def encoded(self, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """Accept-Encodingに合わせた本文と Content-Encoding を返す"""
+        accepted = accepted_encodings(accept_encoding or "")
+        if self.br is not None and "br" in accepted:
+            return self.br, "br"
+        if "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.body, None
+
+
+class ShelterSnapshot:
+    """公開用の避難所一覧のスナップショット。更新系APIとワーカー間の配信で無効化する
+
+    配信を経由しない書き込みや配信の取りこぼしに備えて、最新の変更番号が作成時と違う場合も作り直す
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0):
+        # 配信を取りこぼした場合に備えて一定時間で作り直す
+        self.ttl_seconds = ttl_seconds
+        self._snapshot: Optional[Snapshot] = None
+        self._generation = 0
+        self._built_generation = -1
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+
+    def invalidate(self) -> None:
+        self._generation += 1
+
+    def _is_fresh(self, latest: Optional[int]) -> bool:
+        snapshot = self._snapshot
+        return (
+            snapshot is not None
+            and self._built_generation == self._generation
+            and (latest is None or snapshot.latest == latest)
+            and time.monotonic() - snapshot.built_at <= self.ttl_seconds
+        )
+
+    def get(self, build: Callable[[], Tuple[List[dict], int]], latest: Optional[int] = None) -> Snapshot:
+        """build() は (一覧, 版数) を返す。作り直しは同時に1回だけ行い、待っていたリクエストはその結果を使う
+
+        latest には呼び出し側で読んだ最新の変更番号を渡す（作成時と異なれば作り直す）
+        """
+        if self._is_fresh(latest):
+            self.hits += 1
+            return self._snapshot
+        with self._lock:
+            if self._is_fresh(latest):
+                self.hits += 1
+                return self._snapshot
+            # 作成中に無効化された場合は次のリクエストで作り直す
+            generation = self._generation
+            items, version = build()
+            snapshot = Snapshot(items, version)
+            # 一覧より先に読んだ番号を記録する（作成中の変更は次のリクエストで作り直して拾う）
+            snapshot.latest = latest
+            self._snapshot = snapshot
+            self._built_generation = generation
+            self.builds += 1
+            logger.info(
+                "Shelter snapshot rebuilt: %d shelters, %d bytes (gzip %d, br %s), version=%s",
+                len(items), len(snapshot.body), len(snapshot.gzip),
+                len(snapshot.br) if snapshot.br is not None else "-", version,
+            )
+            return snapshot
@@ -0,0 +1,234 @@
+import heapq
+import math
+import threading
+import time
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+# 緯度1度あたりの距離（km）
+KM_PER_DEG_LAT = 111.32
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def bounding_box(lat: float, lon: float, distance_km: float) -> Tuple[float, float, float, float]:
+    """中心点から半径distance_kmを含む矩形 (min_lat, max_lat, min_lon, max_lon) を返す"""
+    dlat = distance_km / KM_PER_DEG_LAT
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6:
+        dlon = 180.0
+    else:
+        dlon = min(180.0, distance_km / (KM_PER_DEG_LAT * cos_lat))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+class ShelterGridIndex:
+    """避難所の位置を緯度経度グリッドで管理するインメモリ空間インデックス"""
+
+    def __init__(self, cell_size_deg: float = 0.1, ttl_seconds: float = 60.0):
+        self.cell_size_deg = cell_size_deg
+        self.ttl_seconds = ttl_seconds
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._points: Dict[int, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._built_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_size_deg)), int(math.floor(lon / self.cell_size_deg))
+
+    def is_stale(self) -> bool:
+        # 他ワーカーでの更新を拾うため、一定時間ごとに再構築する
+        if self._built_at is None:
+            return True
+        return time.monotonic() - self._built_at > self.ttl_seconds
+
+    def invalidate(self) -> None:
+        self._built_at = None
+
+    def rebuild(self, rows: Iterable[Tuple[int, float, float]]) -> None:
+        cells: Dict[Tuple[int, int], Set[int]] = {}
+        points: Dict[int, Tuple[float, float]] = {}
+        for shelter_id, lat, lon in rows:
+            if lat is None or lon is None:
+                continue
+            points[shelter_id] = (lat, lon)
+            cells.setdefault(self._cell(lat, lon), set()).add(shelter_id)
+        with self._lock:
+            self._cells = cells
+            self._points = points
+            self._built_at = time.monotonic()
+        logger.info("Shelter grid index rebuilt: %d shelters, %d cells", len(points), len(cells))
+
+    def upsert(self, shelter_id: int, lat: Optional[float], lon: Optional[float]) -> None:
+        with self._lock:
+            self._discard(shelter_id)
+            if lat is None or lon is None:
+                return
+            self._points[shelter_id] = (lat, lon)
+            self._cells.setdefault(self._cell(lat, lon), set()).add(shelter_id)
+
+    def remove(self, shelter_id: int) -> None:
+        with self._lock:
+            self._discard(shelter_id)
+
+    def _discard(self, shelter_id: int) -> None:
+        point = self._points.pop(shelter_id, None)
+        if point is None:
+            return
+        key = self._cell(*point)
+        bucket = self._cells.get(key)
+        if bucket is not None:
+            bucket.discard(shelter_id)
+            if not bucket:
+                del self._cells[key]
+
+    def within(self, lat: float, lon: float, distance_km: float) -> Dict[int, float]:
+        """半径distance_km以内の避難所IDと距離(km)を返す"""
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, distance_km)
+        lat_lo, lon_lo = self._cell(min_lat, min_lon)
+        lat_hi, lon_hi = self._cell(max_lat, max_lon)
+        result: Dict[int, float] = {}
+        with self._lock:
+            # 範囲のセル数が登録数より多い（広域の検索）なら、セルを走査せず全点を判定する
+            if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > len(self._points):
+                for shelter_id, (s_lat, s_lon) in self._points.items():
+                    if min_lat <= s_lat <= max_lat and min_lon <= s_lon <= max_lon:
+                        dist = haversine(lat, lon, s_lat, s_lon)
+                        if dist <= distance_km:
+                            result[shelter_id] = dist
+                return result
+            for i in range(lat_lo, lat_hi + 1):
+                for j in range(lon_lo, lon_hi + 1):
+                    for shelter_id in self._cells.get((i, j), ()):
+                        s_lat, s_lon = self._points[shelter_id]
+                        dist = haversine(lat, lon, s_lat, s_lon)
+                        if dist <= distance_km:
+                            result[shelter_id] = dist
+        return result
+
+    def _ring(self, ci: int, cj: int, r: int) -> List[int]:
+        if r == 0:
+            return list(self._cells.get((ci, cj), ()))
+        ids: List[int] = []
+        for i in range(ci - r, ci + r + 1):
+            for j in (cj - r, cj + r):
+                ids.extend(self._cells.get((i, j), ()))
+        for j in range(cj - r + 1, cj + r):
+            for i in (ci - r, ci + r):
+                ids.extend(self._cells.get((i, j), ()))
+        return ids
+
+    def _scanned_radius_km(self, lat: float, lon: float, ci: int, cj: int, r: int) -> float:
+        # 走査済みの矩形の外にある点までの最短距離（下限）
+        south = (ci - r) * self.cell_size_deg
+        north = (ci + r + 1) * self.cell_size_deg
+        west = (cj - r) * self.cell_size_deg
+        east = (cj + r + 1) * self.cell_size_deg
+        to_lat = math.radians(min(lat - south, north - lat)) * EARTH_RADIUS_KM
+        dlon = math.radians(min(lon - west, east - lon, 90.0))
+        to_lon = math.asin(min(1.0, math.sin(dlon) * math.cos(math.radians(lat)))) * EARTH_RADIUS_KM
+        return min(to_lat, to_lon)
+
+    def iter_nearest(self, lat: float, lon: float, max_distance_km: Optional[float] = None) -> Iterator[Tuple[int, float]]:
+        """近い順に (避難所ID, 距離km) を返す。セルをリング状に広げ、確定した分から順次返す"""
+        ci, cj = self._cell(lat, lon)
+        total = len(self._points)
+        seen = 0
+        heap: List[Tuple[float, int]] = []
+        r = 0
+        while True:
+            with self._lock:
+                for shelter_id in self._ring(ci, cj, r):
+                    point = self._points.get(shelter_id)
+                    if point is None:
+                        continue
+                    seen += 1
+                    heapq.heappush(heap, (haversine(lat, lon, point[0], point[1]), shelter_id))
+            exhausted = seen >= total or r * self.cell_size_deg > 360
+            bound = float("inf") if exhausted else self._scanned_radius_km(lat, lon, ci, cj, r)
+            if max_distance_km is not None:
+                bound = min(bound, max_distance_km)
+            while heap and heap[0][0] <= bound:
+                dist, shelter_id = heapq.heappop(heap)
+                yield shelter_id, dist
+            if exhausted or (max_distance_km is not None and bound >= max_distance_km):
+                return
+            r += 1
+
+
+class BoundingBoxIndex:
+    """矩形（WebSocketの購読範囲など）を格子に登録し、点を含む矩形を引くインデックス"""
+
+    def __init__(self, cell_size_deg: float = 1.0, max_cells: int = 400):
+        self.cell_size_deg = cell_size_deg
+        # 格子に載せると大きすぎる矩形（全国規模など）は別枠で線形に判定する
+        self.max_cells = max_cells
+        self._cells: Dict[Tuple[int, int], Set[str]] = {}
+        self._boxes: Dict[str, Tuple[float, float, float, float]] = {}
+        self._wide: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_size_deg)), int(math.floor(lon / self.cell_size_deg))
+
+    def _cell_range(self, box: Tuple[float, float, float, float]) -> Tuple[int, int, int, int]:
+        min_lat, min_lon, max_lat, max_lon = box
+        lat_lo, lon_lo = self._cell(min_lat, min_lon)
+        lat_hi, lon_hi = self._cell(max_lat, max_lon)
+        return lat_lo, lon_lo, lat_hi, lon_hi
+
+    def add(self, key: str, box: Tuple[float, float, float, float]) -> None:
+        """box は (min_lat, min_lon, max_lat, max_lon)"""
+        self.remove(key)
+        self._boxes[key] = box
+        lat_lo, lon_lo, lat_hi, lon_hi = self._cell_range(box)
+        if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > self.max_cells:
+            self._wide.add(key)
+            return
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lon_lo, lon_hi + 1):
+                self._cells.setdefault((i, j), set()).add(key)
+
+    def remove(self, key: str) -> None:
+        box = self._boxes.pop(key, None)
+        if box is None:
+            return
+        if key in self._wide:
+            self._wide.discard(key)
+            return
+        lat_lo, lon_lo, lat_hi, lon_hi = self._cell_range(box)
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lon_lo, lon_hi + 1):
+                bucket = self._cells.get((i, j))
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._cells[(i, j)]
+
+    def containing(self, lat: float, lon: float) -> Set[str]:
+        result: Set[str] = set()
+        for key in self._cells.get(self._cell(lat, lon), ()):
+            if self._contains(self._boxes[key], lat, lon):
+                result.add(key)
+        for key in self._wide:
+            if self._contains(self._boxes[key], lat, lon):
+                result.add(key)
+        return result
+
+    @staticmethod
+    def _contains(box: Tuple[float, float, float, float], lat: float, lon: float) -> bool:
+        min_lat, min_lon, max_lat, max_lon = box
+        return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
@@ -7,6 +7,15 @@ let markers = [];
 let adminMarkers = [];
 let alertPolygons = [];
 
+// WebSocket差分の適用状態
+let shelterCache = [];       // 描画中の避難所一覧
+let shelterVersion = null;   // shelterCacheが反映済みの変更番号（X-Shelter-Version）
+let shelterSeq = null;       // 最後に受け取った配信番号
+let shelterFetches = 0;      // 取得中のリクエスト数
+let pendingDeltas = [];      // 取得中に届いた差分（取得後に適用し直す）
+let shelterSocket = null;    // /ws/shelters の接続
+let shelterSubscription = ""; // 送信済みの購読条件（クエリ文字列）
+
 
 /**
  * Yahoo ジオコーディング API で住所を緯度経度に変換
@@ -24,38 +33,80 @@ async function geocodeAddressViaBackend(address) {
 }
 
 
+/**
+ * 現在の絞り込み条件
+ */
+function buildShelterQuery() {
+  const search = document.getElementById("search")?.value || "";
+  const status = document.getElementById("filter-status")?.value || "";
+  const maxDist = parseFloat(document.getElementById("filter-distance")?.value || "0");
+  const form = document.getElementById("filter-form");
+  const params = new URLSearchParams();
+
+  if (search) params.append("search", search);
+  if (status) params.append("status", status);
+  if (maxDist > 0 && userLocation) {
+    params.append("distance", maxDist);
+    params.append("latitude", userLocation[0]);
+    params.append("longitude", userLocation[1]);
+  }
+
+  const attributes = [
+    "pets_allowed",
+    "barrier_free",
+    "toilet_available",
+    "food_available",
+    "medical_available",
+    "wifi_available",
+    "charging_available",
+  ];
+  attributes.forEach((name) => {
+    if (form?.elements[name]?.checked) params.append(name, "true");
+  });
+  return params;
+}
+
+/**
+ * WebSocketの購読条件（距離で絞り込み中は周辺の矩形のみ購読し、それ以外は全件）
+ */
+function buildShelterSubscription() {
+  const maxDist = parseFloat(document.getElementById("filter-distance")?.value || "0");
+  const params = new URLSearchParams();
+  if (maxDist > 0 && userLocation) {
+    const [lat, lon] = userLocation;
+    const dLat = maxDist / 111.32;
+    const dLon = maxDist / (111.32 * Math.max(Math.cos((lat * Math.PI) / 180), 0.01));
+    const bbox = [lon - dLon, lat - dLat, lon + dLon, lat + dLat].map((v) => v.toFixed(4));
+    params.append("bbox", bbox.join(","));
+  }
+  return params.toString();
+}
+
+function syncShelterSubscription() {
+  const subscription = buildShelterSubscription();
+  if (subscription === shelterSubscription) return;
+  shelterSubscription = subscription;
+  if (shelterSocket?.readyState === WebSocket.OPEN) {
+    const params = Object.fromEntries(new URLSearchParams(subscription));
+    shelterSocket.send(JSON.stringify({ type: "subscribe", ...params }));
+  }
+}
+
+function renderShelters(shelters) {
+  updateShelterList(shelters);
+  updateMap(shelters);
+  updateAdminShelterList(shelters);
+  updateAdminMap(shelters);
+}
+
 /**
  * 避難所を取得
  */
 async function fetchShelters() {
+  shelterFetches += 1;
   try {
-    const search = document.getElementById("search")?.value || "";
-    const status = document.getElementById("filter-status")?.value || "";
-    const maxDist = parseFloat(document.getElementById("filter-distance")?.value || "0");
-    const form = document.getElementById("filter-form");
-    const params = new URLSearchParams();
-
-    if (search) params.append("search", search);
-    if (status) params.append("status", status);
-    if (maxDist > 0 && userLocation) {
-      params.append("distance", maxDist);
-      params.append("latitude", userLocation[0]);
-      params.append("longitude", userLocation[1]);
-    }
-
-    const attributes = [
-      "pets_allowed",
-      "barrier_free",
-      "toilet_available",
-      "food_available",
-      "medical_available",
-      "wifi_available",
-      "charging_available",
-    ];
-    attributes.forEach((name) => {
-      if (form?.elements[name]?.checked) params.append(name, "true");
-    });
-
+    syncShelterSubscription();
+    const params = buildShelterQuery();
     console.log("[fetchShelters] Query:", params.toString());
     const token = localStorage.getItem("auth_token") || "";
     const res = await fetch(`/api/shelters?${params}`, {
@@ -72,16 +123,147 @@ async function fetchShelters() {
 
     const shelters = await res.json() || [];
     console.log("[fetchShelters] Shelters:", shelters.length, shelters[0] || "なし");
-    updateShelterList(shelters);
-    updateMap(shelters);
-    updateAdminShelterList(shelters);
-    updateAdminMap(shelters);
+    const version = parseInt(res.headers.get("X-Shelter-Version") || "", 10);
+    shelterCache = shelters;
+    shelterVersion = Number.isNaN(version) ? null : version;
+    shelterFetches -= 1;
+    if (shelterFetches === 0 && pendingDeltas.length) {
+      // 取得中に届いた差分のうち、一覧に含まれていない新しいものを適用
+      const deltas = pendingDeltas;
+      pendingDeltas = [];
+      if (!deltas.every(applyShelterDelta)) {
+        fetchShelters();
+        return;
+      }
+    }
+    renderShelters(shelterCache);
   } catch (e) {
+    shelterFetches -= 1;
     console.error("[fetchShelters] Error:", e.message);
-    updateShelterList([]);
-    updateMap([]);
-    updateAdminShelterList([]);
-    updateAdminMap([]);
+    shelterCache = [];
+    shelterVersion = null;
+    renderShelters([]);
+  }
+}
+
+
+/**
+ * 前回の取得以降の変更だけを取得して反映（全件取得の代わりに定期実行する）
+ */
+async function syncShelterChanges() {
+  if (shelterVersion === null) return fetchShelters();
+  if (shelterFetches > 0) return;
+  try {
+    const changed = new Map();
+    const deleted = new Set();
+    let cursor = shelterVersion;
+    let data;
+    do {
+      const res = await fetch(`/api/shelters/changes?since=${cursor}`);
+      if (!res.ok) throw new Error(`API error: ${res.status}`);
+      data = await res.json();
+      if (data.reset) return fetchShelters(); // 履歴が残っていない
+      data.shelters.forEach((s) => { changed.set(s.id, s); deleted.delete(s.id); });
+      data.deleted.forEach((id) => { deleted.add(id); changed.delete(id); });
+      cursor = data.cursor;
+    } while (data.has_more);
+
+    console.log("[syncShelterChanges] Changes:", changed.size, "deleted:", deleted.size);
+    if (changed.size || deleted.size) {
+      // 絞り込み中は一致判定をサーバーに任せる
+      if (buildShelterQuery().toString() !== "" && changed.size) return fetchShelters();
+      shelterCache = shelterCache.filter((s) => !deleted.has(s.id)).map((s) => changed.get(s.id) || s);
+      const known = new Set(shelterCache.map((s) => s.id));
+      changed.forEach((s, id) => { if (!known.has(id)) shelterCache.push(s); });
+      renderShelters(shelterCache);
+    }
+    // サーバーのカーソルは欠番の手前で止まるため、そのまま使う
+    shelterVersion = cursor;
+  } catch (e) {
+    console.error("[syncShelterChanges] Error:", e.message);
+    fetchShelters();
+  }
+}
+
+
+// 絞り込みの判定に影響しない項目（これだけの変更なら絞り込み中でも手元で反映できる）
+const FILTER_NEUTRAL_FIELDS = ["current_occupancy", "capacity", "updated_at", "photos", "contact", "operator", "opened_at", "company_id"];
+
+/**
+ * WebSocketの差分をshelterCacheへ適用（反映できない場合はfalseを返し、呼び出し側で取り直す）
+ */
+function applyShelterDelta(msg) {
+  // 版数は全体の通し番号で、購読範囲外の更新は届かないため飛ぶのが普通（取りこぼしはseqで検知する）
+  if (msg.version != null && shelterVersion != null && msg.version <= shelterVersion) {
+    return true; // 取得済みの一覧に含まれている
+  }
+  const filtered = buildShelterQuery().toString() !== "";
+  switch (msg.action) {
+    case "create":
+      if (!msg.shelter || filtered) return false;
+      shelterCache = shelterCache.filter((s) => s.id !== msg.shelter.id).concat([msg.shelter]);
+      break;
+    case "update":
+    case "bulk_update": {
+      const changes = msg.changes || {};
+      if (filtered && Object.keys(changes).some((key) => !FILTER_NEUTRAL_FIELDS.includes(key))) return false;
+      const { attributes, ...fields } = changes;
+      for (const id of msg.shelter_ids || [msg.shelter_id]) {
+        const shelter = shelterCache.find((s) => s.id === id);
+        if (!shelter) {
+          if (!filtered) return false; // 手元に無い避難所の更新
+          continue;
+        }
+        Object.assign(shelter, fields);
+        if (attributes) shelter.attributes = { ...shelter.attributes, ...attributes };
+      }
+      break;
+    }
+    case "delete":
+    case "bulk_delete": {
+      const ids = msg.shelter_ids || [msg.shelter_id];
+      shelterCache = shelterCache.filter((s) => !ids.includes(s.id));
+      break;
+    }
+    default:
+      return false; // resync など
+  }
+  // カーソルは進めない（コミット順と番号順が異なる場合があるため、差分APIの欠番判定に任せる）
+  return true;
+}
+
+/**
+ * WebSocketで受け取った更新を処理（欠番や適用できない差分のときだけ一覧を取り直す）
+ */
+function handleShelterMessage(msg) {
+  if (msg.type === "hello") {
+    // 再接続時は切断中の更新を取りこぼしているため取り直す
+    const reconnected = shelterSeq !== null;
+    shelterSeq = msg.seq;
+    if (reconnected) syncShelterChanges();
+    return;
+  }
+  if (msg.type) {
+    if (msg.type === "error") console.warn("[WebSocket]", msg.detail);
+    return; // subscribed など
+  }
+  if (typeof msg.seq === "number") {
+    const gap = shelterSeq !== null && msg.seq !== shelterSeq + 1;
+    shelterSeq = msg.seq;
+    if (gap) {
+      console.warn("[WebSocket] Missed updates, resyncing");
+      syncShelterChanges();
+      return;
+    }
+  }
+  if (shelterFetches > 0) {
+    pendingDeltas.push(msg);
+    return;
+  }
+  if (applyShelterDelta(msg)) {
+    renderShelters(shelterCache);
+  } else {
+    fetchShelters();
   }
 }
 
@@ -165,7 +347,7 @@ return `
         ? `<div class="photo-gallery mb-2">${shelter.photos
             .map(
               (p) =>
-                `<img src="${p}" class="photo-preview me-1 rounded" style="width:100px;cursor:pointer;" alt="サムネイル" onerror="this.src='/static/placeholder.jpg'">`
+                `<img src="${p}?size=thumb" data-full="${p}" class="photo-preview me-1 rounded" style="width:100px;cursor:pointer;" alt="サムネイル" loading="lazy" onerror="this.src='/static/placeholder.jpg'">`
             )
             .join("")}</div>`
         : ""
@@ -546,7 +728,7 @@ function updateAdminShelterList(shelters) {
                             ? `<div class="photo-gallery">${shelter.photos
                                 .map(
                                   (p) =>
-                                    `<img src="${p}" class="photo-preview" alt="サムネイル" onerror="this.src='/static/placeholder.jpg'">`
+                                    `<img src="${p}?size=thumb" data-full="${p}" class="photo-preview" alt="サムネイル" loading="lazy" onerror="this.src='/static/placeholder.jpg'">`
                                 )
                                 .join("")}</div>`
                             : "<p>写真なし</p>"
@@ -716,7 +898,7 @@ async function showDetails(shelterId) {
           ? `<div class="photo-gallery">${shelter.photos
               .map(
                 (p) =>
-                  `<img src="${p}" class="photo-preview" alt="サムネイル" onerror="this.src='/static/placeholder.jpg'">`
+                  `<img src="${p}?size=thumb" data-full="${p}" class="photo-preview" alt="サムネイル" loading="lazy" onerror="this.src='/static/placeholder.jpg'">`
               )
               .join("")}</div>`
           : "<p>写真なし</p>"
@@ -1225,7 +1407,7 @@ document.addEventListener("DOMContentLoaded", () => {
       if (ev.target.classList.contains("photo-preview")) {
         const modalImg = document.getElementById("modalImg");
         if (modalImg) {
-          modalImg.src = ev.target.src;
+          modalImg.src = ev.target.dataset.full || ev.target.src;
           new bootstrap.Modal(document.getElementById("imageModal")).show();
         }
       }
@@ -1234,27 +1416,34 @@ document.addEventListener("DOMContentLoaded", () => {
 
   // ✅ WebSocket 設定
   const proto = location.protocol === "https:" ? "wss://" : "ws://";
-  let ws = new WebSocket(`${proto}${location.host}/ws/shelters?token=${encodeURIComponent(localStorage.getItem("auth_token") || "")}`);
-  ws.onopen = () => console.log("[WebSocket] Connected");
-  ws.onerror = (e) => console.error("[WebSocket] Error:", e);
-  ws.onmessage = (e) => {
-    try {
-      const data = JSON.parse(e.data);
-      console.log("[WebSocket] Received:", data);
-      fetchShelters();
-    } catch (err) {
-      console.error("[WebSocket] Parse error:", err.message);
-    }
-  };
-  ws.onclose = () => {
-    console.log("[WebSocket] Disconnected, reconnecting...");
-    setTimeout(() => {
-      const reconnectWs = new WebSocket(`${proto}${location.host}/ws/shelters?token=${encodeURIComponent(localStorage.getItem("auth_token") || "")}`);
-      ws = reconnectWs;
-    }, 5000);
-  };
+  function connectShelterSocket() {
+    shelterSubscription = buildShelterSubscription();
+    const subscription = shelterSubscription ? `&${shelterSubscription}` : "";
+    const ws = new WebSocket(`${proto}${location.host}/ws/shelters?token=${encodeURIComponent(localStorage.getItem("auth_token") || "")}${subscription}`);
+    shelterSocket = ws;
+    ws.onopen = () => console.log("[WebSocket] Connected");
+    ws.onerror = (e) => console.error("[WebSocket] Error:", e);
+    ws.onmessage = (e) => {
+      try {
+        const data = JSON.parse(e.data);
+        if (data.type === "ping") {
+          ws.send(JSON.stringify({ type: "pong", ts: data.ts }));
+          return;
+        }
+        console.log("[WebSocket] Received:", data);
+        handleShelterMessage(data);
+      } catch (err) {
+        console.error("[WebSocket] Parse error:", err.message);
+      }
+    };
+    ws.onclose = () => {
+      console.log("[WebSocket] Disconnected, reconnecting...");
+      setTimeout(connectShelterSocket, 5000);
+    };
+  }
+  connectShelterSocket();
 
   // ✅ 定期更新（5分ごと）
   setInterval(fetchAlerts, 5 * 60 * 1000);
-  setInterval(fetchShelters, 5 * 60 * 1000);
+  setInterval(syncShelterChanges, 5 * 60 * 1000);
 });
@@ -0,0 +1,124 @@
+import os
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import mimetypes
+from typing import Dict
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from compression import accepted_encodings, brotli
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+# ビルド成果物（ハッシュ付きファイル名・事前圧縮版・manifest.json）
+DIST_DIR_NAME = "dist"
+MANIFEST_NAME = "manifest.json"
+
+COMPRESSIBLE_EXTENSIONS = (".js", ".css", ".html", ".svg", ".json", ".txt", ".map")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# ハッシュ無しのURLは内容が変わりうるため毎回再検証させる
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def build_static(static_dir: str = STATIC_DIR) -> Dict[str, str]:
+    """static/ 以下をハッシュ付きファイル名で dist/ に出力し、.gz/.br を作って manifest.json を書く"""
+    dist_dir = os.path.join(static_dir, DIST_DIR_NAME)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    manifest: Dict[str, str] = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist_dir)
+        for name in sorted(files):
+            if name.endswith((".gz", ".br")):
+                continue
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, static_dir).replace(os.sep, "/")
+            with open(src, "rb") as f:
+                data = f.read()
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            dest = os.path.join(dist_dir, *hashed.split("/"))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, "wb") as f:
+                f.write(data)
+            if ext.lower() in COMPRESSIBLE_EXTENSIONS:
+                with open(dest + ".gz", "wb") as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(dest + ".br", "wb") as f:
+                        f.write(brotli.compress(data, quality=11))
+            manifest[rel] = f"{DIST_DIR_NAME}/{hashed}"
+            logger.info("Built static asset: %s -> %s", rel, hashed)
+    os.makedirs(dist_dir, exist_ok=True)
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir: str = STATIC_DIR) -> Dict[str, str]:
+    path = os.path.join(static_dir, DIST_DIR_NAME, MANIFEST_NAME)
+    if not os.path.exists(path):
+        logger.info("Static manifest not found, serving unhashed assets: %s", path)
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class StaticAssets(StaticFiles):
+    """事前圧縮版（.br/.gz）があればそれを返し、ハッシュ付きファイルには長期キャッシュを付ける"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = load_manifest(self.directory) if self.directory else {}
+
+    def url(self, name: str) -> str:
+        """テンプレート用。ビルド済みならハッシュ付きURLを返す"""
+        return "/static/" + self.manifest.get(name, name)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        rel = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if rel.startswith(DIST_DIR_NAME + "/") else REVALIDATE_CACHE_CONTROL,
+        }
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        path, stat_result_to_send = full_path, stat_result
+        if full_path.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+                if encoding in accepted and os.path.isfile(full_path + suffix):
+                    path = full_path + suffix
+                    stat_result_to_send = os.stat(path)
+                    headers["Content-Encoding"] = encoding
+                    break
+        response = FileResponse(
+            path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_result_to_send,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+if __name__ == "__main__":
+    # 使い方: python static_assets.py build（デプロイ時に実行）
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print("Usage: python static_assets.py build")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    built = build_static()
+    print(f"Built {len(built)} static assets into {os.path.join(STATIC_DIR, DIST_DIR_NAME)}")
@@ -0,0 +1,248 @@
+import time
+import asyncio
+import logging
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, namedtuple
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from jma_feeds import FeedPoller
+
+logger = logging.getLogger(__name__)
+
+JMA_EQVOL_FEED_URL = "https://www.data.jma.go.jp/developer/xml/feed/eqvol.xml"
+JMA_XML_HEADERS = {"User-Agent": "SafeShelterApp/1.0 (contact@example.com)"}
+
+TsunamiArea = namedtuple("TsunamiArea", ["name", "code", "category", "grade"])
+FeedItem = namedtuple("FeedItem", ["id", "title", "updated", "link"])
+
+# 都道府県名を含まない津波予報区（部分一致では拾えないもの）
+TSUNAMI_AREA_ALIASES = {
+    "青森県": ["陸奥湾"],
+    "千葉県": ["東京湾内湾"],
+    "東京都": ["東京湾内湾", "伊豆諸島", "小笠原諸島"],
+    "神奈川県": ["東京湾内湾", "相模湾・三浦半島"],
+    "新潟県": ["佐渡"],
+    "愛知県": ["伊勢・三河湾"],
+    "三重県": ["伊勢・三河湾"],
+    "島根県": ["隠岐"],
+    "福岡県": ["有明・八代海"],
+    "佐賀県": ["有明・八代海"],
+    "長崎県": ["壱岐・対馬", "有明・八代海"],
+    "熊本県": ["有明・八代海"],
+    "鹿児島県": ["種子島・屋久島地方", "奄美群島・トカラ列島"],
+    "沖縄県": ["沖縄本島地方", "大東島地方", "宮古島・八重山地方"],
+}
+
+
+def _local(tag: str) -> str:
+    # "{名前空間}Item" → "Item"
+    return tag.rsplit("}", 1)[-1]
+
+
+def _child(elem: ET.Element, *path: str) -> Optional[ET.Element]:
+    for name in path:
+        if elem is None:
+            return None
+        elem = next((c for c in elem if _local(c.tag) == name), None)
+    return elem
+
+
+def _child_text(elem: ET.Element, *path: str) -> Optional[str]:
+    found = _child(elem, *path)
+    if found is None or found.text is None:
+        return None
+    return found.text.strip() or None
+
+
+async def stream_xml(chunks: AsyncIterator[bytes], tags: Iterable[str], on_element: Callable[[ET.Element], None]) -> None:
+    """XMLを受信しながら解析し、tagsの要素が閉じるたびに on_element を呼んで破棄する（文書全体の木を作らない）"""
+    tags = set(tags)
+    parser = ET.XMLPullParser(events=("start", "end"))
+    stack: List[ET.Element] = []
+
+    def drain() -> None:
+        for event, elem in parser.read_events():
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            if _local(elem.tag) in tags:
+                on_element(elem)
+                if stack:
+                    stack[-1].remove(elem)
+
+    async for chunk in chunks:
+        parser.feed(chunk)
+        drain()
+    parser.close()
+    drain()
+
+
+def parse_tsunami_area(elem: ET.Element) -> Optional[TsunamiArea]:
+    """津波予報の Item（旧形式の TsunamiArea も可）を TsunamiArea にする。予報以外のItemはNone"""
+    name = _child_text(elem, "Area", "Name") or _child_text(elem, "Name")
+    category = _child_text(elem, "Category", "Kind", "Name") or _child_text(elem, "Category", "Name")
+    # 観測・推定のItemや見出しのItemには警報の種類が無い
+    if not name or not category:
+        return None
+    grade = None
+    max_height = _child(elem, "MaxHeight")
+    if max_height is not None:
+        height = _child(max_height, "TsunamiHeight")
+        if height is not None:
+            grade = height.get("description") or (height.text or "").strip() or None
+        grade = grade or _child_text(max_height, "Value") or _child_text(max_height, "Condition")
+    return TsunamiArea(
+        name=name,
+        code=_child_text(elem, "Area", "Code") or _child_text(elem, "Code"),
+        category=category,
+        grade=grade or "不明",
+    )
+
+
+class TsunamiReport:
+    """1件の津波警報・注意報の電文（解析済み）。都道府県ごとの該当区域も取り込み時に作っておく"""
+
+    def __init__(self, link: str, title: str, updated: Optional[str], areas: List[TsunamiArea], prefectures: Iterable[str]):
+        self.link = link
+        self.title = title
+        self.updated = updated
+        self.areas = areas
+        self.by_prefecture: Dict[str, List[TsunamiArea]] = {}
+        for prefecture in prefectures:
+            names = set(TSUNAMI_AREA_ALIASES.get(prefecture, ()))
+            matched = [area for area in areas if prefecture in area.name or area.name in names]
+            if matched:
+                self.by_prefecture[prefecture] = matched
+
+
+class TsunamiFeedPoller(FeedPoller):
+    """気象庁XMLの地震火山フィードを定期取得し、最新の津波警報電文を1回だけ取得・解析して保持する"""
+
+    name = "tsunami"
+
+    def __init__(self, client: httpx.AsyncClient, prefectures: Iterable[str], interval: float = 60.0, max_reports: int = 20):
+        super().__init__(interval)
+        self.client = client
+        self.prefectures = list(prefectures)
+        self.max_reports = max_reports
+        self.current: Optional[TsunamiReport] = None
+        # 電文のURL → 解析結果（同じ電文を再取得しない）
+        self._reports: "OrderedDict[str, TsunamiReport]" = OrderedDict()
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self.polls = 0
+        self.feed_fetches = 0
+        self.not_modified = 0
+        self.report_fetches = 0
+        self.errors = 0
+        self.last_poll_at: Optional[float] = None
+
+    async def _stream(self, url: str, headers: dict, tags: Iterable[str], on_element: Callable[[ET.Element], None]) -> Tuple[bool, httpx.Headers]:
+        """GETして受信しながら解析する。304ならFalse"""
+        async with self.client.stream("GET", url, headers={**JMA_XML_HEADERS, **headers}) as res:
+            if res.status_code == 304:
+                return False, res.headers
+            res.raise_for_status()
+            await stream_xml(res.aiter_bytes(), tags, on_element)
+            return True, res.headers
+
+    async def fetch_feed(self) -> Optional[Tuple[List[FeedItem], Tuple[Optional[str], Optional[str]]]]:
+        """フィードの項目（新しい順）と (ETag, Last-Modified)。前回から変化が無ければNone
+
+        ETag等はここでは保存しない。電文の取得に失敗したまま保存すると、次の周期は304になって取り直せないため、
+        呼び出し側が電文まで取り込めた後に commit_validators() する。
+        """
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        items: List[FeedItem] = []
+
+        def on_entry(elem: ET.Element) -> None:
+            link = _child(elem, "link")
+            items.append(FeedItem(
+                id=_child_text(elem, "id"),
+                title=_child_text(elem, "title") or "",
+                updated=_child_text(elem, "updated"),
+                link=link.get("href") if link is not None else None,
+            ))
+
+        modified, headers = await self._stream(JMA_EQVOL_FEED_URL, headers, ("entry",), on_entry)
+        if not modified:
+            self.not_modified += 1
+            return None
+        self.feed_fetches += 1
+        items.sort(key=lambda item: item.updated or "", reverse=True)
+        return items, (headers.get("etag"), headers.get("last-modified"))
+
+    def commit_validators(self, validators: Tuple[Optional[str], Optional[str]]) -> None:
+        self._etag, self._last_modified = validators
+
+    async def fetch_report(self, item: FeedItem) -> TsunamiReport:
+        cached = self._reports.get(item.link)
+        if cached is not None:
+            self._reports.move_to_end(item.link)
+            return cached
+        areas: List[TsunamiArea] = []
+
+        def on_area(elem: ET.Element) -> None:
+            area = parse_tsunami_area(elem)
+            if area is not None:
+                areas.append(area)
+
+        # 電文は一度出たら変わらないので条件付きGETは使わない
+        await self._stream(item.link, {}, ("Item", "TsunamiArea"), on_area)
+        self.report_fetches += 1
+        report = TsunamiReport(item.link, item.title, item.updated, areas, self.prefectures)
+        self._reports[item.link] = report
+        while len(self._reports) > self.max_reports:
+            self._reports.popitem(last=False)
+        logger.info("Tsunami report parsed: %s (%s), %d areas", item.title, item.updated, len(areas))
+        return report
+
+    async def poll(self) -> None:
+        self.polls += 1
+        try:
+            feed = await self.fetch_feed()
+            if feed is not None:
+                items, validators = feed
+                latest = next((item for item in items if "津波警報" in item.title and item.link), None)
+                self.current = await self.fetch_report(latest) if latest is not None else None
+                self.commit_validators(validators)
+        except (httpx.HTTPError, ET.ParseError):
+            self.errors += 1
+            raise
+        self._loaded = True
+        self.last_poll_at = time.time()
+
+    async def ensure_loaded(self) -> None:
+        """起動直後などでまだ1度も取得できていなければ取りに行く"""
+        async with self._load_lock:
+            if not self._loaded:
+                await self.poll()
+
+    def areas_for(self, prefecture: str) -> List[TsunamiArea]:
+        if self.current is None:
+            return []
+        return self.current.by_prefecture.get(prefecture, [])
+
+    def metrics(self) -> dict:
+        now = time.time()
+        return {
+            "current_report": self.current.link if self.current else None,
+            "current_areas": len(self.current.areas) if self.current else 0,
+            "cached_reports": len(self._reports),
+            "interval": self.interval,
+            "polls": self.polls,
+            "feed_fetches": self.feed_fetches,
+            "not_modified": self.not_modified,
+            "report_fetches": self.report_fetches,
+            "errors": self.errors,
+            "last_poll_age_seconds": round(now - self.last_poll_at, 1) if self.last_poll_at else None,
+        }
@@ -0,0 +1,134 @@
+import logging
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 気象庁の警報・注意報コード（kind.name が無い場合の表示名）
+WARNING_KIND_NAMES = {
+    "02": "暴風雪警報",
+    "03": "大雨警報",
+    "04": "洪水警報",
+    "05": "暴風警報",
+    "06": "大雪警報",
+    "07": "波浪警報",
+    "08": "高潮警報",
+    "10": "大雨注意報",
+    "12": "大雪注意報",
+    "13": "風雪注意報",
+    "14": "雷注意報",
+    "15": "強風注意報",
+    "16": "波浪注意報",
+    "17": "融雪注意報",
+    "18": "洪水注意報",
+    "19": "高潮注意報",
+    "20": "濃霧注意報",
+    "21": "乾燥注意報",
+    "22": "なだれ注意報",
+    "23": "低温注意報",
+    "24": "霜注意報",
+    "25": "着氷注意報",
+    "26": "着雪注意報",
+    "27": "その他の注意報",
+    "32": "暴風雪特別警報",
+    "33": "大雨特別警報",
+    "35": "暴風特別警報",
+    "36": "大雪特別警報",
+    "37": "波浪特別警報",
+    "38": "高潮特別警報",
+}
+
+# 発表中として扱わない状態
+INACTIVE_STATUSES = ("解除", "発表警報・注意報はなし")
+
+# level: areaTypesの順（0=一次細分区域, 1=市町村等）
+WarningItem = namedtuple("WarningItem", ["office", "area_code", "area", "level", "kind_code", "kind", "status", "issued", "active"])
+
+
+class OfficeWarnings:
+    """1府県予報区分の警報・注意報。取り込み時に1回だけ展開し、地域・種別・発表中かで引けるようにする"""
+
+    def __init__(self, office: str, report_datetime: Optional[str], items: List[WarningItem]):
+        self.office = office
+        self.report_datetime = report_datetime
+        self.items = items
+        self.active = [item for item in items if item.active]
+        self.by_area: Dict[str, List[WarningItem]] = {}
+        self.by_kind: Dict[str, List[WarningItem]] = {}
+        # 発表中のもの（区域の階層ごと）
+        self.active_by_level: Dict[int, List[WarningItem]] = {}
+        for item in self.active:
+            self.active_by_level.setdefault(item.level, []).append(item)
+        for item in items:
+            self.by_area.setdefault(item.area_code, []).append(item)
+            for key in {item.kind_code, item.kind} - {None, ""}:
+                self.by_kind.setdefault(key, []).append(item)
+
+    def query(self, kinds: Optional[Iterable[str]] = None, area_codes: Optional[Iterable[str]] = None,
+              level: Optional[int] = None, include_inactive: bool = False) -> List[WarningItem]:
+        """kinds は種別コード（"03"）または名称（"大雨警報"）"""
+        if kinds is None and area_codes is None and level is not None and not include_inactive:
+            return self.active_by_level.get(level, [])
+        if area_codes is not None:
+            items = [item for code in area_codes for item in self.by_area.get(code, ())]
+            if kinds is not None:
+                kinds = set(kinds)
+                items = [item for item in items if item.kind_code in kinds or item.kind in kinds]
+        elif kinds is not None:
+            items = list(dict.fromkeys(item for kind in kinds for item in self.by_kind.get(kind, ())))
+        else:
+            items = self.items if include_inactive else self.active
+        if level is not None:
+            items = [item for item in items if item.level == level]
+        if not include_inactive:
+            items = [item for item in items if item.active]
+        return items
+
+
+def parse_warning_document(office: str, doc: dict) -> OfficeWarnings:
+    report_datetime = doc.get("reportDatetime")
+    items: List[WarningItem] = []
+    for level, area_type in enumerate(doc.get("areaTypes", [])):
+        for area in area_type.get("areas", []):
+            area_code = str(area.get("code", ""))
+            area_name = area.get("name") or area_code
+            for warn in area.get("warnings", []):
+                kind_code = str(warn.get("code", "")) or None
+                kind = warn.get("kind", {}).get("name") or WARNING_KIND_NAMES.get(kind_code, "")
+                status = warn.get("status", "")
+                items.append(WarningItem(
+                    office=office,
+                    area_code=area_code,
+                    area=area_name,
+                    level=level,
+                    kind_code=kind_code,
+                    kind=kind,
+                    status=status,
+                    issued=warn.get("issued") or report_datetime or "",
+                    active=status not in INACTIVE_STATUSES,
+                ))
+    return OfficeWarnings(office, report_datetime, items)
+
+
+class WarningIndex:
+    """府県予報区コード → OfficeWarnings"""
+
+    def __init__(self):
+        self._offices: Dict[str, OfficeWarnings] = {}
+
+    def __len__(self) -> int:
+        return len(self._offices)
+
+    def __contains__(self, office: str) -> bool:
+        return office in self._offices
+
+    def update(self, office: str, doc: dict) -> OfficeWarnings:
+        warnings = parse_warning_document(office, doc)
+        self._offices[office] = warnings
+        return warnings
+
+    def get(self, office: str) -> Optional[OfficeWarnings]:
+        return self._offices.get(office)
+
+    def active_count(self) -> int:
+        return sum(len(warnings.active) for warnings in self._offices.values())
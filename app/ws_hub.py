@@ -0,0 +1,303 @@
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
+
+from spatial import BoundingBoxIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _prefecture_key(name: str) -> str:
+    # 「東京」「東京都」どちらの指定でも一致させる（北海道はそのまま）
+    name = name.strip()
+    if len(name) > 2 and name[-1] in "都府県":
+        return name[:-1]
+    return name
+
+
+class Subscription:
+    """クライアントの購読条件（いずれかに一致する避難所の更新のみ届ける。条件なしは全件）"""
+
+    def __init__(
+        self,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        prefectures: Iterable[str] = (),
+        company_ids: Iterable[int] = (),
+    ):
+        self.bbox = bbox  # (min_lat, min_lon, max_lat, max_lon)
+        self.prefectures: Set[str] = {_prefecture_key(p) for p in prefectures if p.strip()}
+        self.company_ids: Set[int] = set(company_ids)
+
+    @property
+    def is_all(self) -> bool:
+        return self.bbox is None and not self.prefectures and not self.company_ids
+
+    @classmethod
+    def from_params(cls, params: Mapping) -> "Subscription":
+        """クエリ文字列またはsubscribeメッセージから作る。不正な値はValueError
+
+        bbox: "西経度,南緯度,東経度,北緯度"（LeafletのtoBBoxString()と同じ順）
+        prefecture / company_id: カンマ区切りで複数指定可
+        """
+        bbox = None
+        raw_bbox = params.get("bbox")
+        if raw_bbox:
+            values = raw_bbox if isinstance(raw_bbox, (list, tuple)) else str(raw_bbox).split(",")
+            if len(values) != 4:
+                raise ValueError("bbox must be west,south,east,north")
+            west, south, east, north = (float(v) for v in values)
+            if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+                raise ValueError("bbox is out of range")
+            bbox = (south, west, north, east)
+        return cls(
+            bbox=bbox,
+            prefectures=cls._split(params.get("prefecture")),
+            company_ids=[int(v) for v in cls._split(params.get("company_id"))],
+        )
+
+    @staticmethod
+    def _split(value) -> List[str]:
+        if value is None or value == "":
+            return []
+        if isinstance(value, (list, tuple)):
+            return [str(v) for v in value]
+        return [v for v in str(value).split(",") if v.strip()]
+
+    def to_dict(self) -> dict:
+        return {
+            "bbox": [self.bbox[1], self.bbox[0], self.bbox[3], self.bbox[2]] if self.bbox else None,
+            "prefecture": sorted(self.prefectures),
+            "company_id": sorted(self.company_ids),
+        }
+
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, queue_size: int, subscription: Subscription):
+        self.id = str(uuid.uuid4())
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.subscription = subscription
+        self.seq = 0  # このクライアントへ送った更新の通し番号（欠番で取りこぼしを検知させる）
+        self.connected_at = time.time()
+        self.last_seen = time.monotonic()
+        self.dropped = 0  # 最後に送信できてから捨てた件数
+        self.closing = False
+
+
+class ConnectionHub:
+    """WebSocketクライアントの登録・送信キュー・ハートビートを管理する"""
+
+    def __init__(
+        self,
+        queue_size: int = 100,
+        max_drops: int = 500,
+        heartbeat_interval: float = 30.0,
+        heartbeat_timeout: float = 90.0,
+        send_timeout: float = 10.0,
+    ):
+        self.queue_size = queue_size
+        self.max_drops = max_drops
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.send_timeout = send_timeout
+        self.clients: Dict[str, ClientConnection] = {}
+        # 購読条件ごとの索引（更新ごとに全クライアントの条件を走査しない）
+        self._subscribe_all: Set[str] = set()
+        self._by_company: Dict[int, Set[str]] = {}
+        self._by_prefecture: Dict[str, Set[str]] = {}
+        self._by_bbox = BoundingBoxIndex()
+        self._closing_tasks: Set[asyncio.Task] = set()  # 遅いクライアントの切断（完了まで参照を持つ）
+        self.messages_published = 0
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self.slow_disconnects = 0
+        self.messages_filtered = 0  # 購読条件に一致せず送らなかった件数（クライアント単位）
+
+    def subscribe(self, conn: ClientConnection, subscription: Subscription) -> None:
+        self._unsubscribe(conn)
+        conn.subscription = subscription
+        if subscription.is_all:
+            self._subscribe_all.add(conn.id)
+            return
+        for company_id in subscription.company_ids:
+            self._by_company.setdefault(company_id, set()).add(conn.id)
+        for prefecture in subscription.prefectures:
+            self._by_prefecture.setdefault(prefecture, set()).add(conn.id)
+        if subscription.bbox is not None:
+            self._by_bbox.add(conn.id, subscription.bbox)
+
+    def _unsubscribe(self, conn: ClientConnection) -> None:
+        self._subscribe_all.discard(conn.id)
+        for index, keys in ((self._by_company, conn.subscription.company_ids), (self._by_prefecture, conn.subscription.prefectures)):
+            for key in keys:
+                bucket = index.get(key)
+                if bucket is not None:
+                    bucket.discard(conn.id)
+                    if not bucket:
+                        del index[key]
+        self._by_bbox.remove(conn.id)
+
+    def _recipients(self, targets: List[dict]) -> Set[str]:
+        ids = set(self._subscribe_all)
+        for target in targets:
+            ids |= self._by_company.get(target.get("company_id"), set())
+            if target.get("prefecture"):
+                ids |= self._by_prefecture.get(_prefecture_key(target["prefecture"]), set())
+            if target.get("latitude") is not None and target.get("longitude") is not None:
+                ids |= self._by_bbox.containing(target["latitude"], target["longitude"])
+        return ids
+
+    def publish(self, message: dict, targets: Optional[List[dict]] = None) -> int:
+        """購読条件に一致するクライアントの送信キューへ積む（送信は各クライアントのタスクが並行して行う）
+
+        targets: 変更された避難所の位置・company_id・prefecture（省略時は全クライアントへ送る）
+        """
+        if targets is None:
+            recipients = list(self.clients.values())
+        else:
+            recipients = [self.clients[cid] for cid in self._recipients(targets) if cid in self.clients]
+        # 本文は1回だけシリアライズし、クライアントごとの通し番号を先頭に差し込む
+        body = json.dumps(message, ensure_ascii=False, default=str)[1:]
+        self.messages_published += 1
+        delivered = 0
+        for conn in recipients:
+            if conn.closing:
+                continue
+            conn.seq += 1
+            text = f'{{"seq":{conn.seq},' + body if body != "}" else f'{{"seq":{conn.seq}}}'
+            if self._enqueue(conn, text):
+                delivered += 1
+        self.messages_filtered += len(self.clients) - len(recipients)
+        return delivered
+
+    def _enqueue(self, conn: ClientConnection, text: str) -> bool:
+        if conn.closing:
+            return False
+        try:
+            conn.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            # 遅いクライアントは古いメッセージから捨てる。捨てすぎたら切断して再接続させる
+            conn.queue.get_nowait()
+            conn.queue.put_nowait(text)
+            conn.dropped += 1
+            self.messages_dropped += 1
+            if conn.dropped >= self.max_drops:
+                logger.warning("Disconnecting slow WebSocket client: %s (dropped=%d)", conn.id, conn.dropped)
+                self.slow_disconnects += 1
+                conn.closing = True
+                task = asyncio.ensure_future(self._close(conn, code=1013))
+                self._closing_tasks.add(task)
+                task.add_done_callback(self._close_done)
+            return True
+
+    def _close_done(self, task: asyncio.Task) -> None:
+        self._closing_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to disconnect slow WebSocket client: %s", str(task.exception()))
+
+    async def serve(self, websocket: WebSocket) -> None:
+        try:
+            subscription = Subscription.from_params(websocket.query_params)
+        except ValueError as e:
+            logger.info("Rejecting WebSocket with invalid subscription: %s", str(e))
+            await websocket.close(code=1008)
+            return
+        await websocket.accept()
+        conn = ClientConnection(websocket, self.queue_size, subscription)
+        # 接続時点の通し番号と購読条件を知らせる（以降の更新はseq+1から届く）
+        self._enqueue(conn, json.dumps({"type": "hello", "seq": conn.seq, "subscription": subscription.to_dict()}, ensure_ascii=False))
+        self.clients[conn.id] = conn
+        self.subscribe(conn, subscription)
+        logger.info("WebSocket connected: %s (clients=%d)", conn.id, len(self.clients))
+        sender = asyncio.create_task(self._sender(conn))
+        heartbeat = asyncio.create_task(self._heartbeat(conn))
+        try:
+            while True:
+                text = await websocket.receive_text()
+                conn.last_seen = time.monotonic()
+                self.handle_message(conn, text)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error("WebSocket receive error: %s: %s", conn.id, str(e))
+        finally:
+            sender.cancel()
+            heartbeat.cancel()
+            self.clients.pop(conn.id, None)
+            self._unsubscribe(conn)
+            logger.info("WebSocket disconnected: %s (clients=%d)", conn.id, len(self.clients))
+
+    def handle_message(self, conn: ClientConnection, text: str) -> None:
+        # pongは受信自体が生存確認になる。subscribeで購読条件を切り替える
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(data, dict) or data.get("type") != "subscribe":
+            return
+        try:
+            subscription = Subscription.from_params(data)
+        except (TypeError, ValueError) as e:
+            self._enqueue(conn, json.dumps({"type": "error", "detail": f"invalid subscription: {e}"}))
+            return
+        self.subscribe(conn, subscription)
+        logger.info("WebSocket subscription changed: %s %s", conn.id, subscription.to_dict())
+        self._enqueue(conn, json.dumps({"type": "subscribed", "seq": conn.seq, "subscription": subscription.to_dict()}, ensure_ascii=False))
+
+    async def _sender(self, conn: ClientConnection) -> None:
+        try:
+            while True:
+                text = await conn.queue.get()
+                await asyncio.wait_for(conn.websocket.send_text(text), timeout=self.send_timeout)
+                self.messages_sent += 1
+                conn.dropped = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info("WebSocket send failed: %s: %s", conn.id, str(e) or type(e).__name__)
+            await self._close(conn)
+
+    async def _heartbeat(self, conn: ClientConnection) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if time.monotonic() - conn.last_seen > self.heartbeat_timeout:
+                logger.info("WebSocket heartbeat timeout: %s", conn.id)
+                await self._close(conn)
+                return
+            self._enqueue(conn, json.dumps({"type": "ping", "ts": int(time.time())}))
+
+    async def _close(self, conn: ClientConnection, code: int = 1000) -> None:
+        conn.closing = True
+        self.clients.pop(conn.id, None)
+        self._unsubscribe(conn)
+        if conn.websocket.application_state == WebSocketState.CONNECTED:
+            try:
+                await conn.websocket.close(code=code)
+            except Exception:
+                pass
+
+    def metrics(self) -> dict:
+        depths = [conn.queue.qsize() for conn in self.clients.values()]
+        return {
+            "connected_clients": len(self.clients),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths) if depths else 0,
+            "queue_size": self.queue_size,
+            "messages_published": self.messages_published,
+            "messages_sent": self.messages_sent,
+            "messages_dropped": self.messages_dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "messages_filtered": self.messages_filtered,
+            "subscriptions": {
+                "all": len(self._subscribe_all),
+                "bbox": len(self._by_bbox),
+                "company": sum(len(ids) for ids in self._by_company.values()),
+                "prefecture": sum(len(ids) for ids in self._by_prefecture.values()),
+            },
+        }
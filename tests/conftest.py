@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.insert(0, APP_DIR)
+
+# main.py は読み込み時に環境変数を検証するため、テスト用の値を先に入れておく
+_TMP_DIR = tempfile.mkdtemp(prefix="safeshelter-test-")
+os.environ.setdefault("YAHOO_APPID", "test")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("REG_PASS", "test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP_DIR, 'test.db')}")
+os.environ.setdefault("PHOTO_STORAGE_DIR", os.path.join(_TMP_DIR, "photos"))
+os.environ.setdefault("BROADCAST_BACKEND", "memory")
+
+
+@pytest.fixture(scope="session")
+def main_module():
+    import main
+
+    # 気象庁へのポーリングはテストでは起動しない
+    for poller in (main.warning_poller, main.quake_poller, main.tsunami_poller):
+        poller.start = lambda: None
+    main.warning_poller.cache_path = None
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(main_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(main_module.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    res = client.post("/api/company-token", data={"username": "admin@example.com", "password": "admin123"})
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
@@ -0,0 +1,20 @@
+def test_remote_prefecture_lookups_are_capped(client, main_module, monkeypatch):
+    calls = []
+
+    async def fake_resolve(lat, lon):
+        calls.append((lat, lon))
+        return None
+
+    monkeypatch.setattr(main_module, "resolve_prefecture", fake_resolve)
+    monkeypatch.setattr(main_module, "ALERT_QUERY_MAX_REMOTE_LOOKUPS", 3)
+    # 境界データの外（太平洋上）の地点。先頭2つは同じ格子
+    points = [{"lat": 30.001, "lon": 150.001}, {"lat": 30.002, "lon": 150.002}]
+    points += [{"lat": 30.0 + i * 0.1, "lon": 151.0} for i in range(10)]
+
+    res = client.post("/api/alerts/query", json={"points": points})
+
+    assert res.status_code == 200
+    results = res.json()["results"]
+    assert len(calls) == 4  # 同じ格子の2地点 + 別の格子2つ
+    assert [r.get("error") is not None for r in results] == [False] * 4 + [True] * 8
+    assert all(r["prefecture"] is None for r in results)
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import sys
+
+import pytest
+
+from broadcast import WORKER_ID, BroadcastBackend, InProcessBroadcast, LocalSocketBroadcast, PostgresBroadcast
+from ws_hub import ClientConnection, Subscription
+
+
+def test_backend_is_abstract():
+    class Incomplete(BroadcastBackend):
+        async def start(self, on_message):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_in_process_broadcast_delivers_to_self():
+    received = []
+
+    async def scenario():
+        backend = InProcessBroadcast()
+        await backend.start(lambda message, from_self: received.append((message, from_self)))
+        await backend.publish({"action": "update", "shelter_id": 1})
+        await backend.stop()
+
+    asyncio.run(scenario())
+
+    assert received == [({"action": "update", "shelter_id": 1}, True)]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="UNIX domain sockets only")
+def test_local_socket_broadcast_reaches_every_worker(tmp_path):
+    received = {"a": [], "b": []}
+
+    async def scenario():
+        a = LocalSocketBroadcast(str(tmp_path), worker_id="a")
+        b = LocalSocketBroadcast(str(tmp_path), worker_id="b")
+        await a.start(lambda message, from_self: received["a"].append((message, from_self)))
+        await b.start(lambda message, from_self: received["b"].append((message, from_self)))
+        # 終了したワーカーのソケットが残っていても配信は続ける
+        (tmp_path / "dead.sock").touch()
+        await a.publish({"action": "delete", "shelter_id": 5})
+        for _ in range(50):
+            if received["a"] and received["b"]:
+                break
+            await asyncio.sleep(0.01)
+        await a.stop()
+        await b.stop()
+
+    asyncio.run(scenario())
+
+    assert received["a"] == [({"action": "delete", "shelter_id": 5}, True)]
+    assert received["b"] == [({"action": "delete", "shelter_id": 5}, False)]
+    assert list(tmp_path.iterdir()) == []
+
+
+class FakeWebSocket:
+    application_state = None
+
+
+def test_handle_broadcast_fans_out_and_updates_caches(main_module):
+    main = main_module
+    hub = main.ws_hub
+
+    async def scenario():
+        near = ClientConnection(FakeWebSocket(), 10, Subscription(bbox=(40.0, 130.0, 41.0, 131.0)))
+        far = ClientConnection(FakeWebSocket(), 10, Subscription(bbox=(30.0, 120.0, 31.0, 121.0)))
+        for conn in (near, far):
+            hub.clients[conn.id] = conn
+            hub.subscribe(conn, conn.subscription)
+        try:
+            backend = InProcessBroadcast()
+            await backend.start(main.handle_broadcast)
+            generation = main.shelter_snapshot._generation
+            # 他ワーカーで作成された避難所（from_self=False）
+            main.handle_broadcast({
+                "action": "create",
+                "shelter_id": 9001,
+                "version": 10,
+                "shelter": {"id": 9001, "latitude": 40.5, "longitude": 130.5},
+                "targets": [{"latitude": 40.5, "longitude": 130.5, "company_id": None, "prefecture": None}],
+            }, False)
+            invalidated = main.shelter_snapshot._generation > generation
+            return near, far, invalidated
+        finally:
+            for conn in (near, far):
+                hub.clients.pop(conn.id, None)
+                hub._unsubscribe(conn)
+
+    near, far, invalidated = asyncio.run(scenario())
+
+    assert invalidated
+    assert 9001 in dict(main.shelter_index.iter_nearest(40.5, 130.5, 1))
+    main.shelter_index.remove(9001)
+    message = json.loads(near.queue.get_nowait())
+    assert message["action"] == "create" and message["shelter_id"] == 9001
+    assert "targets" not in message
+    assert far.queue.empty()
+
+
+class FailingEngine:
+    def begin(self):
+        raise RuntimeError("database unavailable")
+
+
+class FakeNotify:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class FakeListenConnection:
+    def __init__(self, notifies):
+        self.notifies = notifies
+
+    def poll(self):
+        pass
+
+
+def test_postgres_broadcast_delivers_locally_even_if_notify_fails():
+    received = []
+    backend = PostgresBroadcast(FailingEngine())
+    backend._on_message = lambda message, from_self: received.append((dict(message), from_self))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(backend.publish({"action": "update", "shelter_id": 3}))
+
+    assert received == [({"action": "update", "shelter_id": 3}, True)]
+
+
+def test_postgres_broadcast_ignores_own_notifications():
+    received = []
+    backend = PostgresBroadcast(FailingEngine())
+    backend._on_message = lambda message, from_self: received.append((message, from_self))
+    backend._conn = FakeListenConnection([
+        FakeNotify(json.dumps({"origin": WORKER_ID, "data": {"shelter_id": 1}})),
+        FakeNotify(json.dumps({"origin": "other-worker", "data": {"shelter_id": 2}})),
+    ])
+
+    backend._on_readable()
+
+    assert received == [({"shelter_id": 2}, False)]
@@ -0,0 +1,168 @@
+import io
+from datetime import datetime, timedelta
+
+
+def test_reset_cursor_is_not_zero_on_fresh_feed(client):
+    first = client.get("/api/shelters/changes", params={"since": 0}).json()
+    assert first["reset"] is True
+    assert first["cursor"] > 0
+
+    # 全件を受け取った後は差分の問い合わせになる（毎回全件を返さない）
+    second = client.get("/api/shelters/changes", params={"since": first["cursor"]}).json()
+    assert second["reset"] is False
+    assert second["deleted"] == []
+
+
+def test_cursor_ahead_of_server_resets(client, main_module):
+    with main_module.SessionLocal() as db:
+        latest = main_module.current_shelter_version(db)
+
+    data = client.get("/api/shelters/changes", params={"since": latest + 1000}).json()
+
+    assert data["reset"] is True
+
+
+def test_prune_keeps_newest_change_and_ids_are_not_reused(main_module):
+    main = main_module
+    with main.SessionLocal() as db:
+        main.record_shelter_changes(db, "update", [1])
+        db.commit()
+        old = datetime.utcnow() - timedelta(days=main.SHELTER_CHANGES_RETENTION_DAYS + 1)
+        db.query(main.ShelterChangeModel).update({"changed_at": old})
+        db.commit()
+        latest = main.current_shelter_version(db)
+
+        main.prune_shelter_changes(db)
+
+        assert [change_id for (change_id,) in db.query(main.ShelterChangeModel.id)] == [latest]
+        version = main.record_shelter_changes(db, "update", [1])
+        db.commit()
+        assert version == latest + 1
+
+
+def settle_all_changes(main):
+    # 欠番を作ったテストの後始末（古い欠番はコミット済みとみなされる）
+    with main.SessionLocal() as db:
+        old = datetime.utcnow() - timedelta(seconds=main.CHANGE_FEED_SETTLE_SECONDS + 60)
+        db.query(main.ShelterChangeModel).update({"changed_at": old})
+        db.commit()
+
+
+def test_versions_stop_before_recent_gap(client, main_module):
+    main = main_module
+    try:
+        with main.SessionLocal() as db:
+            pending = main.record_shelter_changes(db, "update", [1])
+            committed = main.record_shelter_changes(db, "update", [1])
+            # 番号は採番済みだがまだコミットされていない変更の代わりに消しておく
+            db.query(main.ShelterChangeModel).filter(main.ShelterChangeModel.id == pending).delete()
+            db.commit()
+            assert main.current_shelter_version(db) == committed
+            assert main.settled_shelter_version(db) == pending - 1
+
+        data = client.get("/api/shelters/changes", params={"since": pending - 1}).json()
+        assert data["reset"] is False
+        assert data["cursor"] == pending - 1
+        main.shelter_snapshot.invalidate()
+        res = client.get("/api/shelters", params={"search": "テスト"})
+        assert res.headers["X-Shelter-Version"] == str(pending - 1)
+        full = client.get("/api/shelters/changes", params={"since": 0}).json()
+        assert full["cursor"] == pending - 1
+    finally:
+        settle_all_changes(main)
+
+    with main.SessionLocal() as db:
+        assert main.settled_shelter_version(db) == committed
+
+
+def test_photo_upload_is_recorded_as_update(client, auth_headers, main_module):
+    main = main_module
+    settle_all_changes(main)
+    with main.SessionLocal() as db:
+        since = main.settled_shelter_version(db)
+    data = b"\x89PNG\r\n\x1a\n" + b"feed" * 16
+
+    res = client.post(
+        "/api/shelters/upload-photo",
+        data={"shelter_id": "1"},
+        files={"file": ("a.png", io.BytesIO(data), "image/png")},
+        headers=auth_headers,
+    )
+    assert res.status_code == 200
+
+    changes = client.get("/api/shelters/changes", params={"since": since}).json()
+    shelter = next(s for s in changes["shelters"] if s["id"] == 1)
+    assert f"/api/photos/{res.json()['ids'][0]}" in shelter["photos"]
+
+
+def test_legacy_create_is_recorded(client, auth_headers, main_module):
+    main = main_module
+    settle_all_changes(main)
+    with main.SessionLocal() as db:
+        since = main.settled_shelter_version(db)
+    token = auth_headers["Authorization"].split(" ", 1)[1]
+
+    res = client.post(
+        "/shelters",
+        json={
+            "name": "旧フォーム避難所",
+            "address": "東京都港区",
+            "latitude": 35.66,
+            "longitude": 139.75,
+            "capacity": 50,
+            "current_occupancy": 0,
+            "attributes": {"pets_allowed": True},
+            "contact": "03-0000-0000",
+            "operator": "旧フォーム運営",
+            "company_id": 0,
+        },
+        cookies={"token": token},
+    )
+    assert res.status_code == 200
+    created = res.json()
+    assert created["attributes"]["pets_allowed"] is True
+
+    changes = client.get("/api/shelters/changes", params={"since": since}).json()
+    assert created["id"] in [s["id"] for s in changes["shelters"]]
+    main.shelter_index.remove(created["id"])
+
+
+NEW_SHELTER = {
+    "name": "一括確定避難所",
+    "address": "沖縄県那覇市",
+    "latitude": 26.21,
+    "longitude": 127.68,
+    "capacity": 20,
+    "current_occupancy": 0,
+    "attributes": {},
+    "contact": "098-000-0000",
+    "operator": "test",
+    "opened_at": "2026-10-17T09:00:00",
+    "status": "open",
+    "company_id": 0,
+}
+
+
+def test_create_commits_shelter_and_change_together(client, auth_headers, main_module, monkeypatch):
+    main = main_module
+
+    def broken_record(*args, **kwargs):
+        raise RuntimeError("change log unavailable")
+
+    monkeypatch.setattr(main, "record_shelter_changes", broken_record)
+    res = client.post("/api/shelters", json=NEW_SHELTER, headers=auth_headers)
+
+    assert res.status_code == 400
+    with main.SessionLocal() as db:
+        # 変更履歴の無い避難所は残らない（差分を受けるクライアントが取りこぼさない）
+        assert db.query(main.ShelterModel).filter(main.ShelterModel.name == NEW_SHELTER["name"]).count() == 0
+
+    monkeypatch.undo()
+    settle_all_changes(main)
+    with main.SessionLocal() as db:
+        since = main.settled_shelter_version(db)
+    created = client.post("/api/shelters", json=NEW_SHELTER, headers=auth_headers).json()
+
+    changes = client.get("/api/shelters/changes", params={"since": since}).json()
+    assert created["id"] in [s["id"] for s in changes["shelters"]]
+    main.shelter_index.remove(created["id"])
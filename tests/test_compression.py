@@ -0,0 +1,107 @@
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from compression import CompressionMiddleware, accepted_encodings, is_compressible
+
+BODY = b'{"items": "' + b"x" * 4096 + b'"}'
+
+
+def make_client():
+    async def json_body(request):
+        return Response(BODY, media_type="application/json")
+
+    async def small(request):
+        return Response(b'{"ok": true}', media_type="application/json")
+
+    async def image(request):
+        return Response(BODY, media_type="image/png")
+
+    async def encoded(request):
+        return Response(gzip.compress(BODY), media_type="application/json", headers={"Content-Encoding": "gzip"})
+
+    async def stream(request):
+        async def chunks():
+            for _ in range(4):
+                yield BODY
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app = Starlette(routes=[
+        Route("/json", json_body),
+        Route("/small", small),
+        Route("/image", image),
+        Route("/encoded", encoded),
+        Route("/stream", stream),
+    ])
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+
+def get_raw(client, path, accept_encoding):
+    # TestClient(httpx)は自動で展開するため、ストリームで受けて生の本文を読む
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as res:
+        return res, b"".join(res.iter_raw())
+
+
+def test_accepted_encodings_ignores_q_zero():
+    assert accepted_encodings("gzip, br;q=0, deflate;q=0.5") == {"gzip", "deflate"}
+    assert accepted_encodings("") == set()
+    assert accepted_encodings("GZIP;q=0.0") == set()
+
+
+def test_is_compressible():
+    assert is_compressible("application/json; charset=utf-8")
+    assert is_compressible("text/html")
+    assert not is_compressible("text/event-stream")
+    assert not is_compressible("image/png")
+
+
+def test_gzip_when_accepted():
+    res, raw = get_raw(make_client(), "/json", "gzip")
+
+    assert res.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in res.headers["vary"]
+    assert int(res.headers["content-length"]) == len(raw)
+    assert gzip.decompress(raw) == BODY
+
+
+def test_brotli_preferred_when_available():
+    brotli = pytest.importorskip("brotli")
+
+    res, raw = get_raw(make_client(), "/json", "gzip, br")
+
+    assert res.headers["content-encoding"] == "br"
+    assert brotli.decompress(raw) == BODY
+
+
+@pytest.mark.parametrize("path, accept_encoding", [
+    ("/json", "identity"),
+    ("/json", "gzip;q=0"),
+    ("/small", "gzip"),
+    ("/image", "gzip"),
+])
+def test_left_uncompressed(path, accept_encoding):
+    res, raw = get_raw(make_client(), path, accept_encoding)
+
+    assert "content-encoding" not in res.headers
+    assert int(res.headers["content-length"]) == len(raw)
+
+
+def test_already_encoded_response_is_not_compressed_twice():
+    res, raw = get_raw(make_client(), "/encoded", "gzip")
+
+    assert res.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(raw) == BODY
+
+
+def test_streaming_response_is_compressed_per_chunk():
+    res, raw = get_raw(make_client(), "/stream", "gzip")
+
+    assert res.headers["content-encoding"] == "gzip"
+    assert "content-length" not in res.headers
+    assert gzip.decompress(raw) == BODY * 4
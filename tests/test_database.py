@@ -0,0 +1,29 @@
+from sqlalchemy import create_engine, inspect, text
+
+import models  # noqa: F401  テーブル定義を Base に登録する
+from database import Base, upgrade_schema
+
+
+def test_sqlite_upgrade_drops_not_null_and_keeps_rows(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        # 写真の本体をDBに持っていた頃の photos テーブル
+        conn.execute(text(
+            "CREATE TABLE photos (id INTEGER PRIMARY KEY, filename VARCHAR NOT NULL, "
+            "content_type VARCHAR NOT NULL, data BLOB NOT NULL, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO photos (id, filename, content_type, data) VALUES (1, 'a.jpg', 'image/jpeg', x'ffd8')"))
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+    inspector = inspect(engine)
+    columns = {c["name"]: c for c in inspector.get_columns("photos")}
+    assert columns["data"]["nullable"]
+    assert "storage_key" in columns
+    assert "ix_photos_storage_key" in {index["name"] for index in inspector.get_indexes("photos")}
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT filename, data FROM photos")).all() == [("a.jpg", b"\xff\xd8")]
+        conn.execute(text("INSERT INTO photos (filename, content_type, storage_key) VALUES ('b.png', 'image/png', 'k')"))
+    # 2回目は何もしない
+    upgrade_schema(engine)
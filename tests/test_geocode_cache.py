@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from geocode_cache import ReverseGeocodeCache
+
+
+def test_concurrent_lookups_share_one_fetch():
+    calls = []
+
+    async def fetch(lat, lon):
+        calls.append((lat, lon))
+        await asyncio.sleep(0.01)
+        return {"address": "東京都千代田区"}
+
+    async def scenario():
+        cache = ReverseGeocodeCache(grid_deg=0.01)
+        # 同じ格子内の異なる地点
+        results = await asyncio.gather(*(cache.get(35.681 + i * 0.001, 139.767, fetch) for i in range(5)))
+        again = await cache.get(35.6815, 139.7675, fetch)
+        return cache, results, again
+
+    cache, results, again = asyncio.run(scenario())
+
+    assert calls == [(35.685, 139.765)]
+    assert all(result == {"address": "東京都千代田区"} for result in results)
+    assert again == results[0]
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 4, 1)
+
+
+def test_cancelled_leader_does_not_fail_waiters():
+    async def fetch(lat, lon):
+        await asyncio.sleep(0.02)
+        return {"address": "大阪府大阪市"}
+
+    async def scenario():
+        cache = ReverseGeocodeCache()
+        leader = asyncio.ensure_future(cache.get(34.69, 135.50, fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cache.get(34.69, 135.50, fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return leader, await follower, cache
+
+    leader, result, cache = asyncio.run(scenario())
+
+    assert leader.cancelled()
+    assert result == {"address": "大阪府大阪市"}
+    assert len(cache) == 1
+
+
+def test_failures_are_not_cached():
+    attempts = []
+
+    async def fetch(lat, lon):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("upstream down")
+        return {"address": "北海道札幌市"}
+
+    async def scenario():
+        cache = ReverseGeocodeCache()
+        with pytest.raises(RuntimeError):
+            await cache.get(43.06, 141.35, fetch)
+        return cache, await cache.get(43.06, 141.35, fetch)
+
+    cache, result = asyncio.run(scenario())
+
+    assert result == {"address": "北海道札幌市"}
+    assert cache.errors == 1
+    assert cache.metrics()["inflight"] == 0
+
+
+def test_oldest_entries_are_evicted():
+    async def fetch(lat, lon):
+        return {"lat": lat}
+
+    async def scenario():
+        cache = ReverseGeocodeCache(max_entries=2)
+        for lat in (10.0, 20.0, 30.0):
+            await cache.get(lat, 100.0, fetch)
+        return cache
+
+    cache = asyncio.run(scenario())
+
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    assert cache.key(10.0, 100.0) not in cache._entries
@@ -0,0 +1,51 @@
+import asyncio
+
+import httpx
+
+from http_clients import UpstreamStats, _MeteredTransport
+
+
+def test_server_errors_count_as_errors():
+    stats = UpstreamStats()
+    codes = iter([200, 404, 503])
+
+    async def handler(request):
+        return httpx.Response(next(codes))
+
+    async def scenario():
+        transport = _MeteredTransport(httpx.MockTransport(handler), stats)
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(3):
+                await client.get("https://www.jma.go.jp/")
+
+    asyncio.run(scenario())
+
+    data = stats.to_dict()
+    assert data["requests"] == 3
+    assert data["errors"] == 1
+    assert data["status"] == {"2xx": 1, "4xx": 1, "5xx": 1}
+
+
+def test_transport_exceptions_count_as_errors():
+    stats = UpstreamStats()
+    stats.record(0.5, error=httpx.ReadTimeout("timed out"))
+
+    assert (stats.errors, stats.timeouts, stats.status) == (1, 1, {})
+
+
+def test_proxy_only_allows_known_hosts(client, main_module, monkeypatch):
+    used = []
+
+    async def handler(request):
+        return httpx.Response(200, json={"ok": True})
+
+    mock = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main_module.http_clients, "get", lambda name: used.append(name) or mock)
+
+    assert client.get("/api/proxy", params={"url": "https://example.com/data.json"}).status_code == 400
+    assert client.get("/api/proxy", params={"url": "http://www.jma.go.jp/bosai/x.json"}).status_code == 400
+    res = client.get("/api/proxy", params={"url": "https://www.jma.go.jp/bosai/common/const/area.json"})
+
+    assert res.json() == {"ok": True}
+    # 上流ホストごとのクライアント（接続数制限）を使う
+    assert used == ["jma"]
@@ -0,0 +1,53 @@
+import asyncio
+import json
+import os
+
+import httpx
+
+from jma_feeds import WarningFeedPoller
+
+
+def test_stop_cancels_inflight_refreshes():
+    started = asyncio.Event()
+
+    async def handler(request):
+        started.set()
+        await asyncio.sleep(10)
+        return httpx.Response(200, json={})
+
+    async def scenario():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        poller = WarningFeedPoller(client, ["130000"], cache_path=None)
+        request = asyncio.ensure_future(poller.get("130000"))
+        await started.wait()
+        inflight = list(poller._inflight.values())
+        await poller.stop()
+        await client.aclose()
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+        return inflight, poller
+
+    inflight, poller = asyncio.run(scenario())
+
+    assert inflight and all(task.cancelled() for task in inflight)
+    assert poller._inflight == {}
+
+
+def test_cache_is_written_atomically_and_reloaded(tmp_path):
+    cache_path = str(tmp_path / "alerts_cache.json")
+
+    async def handler(request):
+        return httpx.Response(200, json={"reportDatetime": "2026-10-17T10:00:00+09:00"}, headers={"ETag": '"v1"'})
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            poller = WarningFeedPoller(client, ["130000"], cache_path=cache_path)
+            await poller.refresh_all()
+
+    asyncio.run(scenario())
+
+    assert os.listdir(tmp_path) == ["alerts_cache.json"]
+    with open(cache_path, encoding="utf-8") as f:
+        assert json.load(f)["offices"]["130000"]["etag"] == '"v1"'
+    reloaded = WarningFeedPoller(None, ["130000"], cache_path=cache_path)
+    assert reloaded.load_cache() == 1
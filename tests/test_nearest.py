@@ -0,0 +1,56 @@
+from datetime import datetime
+
+from sqlalchemy import event
+
+
+def add_shelters(main, rows):
+    with main.SessionLocal() as db:
+        shelters = [
+            main.ShelterModel(
+                name=f"nearest-{i}", address="北海道札幌市", latitude=lat, longitude=lon,
+                capacity=100, current_occupancy=0, operator="test", opened_at=datetime.utcnow(),
+                status="open", pets_allowed=pets,
+            )
+            for i, (lat, lon, pets) in enumerate(rows)
+        ]
+        db.add_all(shelters)
+        db.commit()
+        ids = [shelter.id for shelter in shelters]
+    main.shelter_index.invalidate()
+    return ids
+
+
+def count_shelter_selects(main):
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM shelters" in statement:
+            statements.append(statement)
+
+    event.listen(main.engine, "before_cursor_execute", before_execute)
+    return statements, lambda: event.remove(main.engine, "before_cursor_execute", before_execute)
+
+
+def test_nearest_returns_closest_matching(client, main_module):
+    ids = add_shelters(main_module, [(43.0 + i * 0.001, 141.0, i % 2 == 0) for i in range(20)])
+
+    res = client.get("/api/shelters/nearest", params={"latitude": 43.0, "longitude": 141.0, "k": 3, "pets_allowed": True})
+
+    assert res.status_code == 200
+    assert [item["id"] for item in res.json()] == [ids[0], ids[2], ids[4]]
+
+
+def test_nearest_with_no_match_uses_few_queries(client, main_module):
+    add_shelters(main_module, [(44.0 + i * 0.0005, 142.0, False) for i in range(600)])
+    statements, stop = count_shelter_selects(main_module)
+    try:
+        res = client.get("/api/shelters/nearest", params={
+            "latitude": 44.0, "longitude": 142.0, "k": 5, "min_available": 10 ** 6,
+        })
+    finally:
+        stop()
+
+    assert res.status_code == 200
+    assert res.json() == []
+    # バッチを倍々に広げるので、全件を走査しても問い合わせは数回で済む
+    assert len([s for s in statements if " IN (" in s]) <= 6
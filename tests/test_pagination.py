@@ -0,0 +1,58 @@
+from test_nearest import add_shelters
+
+
+def collect_pages(client, params):
+    pages = []
+    cursor = None
+    while True:
+        res = client.get("/api/shelters", params=dict(params, **({"cursor": cursor} if cursor else {})))
+        assert res.status_code == 200
+        assert "X-Shelter-Version" in res.headers
+        pages.append(res.json())
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+def test_keyset_pages_cover_every_row_once(client, main_module):
+    ids = add_shelters(main_module, [(26.0 + i * 0.001, 127.7, False) for i in range(7)])
+
+    pages = collect_pages(client, {"search": "nearest-", "status": "open", "limit": 3, "fields": "name"})
+
+    seen = [item["id"] for page in pages for item in page]
+    assert seen == sorted(seen)
+    assert set(ids) <= set(seen)
+    assert all(len(page) <= 3 for page in pages)
+    # 指定した項目とidだけを返す
+    assert set(pages[0][0]) == {"id", "name"}
+
+
+def test_rows_added_between_pages_are_not_duplicated(client, main_module):
+    add_shelters(main_module, [(26.1 + i * 0.001, 127.7, False) for i in range(4)])
+    params = {"search": "nearest-", "limit": 2}
+    first = client.get("/api/shelters", params=params)
+    cursor = first.headers["X-Next-Cursor"]
+
+    # ページの間に先頭側へ行が増えても、キーセットなので続きがずれない
+    add_shelters(main_module, [(26.2, 127.7, False)])
+    second = client.get("/api/shelters", params=dict(params, cursor=cursor))
+
+    first_ids = [item["id"] for item in first.json()]
+    second_ids = [item["id"] for item in second.json()]
+    assert not set(first_ids) & set(second_ids)
+    assert min(second_ids) > max(first_ids)
+
+
+def test_distance_pages_follow_distance_order(client, main_module):
+    ids = add_shelters(main_module, [(27.0 + i * 0.001, 128.0, False) for i in reversed(range(5))])
+
+    pages = collect_pages(client, {"latitude": 27.0, "longitude": 128.0, "distance": 2, "limit": 2})
+
+    seen = [item["id"] for page in pages for item in page]
+    assert seen == list(reversed(ids))
+    assert [len(page) for page in pages] == [2, 2, 1]
+
+
+def test_invalid_cursor_and_fields_are_rejected(client):
+    assert client.get("/api/shelters", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/api/shelters", params={"limit": 1, "fields": "password"}).status_code == 400
@@ -0,0 +1,70 @@
+import io
+import os
+import time
+
+import pytest
+
+from photo_store import LocalPhotoStore, PhotoStore, PhotoTooLarge, UnsupportedPhotoType
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+def test_photo_store_is_abstract():
+    class Incomplete(PhotoStore):
+        def save(self, data):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_save_stream_deduplicates_and_validates(tmp_path):
+    store = LocalPhotoStore(str(tmp_path))
+    first = store.save_stream(io.BytesIO(PNG), max_size=1024)
+    second = store.save_stream(io.BytesIO(PNG), max_size=1024)
+
+    assert first.key == second.key
+    assert first.content_type == "image/png"
+    assert store.read(first.key) == PNG
+    with pytest.raises(PhotoTooLarge):
+        store.save_stream(io.BytesIO(PNG), max_size=10)
+    with pytest.raises(UnsupportedPhotoType):
+        store.save_stream(io.BytesIO(b"plain text"), max_size=1024)
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_delete_skips_recently_reused_file(tmp_path):
+    store = LocalPhotoStore(str(tmp_path))
+    stored = store.save_stream(io.BytesIO(PNG), max_size=1024)
+    path = store.path(stored.key)
+    os.utime(path, (time.time() - 3600, time.time() - 3600))
+    deleting_at = time.time() - 60
+
+    # 削除の確認より後に同じ内容がアップロードされた（更新時刻が進む）
+    store.save_stream(io.BytesIO(PNG), max_size=1024)
+
+    assert store.delete(stored.key, touched_before=deleting_at) is False
+    assert store.read(stored.key) == PNG
+    assert [name for name in os.listdir(os.path.dirname(path)) if ".deleting-" in name] == []
+
+
+def test_delete_removes_untouched_file(tmp_path):
+    store = LocalPhotoStore(str(tmp_path))
+    stored = store.save_stream(io.BytesIO(PNG), max_size=1024)
+    store.save_variant(stored.key, "w200.webp", b"variant")
+
+    assert store.delete(stored.key, touched_before=time.time() + 1) is True
+    assert store.path(stored.key) is None
+    assert store.variant_path(stored.key, "w200.webp") is None
+
+
+def test_upload_during_delete_rewrites_file(tmp_path):
+    store = LocalPhotoStore(str(tmp_path))
+    stored = store.save_stream(io.BytesIO(PNG), max_size=1024)
+    path = store.path(stored.key)
+    # 削除側が退避した直後（本体が無い間）のアップロードは自分で書き直す
+    os.replace(path, path + ".deleting-test")
+
+    store.save_stream(io.BytesIO(PNG), max_size=1024)
+
+    assert store.read(stored.key) == PNG
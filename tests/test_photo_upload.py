@@ -0,0 +1,48 @@
+import io
+import os
+import hashlib
+
+
+def fake_png(tag: bytes) -> bytes:
+    # 形式の判定は先頭バイトだけなので、中身は任意でよい
+    return b"\x89PNG\r\n\x1a\n" + hashlib.sha256(tag).digest() * 4
+
+
+def test_failed_commit_removes_stored_file(client, auth_headers, main_module, monkeypatch):
+    data = fake_png(b"failed-commit")
+    key = hashlib.sha256(data).hexdigest()
+
+    def broken_link(*args, **kwargs):
+        raise RuntimeError("link failed")
+
+    monkeypatch.setattr(main_module, "link_photos", broken_link)
+    res = client.post(
+        "/api/shelters/upload-photo",
+        data={"shelter_id": "1"},
+        files={"file": ("a.png", io.BytesIO(data), "image/png")},
+        headers=auth_headers,
+    )
+
+    assert res.status_code == 500
+    assert main_module.photo_store.path(key) is None
+
+
+def test_failed_commit_keeps_file_used_by_other_photo(client, auth_headers, main_module, monkeypatch):
+    data = fake_png(b"shared")
+    key = hashlib.sha256(data).hexdigest()
+    res = client.post("/api/photos/upload", files={"file": ("a.png", io.BytesIO(data), "image/png")}, headers=auth_headers)
+    assert res.status_code == 200
+
+    def broken_link(*args, **kwargs):
+        raise RuntimeError("link failed")
+
+    monkeypatch.setattr(main_module, "link_photos", broken_link)
+    res = client.post(
+        "/api/shelters/upload-photos",
+        data={"shelter_id": "1"},
+        files=[("files", ("b.png", io.BytesIO(data), "image/png"))],
+        headers=auth_headers,
+    )
+
+    assert res.status_code == 500
+    assert os.path.exists(main_module.photo_store.path(key))
@@ -0,0 +1,56 @@
+import io
+
+import pytest
+
+from photo_variants import VariantFailures, variants_available
+
+BROKEN_JPEG = b"\xff\xd8\xff\xe0" + b"not really a jpeg" * 10
+
+
+def test_variant_failures_expire(monkeypatch):
+    failures = VariantFailures(ttl_seconds=10, max_entries=2)
+    now = [100.0]
+    monkeypatch.setattr("photo_variants.time.monotonic", lambda: now[0])
+
+    failures.add("a", "w200.webp")
+    assert failures.is_failed("a", "w200.webp")
+    assert not failures.is_failed("a", "w200.jpeg")
+
+    now[0] += 11
+    assert not failures.is_failed("a", "w200.webp")
+    assert len(failures) == 0
+
+
+def test_variant_failures_are_bounded():
+    failures = VariantFailures(max_entries=2)
+    for key in ("a", "b", "c"):
+        failures.add(key, "w200.webp")
+    assert len(failures) == 2
+    assert not failures.is_failed("a", "w200.webp")
+
+
+@pytest.mark.skipif(not variants_available(), reason="Pillow is not installed")
+def test_broken_original_is_rendered_once(client, auth_headers, main_module, monkeypatch):
+    res = client.post(
+        "/api/photos/upload",
+        files={"file": ("broken.jpg", io.BytesIO(BROKEN_JPEG), "image/jpeg")},
+        headers=auth_headers,
+    )
+    assert res.status_code == 200
+    photo_id = res.json()["ids"][0]
+
+    calls = []
+    render = main_module.render_variant
+
+    def counting_render(*args):
+        calls.append(args[1:])
+        return render(*args)
+
+    monkeypatch.setattr(main_module, "render_variant", counting_render)
+    for _ in range(3):
+        res = client.get(f"/api/photos/{photo_id}", params={"size": "thumb", "format": "jpeg"})
+        # 縮小版が作れなくても原本を返す
+        assert res.status_code == 200
+        assert res.content == BROKEN_JPEG
+
+    assert len(calls) == 1
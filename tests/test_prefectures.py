@@ -0,0 +1,48 @@
+from prefectures import PrefectureIndex
+
+# 経度, 緯度の正方形2つ（東西に隣接）
+PREFECTURES = [
+    {"code": "90", "name": "西県", "polygons": [[[140.0, 35.0], [141.0, 35.0], [141.0, 36.0], [140.0, 36.0]]]},
+    {"code": "91", "name": "東県", "polygons": [[[141.0, 35.0], [142.0, 35.0], [142.0, 36.0], [141.0, 36.0]]]},
+]
+
+
+def test_lookup_inside_polygon():
+    index = PrefectureIndex(PREFECTURES)
+
+    assert index.lookup(35.5, 140.5) == ("90", "西県", 0.0)
+    assert index.lookup(35.5, 141.5).name == "東県"
+
+
+def test_lookup_snaps_to_nearest_within_snap_km():
+    index = PrefectureIndex(PREFECTURES, snap_km=10.0)
+
+    # 南の境界から約5.5km外側
+    match = index.lookup(34.95, 140.5)
+    assert match.code == "90"
+    assert 5.0 < match.distance_km < 6.0
+    # snap_km より遠い海上は None
+    assert index.lookup(34.5, 140.5) is None
+
+
+def test_outline_is_lat_lon_for_leaflet():
+    index = PrefectureIndex(PREFECTURES)
+
+    assert index.outline("西県")[0] == [35.0, 140.0]
+    assert index.outline("存在しない県") is None
+
+
+def test_missing_boundary_file_gives_empty_index(tmp_path):
+    index = PrefectureIndex.load(str(tmp_path / "missing.json"))
+
+    assert len(index) == 0
+    assert index.lookup(35.68, 139.76) is None
+
+
+def test_bundled_boundaries():
+    index = PrefectureIndex.load()
+
+    assert index.lookup(35.68, 139.76).name == "東京都"
+    assert index.lookup(34.69, 135.50).name == "大阪府"
+    assert index.lookup(43.06, 141.35).code == "01"
+    assert index.lookup(30.0, 150.0) is None
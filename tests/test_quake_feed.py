@@ -0,0 +1,150 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from jma_feeds import FeedPoller
+from quake_feed import QuakeFeedPoller, QuakeHistory, parse_quake
+
+JST = timezone(timedelta(hours=9))
+
+
+def jst(seconds_ago: float) -> str:
+    return datetime.fromtimestamp(time.time() - seconds_ago, JST).isoformat(timespec="seconds")
+
+
+def item(eid, seconds_ago, **fields):
+    base = {"eid": eid, "at": jst(seconds_ago), "rdt": jst(seconds_ago - 60)}
+    base.update(fields)
+    return base
+
+
+def test_parse_quake_reads_coordinates_and_scale():
+    quake = parse_quake(item("1", 60, cod="+35.7+140.1-30000/", maxi="5+", mag="4.8", anm="千葉県北西部"))
+
+    assert (quake.latitude, quake.longitude, quake.depth_km) == (35.7, 140.1, 30.0)
+    assert (quake.max_scale, quake.magnitude, quake.place) == (50, 4.8, "千葉県北西部")
+    assert parse_quake({"eid": "2"}) is None
+    assert parse_quake(item("3", 60, mag="Ｍ不明")).magnitude is None
+
+
+def test_followup_reports_merge_without_losing_fields():
+    history = QuakeHistory()
+    history.ingest([item("1", 600, maxi="3", rdt=jst(590))])
+    changed = history.ingest([item("1", 600, cod="+35.7+140.1-10000/", mag="4.1", rdt=jst(500))])
+
+    (quake, _), = history.query()
+    assert changed == 1 and len(history) == 1
+    assert quake.max_scale == 30  # 続報に震度が無くても残る
+    assert quake.magnitude == 4.1
+    # 同じ内容は変更に数えない
+    assert history.ingest([item("1", 600, cod="+35.7+140.1-10000/", mag="4.1", rdt=jst(500))]) == 0
+
+
+def test_events_older_than_max_age_are_not_reingested():
+    history = QuakeHistory(max_age_seconds=3600)
+    items = [item("old", 7200, maxi="4"), item("new", 60, maxi="1")]
+
+    assert history.ingest(items) == 1
+    # 一覧に残っている古い地震を毎回入れ直さない
+    assert history.ingest(items) == 0
+    assert [quake.event_id for quake, _ in history.query()] == ["new"]
+
+
+def test_query_filters_newest_first():
+    history = QuakeHistory()
+    history.ingest([
+        item("a", 3000, maxi="1", cod="+35.0+135.0/"),
+        item("b", 2000, maxi="5-", cod="+43.0+141.0/"),
+        item("c", 1000, maxi="3", cod="+35.1+135.1/"),
+    ])
+
+    assert [q.event_id for q, _ in history.query()] == ["c", "b", "a"]
+    assert [q.event_id for q, _ in history.query(since=time.time() - 2500)] == ["c", "b"]
+    assert [q.event_id for q, _ in history.query(min_scale=30)] == ["c", "b"]
+    near = history.query(lat=35.0, lon=135.0, radius_km=50)
+    assert [q.event_id for q, _ in near] == ["c", "a"]
+    assert near[1][1] == pytest.approx(0.0)
+    assert len(history.query(limit=1)) == 1
+
+
+def test_history_keeps_only_max_events():
+    history = QuakeHistory(max_events=2)
+    history.ingest([item(str(i), 1000 - i) for i in range(4)])
+
+    assert [q.event_id for q, _ in history.query()] == ["3", "2"]
+
+
+def test_feed_poller_is_abstract():
+    class Incomplete(FeedPoller):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(60)
+
+
+def test_ensure_loaded_refreshes_stale_list_and_serves_stale_on_failure():
+    responses = [httpx.Response(200, json=[item("1", 60)]), httpx.Response(200, json=[item("1", 60), item("2", 30)])]
+
+    async def handler(request):
+        if not responses:
+            return httpx.Response(503)
+        return responses.pop(0)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            poller = QuakeFeedPoller(client, stale_after=600)
+            await poller.ensure_loaded()
+            await poller.ensure_loaded()  # 新しいうちは取りに行かない
+            loaded = len(poller.history)
+            poller.last_poll_at -= 601
+            await poller.ensure_loaded()
+            refreshed = len(poller.history)
+            poller.last_poll_at -= 601
+            await poller.ensure_loaded()  # 503 でも古い履歴で答える
+            return loaded, refreshed, poller
+
+    loaded, refreshed, poller = asyncio.run(scenario())
+
+    assert (loaded, refreshed) == (1, 2)
+    assert poller.polls == 3 and poller.errors == 1
+
+
+def test_naive_since_is_japan_time(client, main_module):
+    history = main_module.quake_poller.history
+    history.ingest([item("jst-test", 30 * 60)])
+    main_module.quake_poller.last_poll_at = time.time()
+    main_module.quake_poller._digest = main_module.quake_poller._digest or "test"
+    # 日本時間で1時間前（UTCとみなすと9時間先になり、何も返らない）
+    since = datetime.now(JST).replace(tzinfo=None) - timedelta(hours=1)
+
+    res = client.get("/api/quake-alerts", params={"since": since.isoformat(timespec="seconds")})
+
+    assert "jst-test" in [quake["event_id"] for quake in res.json()["quakes"]]
+
+
+def test_validators_are_kept_only_after_successful_ingest():
+    seen = []
+    responses = [
+        httpx.Response(200, content=b"<html>maintenance</html>", headers={"ETag": '"broken"'}),
+        httpx.Response(200, json=[item("1", 60)], headers={"ETag": '"good"'}),
+    ]
+
+    async def handler(request):
+        seen.append(request.headers.get("if-none-match"))
+        return responses.pop(0)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            poller = QuakeFeedPoller(client)
+            with pytest.raises(ValueError):
+                await poller.poll()
+            return await poller.poll(), poller
+
+    changed, poller = asyncio.run(scenario())
+
+    # 壊れた本文のETagで条件付き取得しないので、次の取得で取り込み直せる
+    assert seen == [None, None]
+    assert changed == 1 and len(poller.history) == 1
@@ -0,0 +1,18 @@
+from test_nearest import add_shelters
+
+
+def test_radius_search_returns_shelters_in_range(client, main_module, monkeypatch):
+    ids = add_shelters(main_module, [(24.3 + i * 0.01, 124.1, False) for i in range(5)] + [(25.5, 124.1, False)])
+    # IN句の分割を通す
+    monkeypatch.setattr(main_module, "SHELTER_ID_BATCH", 2)
+
+    res = client.get("/api/shelters", params={"latitude": 24.3, "longitude": 124.1, "distance": 10})
+
+    assert res.status_code == 200
+    assert sorted(item["id"] for item in res.json()) == ids[:5]
+
+
+def test_radius_search_rejects_too_wide_distance(client):
+    res = client.get("/api/shelters", params={"latitude": 35, "longitude": 139, "distance": 2000000})
+
+    assert res.status_code == 422
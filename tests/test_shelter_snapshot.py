@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from shelter_snapshot import ShelterSnapshot
+
+
+def test_snapshot_is_rebuilt_when_latest_change_moves():
+    snapshot = ShelterSnapshot(ttl_seconds=60)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return [{"id": len(builds)}], len(builds)
+
+    first = snapshot.get(build, latest=5)
+    assert snapshot.get(build, latest=5) is first
+    second = snapshot.get(build, latest=6)
+
+    assert second is not first
+    assert second.items == [{"id": 2}]
+    assert snapshot.builds == 2 and snapshot.hits == 1
+
+
+def test_write_without_broadcast_is_served(client, main_module):
+    main = main_module
+    client.get("/api/shelters")
+    # 配信を経由しない書き込み（別プロセスからの更新など）
+    with main.SessionLocal() as db:
+        shelter = main.ShelterModel(
+            name="配信なし避難所", address="沖縄県那覇市", latitude=26.2, longitude=127.68,
+            capacity=10, current_occupancy=0, operator="test", opened_at=datetime.utcnow(), status="open",
+        )
+        db.add(shelter)
+        db.flush()
+        main.record_shelter_changes(db, "create", [shelter.id])
+        db.commit()
+        shelter_id = shelter.id
+
+    res = client.get("/api/shelters")
+
+    assert shelter_id in [item["id"] for item in res.json()]
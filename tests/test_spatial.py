@@ -0,0 +1,67 @@
+import random
+
+from spatial import ShelterGridIndex, haversine
+
+
+def build_index(points):
+    index = ShelterGridIndex(cell_size_deg=0.1)
+    index.rebuild((i, lat, lon) for i, (lat, lon) in enumerate(points))
+    return index
+
+
+def random_points(n, seed=1):
+    rng = random.Random(seed)
+    return [(35.0 + rng.uniform(-1.5, 1.5), 139.0 + rng.uniform(-1.5, 1.5)) for _ in range(n)]
+
+
+def test_iter_nearest_matches_brute_force_order():
+    points = random_points(500)
+    index = build_index(points)
+    lat, lon = 35.2, 139.3
+    expected = sorted((haversine(lat, lon, p[0], p[1]), i) for i, p in enumerate(points))
+
+    result = list(index.iter_nearest(lat, lon))
+
+    assert [shelter_id for shelter_id, _ in result] == [i for _, i in expected]
+    distances = [dist for _, dist in result]
+    assert distances == sorted(distances)
+
+
+def test_iter_nearest_stops_at_max_distance():
+    points = random_points(300, seed=2)
+    index = build_index(points)
+    lat, lon = 35.0, 139.0
+
+    result = list(index.iter_nearest(lat, lon, max_distance_km=20))
+
+    inside = {i for i, p in enumerate(points) if haversine(lat, lon, p[0], p[1]) <= 20}
+    assert {shelter_id for shelter_id, _ in result} == inside
+    assert all(dist <= 20 for _, dist in result)
+
+
+def test_iter_nearest_is_lazy_and_skips_removed():
+    points = random_points(200, seed=3)
+    index = build_index(points)
+    index.remove(0)
+    index.upsert(1, 35.0, 139.0)
+
+    first_id, first_dist = next(index.iter_nearest(35.0, 139.0))
+
+    assert first_id == 1 and first_dist == 0
+    assert 0 not in {shelter_id for shelter_id, _ in index.iter_nearest(35.0, 139.0)}
+
+
+def test_iter_nearest_empty_index():
+    assert list(ShelterGridIndex().iter_nearest(35.0, 139.0)) == []
+
+
+def test_within_matches_brute_force_for_small_and_wide_radius():
+    points = random_points(200)
+    index = build_index(points)
+
+    # 20km はセルを走査し、500km は登録点を直接判定する
+    for radius in (20.0, 500.0):
+        expected = {i for i, (lat, lon) in enumerate(points) if haversine(35.0, 139.0, lat, lon) <= radius}
+        found = index.within(35.0, 139.0, radius)
+        assert set(found) == expected
+        assert all(abs(found[i] - haversine(35.0, 139.0, *points[i])) < 1e-9 for i in found)
@@ -0,0 +1,94 @@
+import asyncio
+import xml.etree.ElementTree as ET
+
+import httpx
+
+from tsunami_feed import JMA_EQVOL_FEED_URL, TsunamiFeedPoller, parse_tsunami_area, stream_xml
+
+NS = "http://xml.kishou.go.jp/jmaxml1/body/seismology1/"
+REPORT = f"""<?xml version="1.0" encoding="UTF-8"?>
+<Report xmlns="http://xml.kishou.go.jp/jmaxml1/"><Body xmlns="{NS}"><Tsunami><Forecast>
+<Item><Area><Name>宮城県</Name><Code>220</Code></Area>
+<Category><Kind><Name>大津波警報</Name></Kind></Category>
+<MaxHeight><TsunamiHeight xmlns="http://xml.kishou.go.jp/jmaxml1/elementBasis1/" description="１０ｍ超">10</TsunamiHeight></MaxHeight></Item>
+<Item><Area><Name>東京湾内湾</Name><Code>300</Code></Area>
+<Category><Kind><Name>津波注意報</Name></Kind></Category>
+<MaxHeight><Condition>高い</Condition></MaxHeight></Item>
+<Item><Area><Name>観測点</Name></Area></Item>
+</Forecast></Tsunami></Body></Report>""".encode()
+
+FEED = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<entry><id>a</id><title>津波警報・注意報・予報a</title>
+<updated>2026-10-17T01:00:00Z</updated><link href="https://example.jp/report.xml"/></entry>
+<entry><id>b</id><title>震源・震度に関する情報</title>
+<updated>2026-10-17T00:59:00Z</updated><link href="https://example.jp/other.xml"/></entry>
+</feed>""".encode()
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_stream_xml_handles_split_chunks_and_releases_elements():
+    seen = []
+
+    async def scenario():
+        await stream_xml(chunked(REPORT, 7), ["Item", "Forecast"], lambda elem: seen.append((elem.tag.rsplit("}", 1)[-1], len(elem))))
+
+    asyncio.run(scenario())
+
+    # 処理済みのItemは親から外されている
+    assert seen[:3] == [("Item", 3), ("Item", 3), ("Item", 1)]
+    assert seen[3] == ("Forecast", 0)
+
+
+def test_parse_tsunami_area_forms():
+    areas = []
+
+    async def scenario():
+        await stream_xml(chunked(REPORT, 4096), ["Item"], lambda elem: areas.append(parse_tsunami_area(elem)))
+
+    asyncio.run(scenario())
+
+    assert areas[0] == ("宮城県", "220", "大津波警報", "１０ｍ超")
+    assert areas[1] == ("東京湾内湾", "300", "津波注意報", "高い")
+    assert areas[2] is None
+    # 旧形式（TsunamiArea 直下に Name/Category）
+    old = ET.fromstring("<TsunamiArea><Name>高知県</Name><Code>390</Code><Category><Name>津波警報</Name></Category></TsunamiArea>")
+    assert parse_tsunami_area(old) == ("高知県", "390", "津波警報", "不明")
+
+
+def test_validators_are_kept_until_the_report_is_parsed():
+    feed_headers = []
+    report_failures = [True]
+
+    async def handler(request):
+        if str(request.url) == JMA_EQVOL_FEED_URL:
+            feed_headers.append(request.headers.get("if-none-match"))
+            if request.headers.get("if-none-match") == '"feed-1"':
+                return httpx.Response(304)
+            return httpx.Response(200, content=FEED, headers={"ETag": '"feed-1"'})
+        if report_failures and report_failures.pop():
+            return httpx.Response(503)
+        return httpx.Response(200, content=REPORT)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            poller = TsunamiFeedPoller(client, ["宮城県", "東京都", "大阪府"])
+            try:
+                await poller.poll()
+            except httpx.HTTPError:
+                pass
+            # 電文の取得に失敗した周期のETagは使わず、次の周期で取り直す
+            await poller.poll()
+            await poller.poll()
+            return poller
+
+    poller = asyncio.run(scenario())
+
+    assert feed_headers == [None, None, '"feed-1"']
+    assert poller.errors == 1 and poller.not_modified == 1
+    assert [area.name for area in poller.areas_for("東京都")] == ["東京湾内湾"]
+    assert poller.areas_for("大阪府") == []
@@ -0,0 +1,63 @@
+from warning_index import WarningIndex, parse_warning_document
+
+DOC = {
+    "reportDatetime": "2026-10-17T10:00:00+09:00",
+    "areaTypes": [
+        {"areas": [
+            {"code": "130010", "name": "東京地方", "warnings": [
+                {"code": "03", "status": "発表"},
+                {"code": "14", "status": "継続", "kind": {"name": "雷注意報"}},
+                {"code": "15", "status": "解除"},
+            ]},
+        ]},
+        {"areas": [
+            {"code": "1310100", "warnings": [
+                {"code": "03", "status": "発表", "issued": "2026-10-17T09:30:00+09:00"},
+            ]},
+            {"code": "1310200", "name": "中央区", "warnings": [
+                {"status": "発表警報・注意報はなし"},
+            ]},
+        ]},
+    ],
+}
+
+
+def test_items_are_expanded_with_levels_and_names():
+    warnings = parse_warning_document("130000", DOC)
+
+    first = warnings.items[0]
+    assert (first.area_code, first.area, first.level, first.kind_code, first.kind) == ("130010", "東京地方", 0, "03", "大雨警報")
+    assert first.issued == DOC["reportDatetime"]
+    assert warnings.items[1].kind == "雷注意報"
+    city = warnings.items[3]
+    # 名前が無い区域はコードで表示し、個別の発表時刻を優先する
+    assert (city.area, city.level, city.issued) == ("1310100", 1, "2026-10-17T09:30:00+09:00")
+    assert warnings.items[4].kind_code is None
+
+
+def test_lifted_and_none_statuses_are_inactive():
+    warnings = parse_warning_document("130000", DOC)
+
+    assert [item.status for item in warnings.items if not item.active] == ["解除", "発表警報・注意報はなし"]
+    assert len(warnings.active) == 3
+
+
+def test_query_by_kind_area_and_level():
+    warnings = parse_warning_document("130000", DOC)
+
+    assert [item.area_code for item in warnings.query(kinds=["大雨警報"])] == ["130010", "1310100"]
+    assert warnings.query(kinds=["03"]) == warnings.query(kinds=["大雨警報"])
+    assert [item.kind for item in warnings.query(area_codes=["130010"])] == ["大雨警報", "雷注意報"]
+    assert len(warnings.query(area_codes=["130010"], include_inactive=True)) == 3
+    assert [item.area_code for item in warnings.query(level=1)] == ["1310100"]
+    assert warnings.query(kinds=["15"]) == []
+
+
+def test_empty_document_and_index():
+    index = WarningIndex()
+    empty = index.update("010000", {})
+
+    assert empty.items == [] and empty.report_datetime is None
+    assert "010000" in index and index.get("999999") is None
+    index.update("130000", DOC)
+    assert index.active_count() == 3
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+from starlette.websockets import WebSocketState
+
+from ws_hub import ClientConnection, ConnectionHub, Subscription
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.application_state = WebSocketState.CONNECTED
+        self.closed_with = None
+
+    async def close(self, code=1000):
+        self.closed_with = code
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+def connect(hub, subscription=None):
+    conn = ClientConnection(FakeWebSocket(), hub.queue_size, subscription or Subscription())
+    hub.clients[conn.id] = conn
+    hub.subscribe(conn, conn.subscription)
+    return conn
+
+
+def drain(conn):
+    messages = []
+    while not conn.queue.empty():
+        messages.append(json.loads(conn.queue.get_nowait()))
+    return messages
+
+
+def test_full_queue_drops_oldest_messages():
+    async def scenario():
+        hub = ConnectionHub(queue_size=3, max_drops=100)
+        conn = connect(hub)
+        for i in range(5):
+            hub.publish({"action": "update", "n": i})
+        return hub, conn
+
+    hub, conn = asyncio.run(scenario())
+
+    messages = drain(conn)
+    assert [m["n"] for m in messages] == [2, 3, 4]
+    # 捨てた分も通し番号は進むので、クライアントは欠番から取りこぼしを検知できる
+    assert [m["seq"] for m in messages] == [3, 4, 5]
+    assert conn.dropped == 2
+    assert hub.messages_dropped == 2
+    assert not conn.closing
+
+
+def test_slow_client_is_disconnected_after_max_drops():
+    async def scenario():
+        hub = ConnectionHub(queue_size=2, max_drops=3)
+        slow = connect(hub)
+        fast = connect(hub)
+        for i in range(5):
+            hub.publish({"n": i})
+            drain(fast)
+        assert len(hub._closing_tasks) == 1  # 完了までは参照を持つ
+        await asyncio.sleep(0)  # 切断タスクを走らせる
+        return hub, slow, fast
+
+    hub, slow, fast = asyncio.run(scenario())
+
+    assert slow.closing
+    assert slow.websocket.closed_with == 1013
+    assert slow.id not in hub.clients
+    assert fast.id in hub.clients and not fast.closing
+    assert hub.slow_disconnects == 1
+    assert hub._closing_tasks == set()
+    # 切断済みのクライアントにはもう積まない
+    assert hub.publish({"n": 99}) == 1
+
+
+def test_publish_routes_by_subscription():
+    async def scenario():
+        hub = ConnectionHub()
+        tokyo = connect(hub, Subscription(prefectures=["東京"]))
+        company = connect(hub, Subscription(company_ids=[7]))
+        area = connect(hub, Subscription(bbox=(35.0, 139.0, 36.0, 140.0)))
+        everyone = connect(hub)
+        delivered = hub.publish({"action": "update"}, [{"latitude": 35.5, "longitude": 139.5, "company_id": 1, "prefecture": "東京都"}])
+        return hub, delivered, tokyo, company, area, everyone
+
+    hub, delivered, tokyo, company, area, everyone = asyncio.run(scenario())
+
+    assert delivered == 3
+    assert len(drain(tokyo)) == 1
+    assert drain(company) == []
+    assert len(drain(area)) == 1
+    assert len(drain(everyone)) == 1